@@ -2,44 +2,74 @@ import os
 import glob
 import time
 import json
-import RPi.GPIO as GPIO
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import paho.mqtt.client as mqtt
+from status_codec import ENCODINGS, StatusRecord, encode as encode_status, encode_binary, encode_batch
+from spool import Spool
+
+# SCADA_SIMULATE=1 swaps in the simulator's GPIO backend so this script runs
+# off the Pi (see simulator/).
+if os.getenv("SCADA_SIMULATE"):
+    from simulator import fake_gpio as GPIO
+else:
+    import RPi.GPIO as GPIO
 
 # Config
 LED_PINS = [17, 27, 22]
 SWITCH_PINS = [23, 24]
-MQTT_BROKER = "172.20.10.3"   # change to your broker IP
-MQTT_PORT = 1883
-DEVICE_ID = "raspberry_pi_1"
-PUBLISH_INTERVAL = 5  # seconds
-
-
-# GPIO Setup
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+MQTT_BROKER = os.getenv("MQTT_BROKER", "172.20.10.3")   # change to your broker IP
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+DEVICE_ID = os.getenv("DEVICE_ID", "raspberry_pi_1")
+SAMPLE_INTERVAL = float(os.getenv("SAMPLE_INTERVAL", 5))  # seconds between samples in steady state
+# Reporting: a sample is published when the temperature moved more than
+# TEMP_DEADBAND since the last status sent, when a switch, the LEDs or the
+# set of failing sensors changed, and otherwise every HEARTBEAT_INTERVAL.
+# While the temperature changes faster than FAST_RATE, sampling speeds up to
+# FAST_SAMPLE_INTERVAL and stays there for FAST_HOLD seconds.
+TEMP_DEADBAND = float(os.getenv("TEMP_DEADBAND", 0.2))  # degrees C
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", 60))  # seconds
+FAST_SAMPLE_INTERVAL = 1.0  # seconds; one DS18B20 conversion takes ~750 ms
+FAST_RATE = float(os.getenv("FAST_RATE", 0.02))  # degrees C per second
+FAST_HOLD = 30  # seconds
+STATUS_ENCODING = os.getenv("STATUS_ENCODING", "json")  # "json" or "binary", see status_codec.py
+if STATUS_ENCODING not in ENCODINGS:
+    raise ValueError(f"STATUS_ENCODING must be one of {', '.join(ENCODINGS)}")
+W1_BASE_DIR = os.getenv("W1_BASE_DIR", '/sys/bus/w1/devices/')
+SENSOR_TIMEOUT = 2.0  # seconds before a sensor that keeps failing CRC is reported
+# Statuses that could not be published are kept here and forwarded, oldest
+# first, once the broker is back. At least a day of readings by default.
+SPOOL_PATH = os.getenv("SPOOL_PATH", "status_spool.bin")
+SPOOL_CAPACITY = int(os.getenv("SPOOL_CAPACITY", 17280))
+BACKLOG_BATCH = 100  # records per backlog message
+# Switch changes are also pushed the moment they happen, on {DEVICE_ID}/event.
+# Edges closer together than SWITCH_BOUNCE_MS are ignored and the level is
+# read again after SWITCH_SETTLE seconds, so contact bounce sends nothing.
+SWITCH_BOUNCE_MS = 50
+SWITCH_SETTLE = 0.02
+SWITCH_NAMES = {23: "switch_window", 24: "switch_someone_present"}
 
-for pin in LED_PINS:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.LOW)
-
-for pin in SWITCH_PINS:
-    GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
 # Temperature Sensor Setup
-def setup_sensor():
+def setup_sensors():
     os.system('modprobe w1-gpio')
     os.system('modprobe w1-therm')
-    base_dir = '/sys/bus/w1/devices/'
-    device_folder = glob.glob(base_dir + '28*')[0]
-    return device_folder + '/w1_slave'
+    return {
+        os.path.basename(folder): folder + '/w1_slave'
+        for folder in sorted(glob.glob(W1_BASE_DIR + '28*'))
+    }
 
 def read_temp_raw(device_file):
     with open(device_file, 'r') as f:
         return f.readlines()
 
-def read_temperature(device_file):
+def read_temperature(device_file, timeout=SENSOR_TIMEOUT):
+    deadline = time.monotonic() + timeout
     lines = read_temp_raw(device_file)
     while lines[0].strip()[-3:] != 'YES':
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"CRC check failed for {timeout}s")
         time.sleep(0.2)
         lines = read_temp_raw(device_file)
     equals_pos = lines[1].find('t=')
@@ -47,77 +77,313 @@ def read_temperature(device_file):
         return float(lines[1][equals_pos + 2:]) / 1000.0
     return None
 
-# Count LEDs that are ON
-def count_leds_on():
-    return sum(GPIO.input(pin) for pin in LED_PINS)
+def average_temperature(readings):
+    values = [value for value in readings.values() if value is not None]
+    return sum(values) / len(values) if values else None
 
-# Get switch states
-def get_switch_states():
-    return {
-        f"switch_{i+1}": "on" if GPIO.input(pin) == 0 else "off"
-        for i, pin in enumerate(SWITCH_PINS)
-    }
+class ReportPolicy:
+    """Decides which samples are published and how long to wait for the next one."""
 
-def on_message(client, userdata, msg):
-    try:
-        command = json.loads(msg.payload.decode())
-        print(command)
-        action = command.get("action")
-        pin = command.get("pin")
+    def __init__(self, deadband=TEMP_DEADBAND, heartbeat=HEARTBEAT_INTERVAL, slow=SAMPLE_INTERVAL,
+                 fast=FAST_SAMPLE_INTERVAL, fast_rate=FAST_RATE, fast_hold=FAST_HOLD):
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.slow = slow
+        self.fast = fast
+        self.fast_rate = fast_rate
+        self.fast_hold = fast_hold
+        self.last_sent = None
+        self.last_sent_at = None
+        self.samples = deque()  # (time, temperature) over the last `slow` seconds
+        self.fast_until = 0.0
 
-        if action == "turn_on_led" and pin in LED_PINS:
-           turn_on_led(pin)
+    def should_publish(self, status, now):
+        previous = self.last_sent
+        if previous is None or now - self.last_sent_at >= self.heartbeat:
+            return True
+        if (status.leds_on, status.switch_window, status.switch_someone_present) != \
+                (previous.leds_on, previous.switch_window, previous.switch_someone_present):
+            return True
+        if set(status.sensor_errors or {}) != set(previous.sensor_errors or {}):
+            return True
+        if status.temperature_c is None or previous.temperature_c is None:
+            return status.temperature_c != previous.temperature_c
+        return abs(status.temperature_c - previous.temperature_c) > self.deadband
 
-        elif action == "turn_off_led" and pin in LED_PINS:
-            turn_off_led(pin)
+    def sent(self, status, now):
+        self.last_sent = status
+        self.last_sent_at = now
 
-        else:
-            print(f"Unknown command: {command}")
+    def next_interval(self, temperature, now):
+        """Seconds until the next sample, given the one just taken."""
+        if temperature is not None:
+            self.samples.append((now, temperature))
+            # The rate is taken over at least `slow` seconds, so the sensor's
+            # 1/16 degree steps do not read as a transient at the fast rate.
+            while len(self.samples) > 1 and self.samples[1][0] <= now - self.slow:
+                self.samples.popleft()
+            then, previous = self.samples[0]
+            if now > then and abs(temperature - previous) / (now - then) >= self.fast_rate:
+                self.fast_until = now + self.fast_hold
+        return self.fast if now < self.fast_until else self.slow
 
-    except Exception as e:
-        print(f"Error handling message: {e}")
+def switch_event(device_id, levels, timestamp):
+    """Event payload: both switch states, as in a status, and when the change happened."""
+    return json.dumps({
+        "device_id": device_id,
+        **{SWITCH_NAMES[pin]: "on" if level == 0 else "off" for pin, level in levels.items()},
+        "timestamp": timestamp,
+    })
 
+class Device:
+    """One device: its sensors, switches and fans on `gpio`, reported through `client`.
 
-def turn_on_led(pin):
-    if pin not in LED_PINS:
-        raise ValueError("Invalid LED Pin")
-    GPIO.output(pin, GPIO.HIGH)
+    main() runs one against the Pi; the simulator runs many against fake GPIO
+    boards and 1-Wire trees.
+    """
 
-def turn_off_led(pin):
-    if pin not in LED_PINS:
-        raise ValueError("Invalid LED Pin")
-    GPIO.output(pin, GPIO.LOW)
+    def __init__(self, device_id, client, gpio, sensors, spool, encoding=STATUS_ENCODING, policy=None):
+        self.device_id = device_id
+        self.client = client
+        self.gpio = gpio
+        self.sensors = sensors  # sensor id -> w1_slave path
+        self.spool = spool
+        self.encoding = encoding
+        self.policy = policy or ReportPolicy()
+        # Each DS18B20 conversion takes ~750 ms, so all sensors are read in
+        # parallel and a cycle costs one conversion no matter how many are attached.
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(sensors)))
+        # Reads that outlived their cycle, by sensor. Their threads are stuck until
+        # the read returns, so the sensor is not read again (and reported failed) meanwhile.
+        self.hung_reads = {}
+        # Set when a command changed the outputs, so the next sample (and status)
+        # follows at once instead of at the next interval.
+        self.sample_now = threading.Event()
+        self.reported_levels = {}
+        self.switch_lock = threading.Lock()
+        self.switch_changed_at = None  # monotonic time of the last switch change, until the fans stop
+        self.running = False
+        client.on_message = self.on_message
+        client.on_connect = self.on_connect
 
-# MQTT Setup
-client = mqtt.Client()
-client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    def log(self, message):
+        print(message)
 
-client.on_message = on_message
-client.subscribe(f"{DEVICE_ID}/command")
-client.loop_start()
+    # GPIO Setup
+    def setup_gpio(self):
+        self.gpio.setmode(GPIO.BCM)
+        self.gpio.setwarnings(False)
 
-# Main Loop
-def main():
-    device_file = setup_sensor()
+        for pin in LED_PINS:
+            self.gpio.setup(pin, GPIO.OUT)
+            self.gpio.output(pin, GPIO.LOW)
 
-    try:
-        while True:
-            payload = {
-                "device_id": DEVICE_ID,
-                "temperature_c": read_temperature(device_file),
-                "leds_on": count_leds_on(),
-                "switches": get_switch_states(),
-                "timestamp": int(time.time())
-            }
+        for pin in SWITCH_PINS:
+            self.gpio.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            self.reported_levels[pin] = self.gpio.input(pin)
+            self.gpio.add_event_detect(pin, GPIO.BOTH, callback=self.on_switch_edge, bouncetime=SWITCH_BOUNCE_MS)
+
+    def read_all_temperatures(self):
+        deadline = time.monotonic() + SENSOR_TIMEOUT + 1
+        readings, errors, futures = {}, {}, {}
+        for sensor_id, path in self.sensors.items():
+            hung = self.hung_reads.get(sensor_id)
+            if hung is not None and not hung.done():
+                errors[sensor_id] = "timeout"
+                continue
+            self.hung_reads.pop(sensor_id, None)
+            futures[sensor_id] = self.executor.submit(read_temperature, path)
+        for sensor_id, future in futures.items():
+            try:
+                readings[sensor_id] = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeout:
+                self.hung_reads[sensor_id] = future
+                errors[sensor_id] = "timeout"
+            except Exception as e:
+                errors[sensor_id] = str(e)
+        return readings, errors
+
+    # Count LEDs that are ON
+    def count_leds_on(self):
+        return sum(self.gpio.input(pin) for pin in LED_PINS)
+
+    # Get switch states
+    def get_switch_states(self):
+        return {
+            f"switch_{i+1}": "on" if self.gpio.input(pin) == 0 else "off"
+            for i, pin in enumerate(SWITCH_PINS)
+        }
+
+    def report_switches(self, changed_at):
+        """Publish an event if the switches differ from the last ones reported."""
+        with self.switch_lock:
+            levels = {pin: self.gpio.input(pin) for pin in SWITCH_PINS}
+            if levels == self.reported_levels:
+                return False
+            # Left unreported while the broker is unreachable, so the first
+            # sample after reconnecting publishes it.
+            if self.client.is_connected():
+                info = self.client.publish(f"{self.device_id}/event",
+                                           switch_event(self.device_id, levels, changed_at), qos=1)
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.reported_levels.update(levels)
+        return True
+
+    # Runs on RPi.GPIO's event thread.
+    def on_switch_edge(self, pin):
+        changed_at = time.time()
+        edge = time.monotonic()
+        time.sleep(SWITCH_SETTLE)
+        if self.report_switches(changed_at):  # otherwise it bounced back
+            self.switch_changed_at = edge
+            self.sample_now.set()  # and a full status right behind it
+
+    def on_message(self, client, userdata, msg):
+        try:
+            command = json.loads(msg.payload.decode())
+            self.log(command)
+            action = command.get("action")
+            pin = command.get("pin")
+
+            if action == "set_speed":
+                self.set_speed(command.get("speed"))
+                self.report_stop_latency(command.get("speed"))
+
+            elif action == "turn_on_led" and pin in LED_PINS:
+                self.turn_on_led(pin)
 
-            client.publish(f"{DEVICE_ID}/status", json.dumps(payload))
+            elif action == "turn_off_led" and pin in LED_PINS:
+                self.turn_off_led(pin)
 
-            time.sleep(PUBLISH_INTERVAL)
+            else:
+                self.log(f"Unknown command: {command}")
+                return
+            self.sample_now.set()
 
+        except Exception as e:
+            self.log(f"Error handling message: {e}")
+
+    def report_stop_latency(self, speed):
+        if speed == 0 and self.switch_changed_at is not None:
+            self.log(f"Fans stopped {(time.monotonic() - self.switch_changed_at) * 1000:.0f} ms "
+                     "after the switch changed")
+        self.switch_changed_at = None
+
+    # Fan speed N lights the first N LEDs. All pins are written in one call so
+    # the fan never drops to zero on the way between two speeds.
+    def set_speed(self, speed):
+        if speed not in range(len(LED_PINS) + 1):
+            raise ValueError("Invalid speed")
+        self.gpio.output(LED_PINS, [GPIO.HIGH if i < speed else GPIO.LOW for i in range(len(LED_PINS))])
+
+    def turn_on_led(self, pin):
+        if pin not in LED_PINS:
+            raise ValueError("Invalid LED Pin")
+        self.gpio.output(pin, GPIO.HIGH)
+
+    def turn_off_led(self, pin):
+        if pin not in LED_PINS:
+            raise ValueError("Invalid LED Pin")
+        self.gpio.output(pin, GPIO.LOW)
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(f"{self.device_id}/command")
+
+    # Connects in the background and keeps reconnecting, so the device starts
+    # and keeps spooling readings while the broker is unreachable.
+    def connect(self, broker=MQTT_BROKER, port=MQTT_PORT):
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.connect_async(broker, port, 60)
+        self.client.loop_start()
+
+    def publish_status(self, status):
+        if self.client.is_connected():
+            info = self.client.publish(f"{self.device_id}/status", encode_status(status, self.encoding))
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                return
+        try:
+            self.spool.append(encode_binary(status))
+        except ValueError as e:
+            self.log(f"Status not spooled: {e}")
+
+    # Sends the backlog in batches until it is empty or the deadline passes. A
+    # batch leaves the spool only once the broker acknowledged it, and the next
+    # live reading always goes out before more backlog.
+    def forward_backlog(self, deadline):
+        while len(self.spool) and self.client.is_connected() and time.monotonic() < deadline:
+            frames, end = self.spool.peek(BACKLOG_BATCH)
+            info = self.client.publish(f"{self.device_id}/backlog", encode_batch(frames), qos=1)
+            try:
+                info.wait_for_publish(timeout=max(0.1, deadline - time.monotonic()))
+            except (RuntimeError, ValueError):
+                return
+            if not info.is_published():
+                return
+            self.spool.commit(end)
+
+    def sample(self):
+        readings, errors = self.read_all_temperatures()
+        for sensor_id, error in errors.items():
+            self.log(f"Sensor {sensor_id} read failed: {error}")
+
+        # Catches a change whose edge fell inside the bounce time.
+        self.report_switches(time.time())
+        # Stamped before the read: an edge after it carries a later
+        # event timestamp and wins over these switch states.
+        sampled_at = time.time()
+        switches = self.get_switch_states()
+        return StatusRecord(
+            device_id=self.device_id,
+            temperature_c=average_temperature(readings),
+            leds_on=self.count_leds_on(),
+            switch_window=switches["switch_1"],
+            switch_someone_present=switches["switch_2"],
+            timestamp=sampled_at,
+            sensors=readings,
+            sensor_errors=errors,
+        )
+
+    def run(self):
+        self.running = True
+        while self.running:
+            started = time.monotonic()
+            status = self.sample()
+
+            if self.policy.should_publish(status, started):
+                self.publish_status(status)
+                self.policy.sent(status, started)
+            interval = self.policy.next_interval(status.temperature_c, started)
+            self.forward_backlog(started + interval * 0.8)
+
+            self.sample_now.wait(max(0, interval - (time.monotonic() - started)))
+            self.sample_now.clear()
+
+    def stop(self):
+        self.running = False
+        self.sample_now.set()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.spool.close()
+        self.gpio.cleanup()
+
+# Main Loop
+def main():
+    sensors = setup_sensors()
+    print(f"Found {len(sensors)} temperature sensors: {', '.join(sensors)}")
+    device = Device(DEVICE_ID, mqtt.Client(), GPIO, sensors, Spool(SPOOL_PATH, SPOOL_CAPACITY))
+    if len(device.spool):
+        print(f"{len(device.spool)} spooled statuses waiting to be forwarded")
+    device.setup_gpio()
+    device.connect()
+
+    try:
+        device.run()
     except KeyboardInterrupt:
         print("Exiting...")
     finally:
-        GPIO.cleanup()
+        device.close()
 
 if __name__ == "__main__":
     main()
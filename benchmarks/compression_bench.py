@@ -0,0 +1,114 @@
+"""Historian compression ratio and reconstruction error on recorded history.
+
+Replays raw history through repository.compression.Historian and checks every
+sample against the series rebuilt from the stored points (linear between
+points for swinging door, last value held for deadband).
+
+    python -m repository.export --start -7d --out week.csv
+    python -m benchmarks.compression_bench --csv week.csv
+    python -m benchmarks.compression_bench                # a simulated day
+
+Without --csv it simulates a day of one device reporting every 5 s, with the
+DS18B20's 1/16 degree resolution, a fan switched by a thermostat and a
+window opened for ten minutes every two hours.
+"""
+import argparse
+import bisect
+import csv
+import random
+from collections import defaultdict
+
+from repository.compression import Historian, Spec, SwingingDoor, spec_from_env
+from repository.downsampling import parse_time
+
+
+def recorded(path):
+    """(measurement, device_id) -> [(t, value)] from an export CSV."""
+    series = defaultdict(list)
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            value = row["value"]
+            try:
+                value = float(value)
+            except ValueError:
+                pass  # switch state
+            series[(row["measurement"], row["device_id"] or None)].append((parse_time(row["time"]).timestamp(), value))
+    return series
+
+
+def simulated(hours=24, interval=5.0, seed=1):
+    from simulator.plant import ThermalPlant
+
+    random.seed(seed)
+    plant = ThermalPlant(temperature=24.0)
+    series = defaultdict(list)
+    speed = 0
+    for i in range(int(hours * 3600 / interval)):
+        t = i * interval
+        window_open = (t % 7200) < 600
+        temperature = round(plant.step(interval, speed, window_open) * 16) / 16
+        # A thermostat with hysteresis, so the fan does not chatter.
+        if window_open or temperature < 23.0:
+            speed = 0
+        elif temperature > 25.0:
+            speed = 2
+        series[("temperature_data", "sim")].append((t, temperature))
+        series[("windows_switch", "sim")].append((t, "off" if window_open else "on"))
+        series[("fan_speed", "sim")].append((t, speed))
+    return series
+
+
+def max_error(samples, stored, linear):
+    times = [t for t, _ in stored]
+    worst = 0.0
+    for t, value in samples:
+        i = bisect.bisect_right(times, t) - 1
+        if linear and i + 1 < len(stored) and times[i] != t:
+            (t0, v0), (t1, v1) = stored[i], stored[i + 1]
+            rebuilt = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+        else:
+            rebuilt = stored[i][1]
+        if isinstance(value, str) or isinstance(rebuilt, str):
+            worst = max(worst, 0.0 if value == rebuilt else float("inf"))
+        else:
+            worst = max(worst, abs(value - rebuilt))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=None, help="export CSV (python -m repository.export)")
+    parser.add_argument("--bound", type=float, default=None, help="override the temperature error bound")
+    parser.add_argument("--max-interval", type=float, default=None)
+    args = parser.parse_args()
+
+    series = recorded(args.csv) if args.csv else simulated()
+    specs = {}
+    if args.bound is not None:
+        specs["temperature_data"] = Spec(spec_from_env("temperature_data").method, args.bound)
+    historian = Historian(specs, args.max_interval)
+
+    # "on change" is what storing every changed value, as before, would keep.
+    print(f"{'measurement':<18}{'device':<14}{'method':<15}{'bound':>7}{'samples':>9}{'on change':>11}"
+          f"{'stored':>8}{'ratio':>8}{'max err':>9}")
+    total_in = total_changes = total_out = 0
+    for (measurement, device_id), samples in sorted(series.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+        samples.sort(key=lambda sample: sample[0])
+        stored = []
+        for t, value in samples:
+            stored += historian.offer(measurement, device_id, t, value)
+        compressor = historian.series[(device_id, measurement)]
+        stored += compressor.flush()
+        spec = historian.specs[measurement]
+        error = max_error(samples, stored, isinstance(compressor, SwingingDoor))
+        changes = 1 + sum(a[1] != b[1] for a, b in zip(samples, samples[1:]))
+        total_in += len(samples)
+        total_changes += changes
+        total_out += len(stored)
+        print(f"{measurement:<18}{device_id or '-':<14}{spec.method:<15}{spec.bound:>7g}{len(samples):>9}"
+              f"{changes:>11}{len(stored):>8}{len(samples) / len(stored):>8.1f}{error:>9.4f}")
+    print(f"{'total':<54}{total_in:>9}{total_changes:>11}{total_out:>8}{total_in / max(1, total_out):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
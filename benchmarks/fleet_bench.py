@@ -0,0 +1,78 @@
+"""End-to-end fleet benchmark: virtual devices -> broker -> DaemonWorker -> devices.
+
+Needs a local mosquitto (docker compose up mosquitto). The devices run in a
+child process so the CPU time measured here is the daemon's alone.
+
+    python -m benchmarks.fleet_bench --sizes 1,10,100 --duration 30
+    python -m benchmarks.fleet_bench --influx   # use the real InfluxRepository
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+
+from dotenv import load_dotenv
+
+from gpio_api.system_state import system_state
+from simulator.standins import NullInfluxRepository, NullFanout
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(size, args):
+    from gpio_api.daemon_worker import DaemonWorker
+    from repository.influx_repository import InfluxRepository
+
+    influx = InfluxRepository(write_mode="buffered") if args.influx else NullInfluxRepository()
+    daemon = DaemonWorker(influx_client=influx, fanout=NullFanout())
+    daemon.start()
+
+    cpu_before = cpu_seconds()
+    devices = subprocess.run(
+        [sys.executable, "-m", "simulator", "--devices", str(size), "--prefix", f"bench{size}",
+         "--broker", os.getenv("MQTT_BROKER", "localhost"), "--port", os.getenv("MQTT_PORT", "1883"),
+         "--interval", str(args.interval), "--encoding", args.encoding, "--deadband", "0",
+         "--duration", str(args.duration), "--report"],
+        capture_output=True, text=True, check=True,
+    )
+    cpu = cpu_seconds() - cpu_before
+    daemon.stop()
+
+    report = json.loads(devices.stdout.strip().splitlines()[-1])
+    report["statuses_per_second"] = report["published"] / report["elapsed"]
+    report["daemon_cpu_per_device"] = cpu / report["elapsed"] / size
+    report["scheduler"] = daemon.scheduler.stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,10,50,100")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--encoding", choices=["json", "binary"], default="json")
+    parser.add_argument("--influx", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv()
+    os.environ.setdefault("MQTT_BROKER", "localhost")
+    os.environ.setdefault("MQTT_PORT", "1883")
+    os.environ["MQTT_STATUS_TOPIC"] = "+/status"
+    system_state.update(mode="auto")
+
+    print(f"{'devices':>8}{'msg/s':>10}{'cmds':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cpu/dev %':>11}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        report = run(size, args)
+        ms = lambda value: f"{value * 1000:.1f}" if value is not None else "-"
+        print(f"{size:>8}{report['statuses_per_second']:>10.1f}{report['commands']:>8}"
+              f"{ms(report['latency_p50']):>10}{ms(report['latency_p95']):>10}{ms(report['latency_p99']):>10}"
+              f"{report['daemon_cpu_per_device'] * 100:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Zones stepped per second by PIDEngine, against a plain Python loop.
+
+    python -m benchmarks.pid_engine_bench [zones,...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from gpio_api.pid_engine import PIDEngine
+
+
+def scalar_step(state, measurement, dt, kp=1.0, ki=0.1, kd=1.0, setpoint=22.0):
+    error = setpoint - measurement
+    state["integral"] += error * dt
+    derivative = 0.0 if state["last"] is None else -(measurement - state["last"]) / dt
+    state["last"] = measurement
+    return max(-100.0, min(100.0, kp * error + ki * state["integral"] + kd * derivative))
+
+
+def bench_engine(zones, duration=1.0):
+    engine = PIDEngine(capacity=zones)
+    for zone in range(zones):
+        engine.add_zone(zone, 1.0, 0.1, 1.0, 22.0)
+    index = np.arange(zones)
+    measurements = np.random.uniform(18, 28, zones)
+    steps = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        engine.step(index, measurements, 5.0)
+        steps += 1
+    return steps * zones / (time.perf_counter() - started)
+
+
+def bench_scalar(zones, duration=1.0):
+    states = [{"integral": 0.0, "last": None} for _ in range(zones)]
+    measurements = np.random.uniform(18, 28, zones).tolist()
+    steps = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        for state, measurement in zip(states, measurements):
+            scalar_step(state, measurement, 5.0)
+        steps += 1
+    return steps * zones / (time.perf_counter() - started)
+
+
+def main(sizes=(1, 100, 10000, 100000)):
+    print(f"{'zones':>8}{'engine zones/s':>18}{'scalar zones/s':>18}")
+    for zones in sizes:
+        print(f"{zones:>8}{bench_engine(zones):>18,.0f}{bench_scalar(zones):>18,.0f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else (1, 100, 10000, 100000))
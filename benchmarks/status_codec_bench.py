@@ -0,0 +1,41 @@
+"""Compare the JSON and binary status encodings.
+
+    python -m benchmarks.status_codec_bench [iterations]
+"""
+import sys
+import time
+
+from status_codec import StatusRecord, decode, encode
+
+SAMPLE = StatusRecord(
+    device_id="raspberry_pi_1",
+    temperature_c=22.437,
+    leds_on=2,
+    switch_window="on",
+    switch_someone_present="off",
+    timestamp=1760000000,
+    sensors={"28-00000a1b2c3d": 22.375, "28-00000a1b2c3e": 22.5},
+    sensor_errors={},
+)
+
+
+def _time(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main(iterations=100000):
+    print(f"{'encoding':<10}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for encoding in ("json", "binary"):
+        payload = encode(SAMPLE, encoding)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        encode_us = _time(lambda: encode(SAMPLE, encoding), iterations)
+        decode_us = _time(lambda: decode(payload), iterations)
+        print(f"{encoding:<10}{len(payload):>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
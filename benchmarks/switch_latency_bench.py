@@ -0,0 +1,79 @@
+"""Time from a window opening to the fans stopping, with and without switch events.
+
+A virtual device runs its fans in auto mode against a real DaemonWorker; the
+window is then opened and closed repeatedly and the device records how long
+each stop command took to arrive. Needs a local mosquitto.
+
+    python -m benchmarks.switch_latency_bench --trials 20
+"""
+import argparse
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+
+from gpio_api.system_state import system_state
+from simulator.standins import NullInfluxRepository, NullFanout
+
+
+def wait_until(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def run(events, args):
+    from gpio_api.daemon_worker import DaemonWorker
+    from simulator.device import VirtualDevice
+
+    daemon = DaemonWorker(influx_client=NullInfluxRepository(), fanout=NullFanout())
+    daemon.start()
+    device = VirtualDevice(f"switchbench_{'events' if events else 'polling'}", os.getenv("MQTT_BROKER"),
+                           int(os.getenv("MQTT_PORT")), args.interval, events=events)
+    device.plant.temperature = device.plant.outside = 30.0  # warm enough that auto keeps the fans on
+    device.plant.cooling = 0.0
+    device.start()
+    try:
+        for _ in range(args.trials):
+            if not wait_until(lambda: device.speed() > 0, args.interval * 4):
+                raise RuntimeError("fans never started")
+            # Open at a random point of the status cycle.
+            time.sleep(random.uniform(0, args.interval))
+            device.set_switch(0, closed=False)
+            wait_until(lambda: device.speed() == 0, args.interval * 4)
+            time.sleep(random.uniform(0.5, 2))
+            device.set_switch(0, closed=True)
+    finally:
+        device.stop()
+        daemon.stop()
+    return sorted(device.stop_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=5.0, help="device status interval, seconds")
+    args = parser.parse_args()
+
+    load_dotenv()
+    os.environ.setdefault("MQTT_BROKER", "localhost")
+    os.environ.setdefault("MQTT_PORT", "1883")
+    system_state.update(mode="auto")
+
+    print(f"{'switches':>10}{'trials':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for events in (False, True):
+        latencies = run(events, args)
+        if not latencies:
+            print(f"{'events' if events else 'polling':>10}{0:>8}")
+            continue
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{'events' if events else 'polling':>10}{len(latencies):>8}"
+              f"{pick(0.5):>10.1f}{pick(0.95):>10.1f}{latencies[-1] * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
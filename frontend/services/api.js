@@ -125,3 +125,28 @@ export const getRecentTemperatures = async () => {
     console.error('Error fetching recent temperatures:', error)
   }
 }
+
+// Several measurements in one request, as { time: [ms...], series: { name: [values...] } }.
+export const getHistory = async (measurements, params = {}) => {
+  try {
+    const query = new URLSearchParams({ measurements: measurements.join(','), ...params })
+    const response = await fetch(`${API_URL}/influx/history?${query}`)
+
+    if (!response.ok) {
+      let errorText = `HTTP ${response.status} ${response.statusText}`
+      try {
+        const errorData = await response.json()
+        errorText = errorData.error || errorText
+      } catch (jsonError) {
+        console.warn('No JSON body in error response')
+      }
+      console.error('Failed to fetch history:', errorText)
+      return
+    }
+
+    return await response.json()
+  } catch (error) {
+    console.error('Error fetching history:', error)
+  }
+}
+
@@ -1,7 +1,7 @@
 import { motion } from "framer-motion";
 import { AreaChart, Area, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from "recharts";
 import { useState, useEffect } from "react";
-import { getRecentTemperatures } from "../../../services/api";
+import { getHistory } from "../../../services/api";
 
 
 
@@ -15,10 +15,12 @@ const TemperatureOverviewChart = () => {
 
 	useEffect(() => {
 		const fetchData = async () => {
-		  const rawData = await getRecentTemperatures();
-		  const formattedData = rawData.map(item => ({
-			timestamp: new Date(item.time).getTime(), // Convert to timestamp
-			temperature: item.value,
+		  const history = await getHistory(["temperature_data"]);
+		  if (!history) return;
+		  const temperatures = history.series.temperature_data;
+		  const formattedData = history.time.map((timestamp, i) => ({
+			timestamp,
+			temperature: temperatures[i],
 		  }));
 		  setMonthlyTemperaturesData(formattedData);
 		};
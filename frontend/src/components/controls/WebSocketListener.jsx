@@ -11,9 +11,12 @@ const WebSocketListener = ({ url, onMessage }) => {
         methods: ["GET", "POST"]
       }
     });
-    // Listen for messages from the server
-    socket.on('message', (data) => {
+    // Listen for messages from the server. Each message only carries the
+    // fields that changed; acknowledging it tells the server we are ready
+    // for the next one.
+    socket.on('message', (data, ack) => {
       onMessage(data); // Handle the incoming message
+      if (typeof ack === 'function') ack();
     });
 
     socket.on("alarm",(data) => {
@@ -26,6 +29,7 @@ const WebSocketListener = ({ url, onMessage }) => {
     });
 
     return () => {
+      socket.disconnect();
     };
   }, [url, onMessage]);
 
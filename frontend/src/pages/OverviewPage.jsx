@@ -47,14 +47,19 @@ const OverviewPage = () => {
 		// Parse the incoming data and update the state accordingly
 		try {
 			const parsedData = data
+			// Updates are deltas: fields missing from a message keep their value.
 			setStatus((prevStatus) => ({
 				...prevStatus,
-				temperature: parsedData.temperature || prevStatus.temperature,
-				presenceSwitch: parsedData.switch_someone_present === 'on' ? 'Active' : 'Inactive',
-				windowSwitch: parsedData.switch_window === 'on' ? 'Active' : 'Inactive',
-				fanSpeed: (parsedData.leds_on & parsedData.leds_on.toString()) || prevStatus.fanSpeed,
+				temperature: parsedData.temperature ?? prevStatus.temperature,
+				presenceSwitch: 'switch_someone_present' in parsedData
+					? (parsedData.switch_someone_present === 'on' ? 'Active' : 'Inactive')
+					: prevStatus.presenceSwitch,
+				windowSwitch: 'switch_window' in parsedData
+					? (parsedData.switch_window === 'on' ? 'Active' : 'Inactive')
+					: prevStatus.windowSwitch,
+				fanSpeed: parsedData.leds_on != null ? parsedData.leds_on.toString() : prevStatus.fanSpeed,
 				mode: apiModeToMode[parsedData.mode] || prevStatus.mode,
-				pidValue: parsedData.pid_value || prevStatus.pidValue,
+				pidValue: parsedData.pid_value ?? prevStatus.pidValue,
 			}));
 		} catch (error) {
 			console.error("Error parsing message:", error);
@@ -1,14 +1,18 @@
 from flask import Flask, request
 from flask_cors import CORS
-from gpio_api.daemon_worker import DaemonWorker
 from dotenv import load_dotenv
+from gpio_api.logging_setup import configure_logging
 
 def create_app():
     app = Flask(__name__)
     load_dotenv()
+    configure_logging()
 
     CORS(app)
 
-    from gpio_api.routes import gpio_blueprint
+    from gpio_api import ipc
+    from gpio_api.routes import gpio_blueprint, daemon
     app.register_blueprint(gpio_blueprint)
+    if ipc.daemon_mode() == "embedded":
+        daemon.get()  # start the control loop with the app, as before
     return app
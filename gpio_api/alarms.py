@@ -0,0 +1,184 @@
+"""Declarative alarm rules evaluated for a whole batch of statuses at once.
+
+A rule watches one status field and fires when it goes above or below a
+threshold, or equals a given state. Thresholds can be relative to the target
+temperature. A rule only fires after `debounce` consecutive matching samples
+and then stays latched for that device until the value leaves the hysteresis
+band, so a reading hovering around the threshold raises one alarm, not many.
+"""
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+ABOVE, BELOW, EQUALS = 0, 1, 2
+KINDS = {"above": ABOVE, "below": BELOW, "equals": EQUALS}
+
+# Status fields the rules can watch, as columns of the batch matrix. Switch
+# states are encoded as 1.0 for "on" and 0.0 for "off".
+FIELDS = ("temperature_c", "switch_window", "switch_someone_present", "leds_on")
+SWITCH_VALUES = {"on": 1.0, "off": 0.0}
+
+DEFAULT_RULES = [
+    {"name": "window_open", "description": "Window open", "field": "switch_window",
+     "kind": "equals", "value": "off"},
+    {"name": "door_open", "description": "Door open", "field": "switch_someone_present",
+     "kind": "equals", "value": "off"},
+    {"name": "high_temperature", "description": "High temperature", "field": "temperature_c",
+     "kind": "above", "value": 10, "relative_to_target": True, "hysteresis": 0.5, "debounce": 1},
+    {"name": "low_temperature", "description": "Low temperature", "field": "temperature_c",
+     "kind": "below", "value": -10, "relative_to_target": True, "hysteresis": 0.5, "debounce": 1},
+]
+
+
+def load_rules():
+    """Rules from the JSON file named by ALARM_RULES_FILE, or the defaults."""
+    path = os.getenv("ALARM_RULES_FILE")
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        return json.load(f)
+
+
+def _field_value(status, field):
+    value = getattr(status, field)
+    if value is None:
+        return math.nan
+    if isinstance(value, str):
+        return SWITCH_VALUES.get(value, math.nan)
+    return float(value)
+
+
+class AlarmEngine:
+    def __init__(self, rules=None):
+        rules = rules if rules is not None else load_rules()
+        self.names = [rule["name"] for rule in rules]
+        self.descriptions = [rule.get("description", rule["name"]) for rule in rules]
+        self.field_index = np.array([FIELDS.index(rule["field"]) for rule in rules], dtype=np.intp)
+        self.kind = np.array([KINDS[rule["kind"]] for rule in rules], dtype=np.int8)
+        self.threshold = np.array([
+            SWITCH_VALUES[rule["value"]] if isinstance(rule["value"], str) else float(rule["value"])
+            for rule in rules
+        ])
+        self.relative = np.array([bool(rule.get("relative_to_target")) for rule in rules])
+        self.hysteresis = np.array([float(rule.get("hysteresis", 0.0)) for rule in rules])
+        self.debounce = np.array([int(rule.get("debounce", 1)) for rule in rules], dtype=np.int32)
+
+        self._lock = threading.Lock()
+        self._rows = {}  # device_id -> row in the state arrays
+        self._active = np.zeros((0, len(rules)), dtype=bool)
+        self._streak = np.zeros((0, len(rules)), dtype=np.int32)
+
+    def _row(self, device_id):
+        row = self._rows.get(device_id)
+        if row is None:
+            row = len(self._rows)
+            self._rows[device_id] = row
+            if row >= len(self._active):
+                grow = max(16, len(self._active))
+                self._active = np.vstack([self._active, np.zeros((grow, len(self.names)), dtype=bool)])
+                self._streak = np.vstack([self._streak, np.zeros((grow, len(self.names)), dtype=np.int32)])
+        return row
+
+    def active(self, device_id):
+        row = self._rows.get(device_id)
+        if row is None:
+            return []
+        return [name for name, on in zip(self.names, self._active[row]) if on]
+
+    def evaluate_batch(self, statuses, target_temperature):
+        """Evaluate (device_id, StatusRecord) pairs in order; returns the newly fired alarms."""
+        if not statuses or not self.names:
+            return []
+        # Every sample counts towards debounce and clearing, so a device's
+        # samples are applied in order: round k holds each device's k-th one.
+        rounds = []
+        seen = {}
+        for device_id, status in statuses:
+            k = seen.get(device_id, 0)
+            seen[device_id] = k + 1
+            if k == len(rounds):
+                rounds.append([])
+            rounds[k].append((device_id, status))
+        events = []
+        for pairs in rounds:
+            events += self._evaluate_round(pairs, target_temperature)
+        return events
+
+    def _evaluate_round(self, pairs, target_temperature):
+        """One sample per device, all evaluated at once."""
+        device_ids = [device_id for device_id, _ in pairs]
+        values = np.array([[_field_value(status, field) for field in FIELDS] for _, status in pairs])
+        observed = values[:, self.field_index]  # devices x rules
+        threshold = self.threshold + self.relative * target_temperature
+
+        with np.errstate(invalid="ignore"):
+            trigger = np.where(self.kind == ABOVE, observed > threshold,
+                      np.where(self.kind == BELOW, observed < threshold, observed == threshold))
+            clear = np.where(self.kind == ABOVE, observed < threshold - self.hysteresis,
+                    np.where(self.kind == BELOW, observed > threshold + self.hysteresis,
+                             observed != threshold))
+        clear &= ~np.isnan(observed)
+
+        with self._lock:
+            rows = np.array([self._row(device_id) for device_id in device_ids], dtype=np.intp)
+            streak = np.where(trigger, self._streak[rows] + 1, 0)
+            active = self._active[rows]
+            fired = trigger & (streak >= self.debounce) & ~active
+            self._active[rows] = (active | fired) & ~clear
+            self._streak[rows] = streak
+
+        events = []
+        for i, j in zip(*np.nonzero(fired)):
+            events.append({
+                "device_id": device_ids[i],
+                "rule": self.names[j],
+                "alarmDescription": self.descriptions[j],
+                "value": float(observed[i, j]),
+            })
+        return events
+
+
+class AlarmLimiter:
+    """Deduplicates and rate-limits alarms before they reach the websocket.
+
+    The same (device, rule) alarm is suppressed for `dedupe_window` seconds,
+    and at most `rate` alarms per second (with bursts up to `burst`) pass
+    overall; whatever is held back is counted so a storm can be reported as a
+    single summary instead of thousands of messages.
+    """
+
+    def __init__(self, rate=20.0, burst=50, dedupe_window=10.0):
+        self.rate = rate
+        self.burst = burst
+        self.dedupe_window = dedupe_window
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def allow(self, event):
+        now = time.monotonic()
+        key = (event["device_id"], event["rule"])
+        with self._lock:
+            last = self._last_sent.get(key)
+            if last is not None and now - last < self.dedupe_window:
+                self.suppressed += 1
+                return False
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens < 1:
+                self.suppressed += 1
+                return False
+            self._tokens -= 1
+            self._last_sent[key] = now
+            return True
+
+    def take_suppressed(self):
+        with self._lock:
+            suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
@@ -0,0 +1,18 @@
+"""Control decisions shared by the daemon and the replay engine."""
+
+AUTO_LOW_DEVIATION = 2  # below this deviation from target the fan is off
+AUTO_HIGH_DEVIATION = 5  # above this it runs at full speed
+
+
+def auto_speed(temperature, target, low=AUTO_LOW_DEVIATION, high=AUTO_HIGH_DEVIATION):
+    deviation = abs(temperature - target)
+    if deviation < low:
+        return 0
+    elif low <= deviation <= high:
+        return 2
+    return 3
+
+
+def is_paused(mode, switch_window, switch_someone_present):
+    # The switches read "off" when the window or door is open.
+    return mode == "auto" and (switch_someone_present == "off" or switch_window == "off")
@@ -0,0 +1,43 @@
+"""The control daemon: the one process that runs the control loop.
+
+    python -m gpio_api.daemon
+
+Start it before the API (SCADA_DAEMON=external, the default); the API
+workers reach it through gpio_api.ipc.
+"""
+import logging
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+log = logging.getLogger("scada.daemon")
+
+
+def main():
+    load_dotenv()
+    from gpio_api.logging_setup import configure_logging
+    from gpio_api.daemon_worker import DaemonWorker
+    from gpio_api.ipc import DaemonService, LocalDaemon
+    configure_logging()
+
+    worker = DaemonWorker()
+    service = DaemonService(LocalDaemon(worker))  # fails if another daemon is running
+    worker.start()
+    service.start()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("daemon stopping")
+        service.stop()
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
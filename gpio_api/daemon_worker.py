@@ -1,244 +1,390 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import logging
 import threading
 import os
 import time
-from gpio_api.system_state import system_state
-from config import *
+from gpio_api.system_state import system_state, controls_changed
+from gpio_api.device_table import DeviceTable
+from gpio_api.scheduler import ControlScheduler
+from gpio_api.alarms import AlarmEngine, AlarmLimiter
+from gpio_api.fanout import Fanout, ALL_DEVICES
+from gpio_api.pid_engine import PIDEngine
+from gpio_api.control import auto_speed, is_paused
+from gpio_api.ingest import IngestPipeline
+from gpio_api import metrics
+from status_codec import decode as decode_status, decode_batch
 from repository.influx_repository import InfluxRepository
+from repository.ring_buffer import HistoryCache
+from repository.export import MEASUREMENTS as HISTORY_MEASUREMENTS
 import paho.mqtt.client as mqtt
 import json
-import asyncio
-import websockets
-import socketio
-
-class PIDController:
-    def __init__(self, Kp, Ki, Kd, setpoint, output_limits=(-100, 100)):
-        self.Kp = Kp
-        self.Ki = Ki
-        self.Kd = Kd
-        self.setpoint = setpoint
-        self.output_limits = output_limits
-        self.integral = 0
-        self.last_error = None
-        
-
-    def compute(self, current_value, dt):
-        print(f"[PID] Kp: {self.Kp} | Ki: {self.Ki} | Kd: {self.Kd}")
-        print(f"[PID] Setpoint: {self.setpoint} | Current Value: {current_value}")
-        error = self.setpoint - current_value
-        print(f"[PID] Error: {error:.2f} | Setpoint: {self.setpoint:.2f} | Current: {current_value:.2f}")
-        self.integral += error * dt
-        derivative = 0 if self.last_error is None else (error - self.last_error) / dt
-        output = (self.Kp * error) + (self.Ki * self.integral) + (self.Kd * derivative)
-        output = max(self.output_limits[0], min(self.output_limits[1], output))
-        self.last_error = error
-        return abs(output)
+
+
+log = logging.getLogger("scada.daemon")
 
 class DaemonWorker:
-    def __init__(self):
-        self.interval = 5  # seconds
+    def __init__(self, influx_client=None, fanout=None):
+        self.interval = 5  # seconds, longest gap between control passes
+        self.workers = int(os.getenv("DAEMON_WORKERS", 4))
+        self.status_topic = os.getenv("MQTT_STATUS_TOPIC", "+/status")
+        self.backlog_topic = os.getenv("MQTT_BACKLOG_TOPIC", "+/backlog")
+        self.event_topic = os.getenv("MQTT_EVENT_TOPIC", "+/event")
+        self.default_device_id = os.getenv("DEVICE_ID")
         self.running = False
         self.thread = threading.Thread(target=self._worker, daemon=True)
-        self.pid = None
-        self.influx_client = InfluxRepository()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="daemon-shard")
+        self.devices = DeviceTable()
+        self.pid_engine = PIDEngine()
+        self._pid_settings = None
+        self.alarm_engine = AlarmEngine()
+        self.alarm_limiter = AlarmLimiter(
+            rate=float(os.getenv("ALARM_RATE", 20)),
+            burst=int(os.getenv("ALARM_BURST", 50)),
+            dedupe_window=float(os.getenv("ALARM_DEDUPE_WINDOW", 10)),
+        )
+        self.scheduler = ControlScheduler(
+            min_period=float(os.getenv("CONTROL_MIN_PERIOD", 0.5)),
+            max_period=float(os.getenv("CONTROL_MAX_PERIOD", self.interval)),
+        )
+        self.history = HistoryCache()
+        self.ingest = IngestPipeline(
+            self._ingest_batch,
+            workers=int(os.getenv("INGEST_WORKERS", 2)),
+            capacity=int(os.getenv("INGEST_QUEUE_SIZE", 10000)),
+            batch_size=int(os.getenv("INGEST_BATCH", 200)),
+            policy=os.getenv("INGEST_POLICY", "conflate"),
+        )
+        self.influx_client = influx_client or InfluxRepository(write_mode=os.getenv("INFLUX_WRITE_MODE", "buffered"))
         self.client = mqtt.Client()
         self.client.connect(os.getenv('MQTT_BROKER'), int(os.getenv('MQTT_PORT')), 60)
         self.client.on_message = self.on_message
-        self.client.subscribe(f"{os.getenv('DEVICE_ID')}/status")
+        self.client.message_callback_add(self.backlog_topic, self.on_backlog)
+        self.client.message_callback_add(self.event_topic, self.on_event)
+        self.client.subscribe([(self.status_topic, 0), (self.backlog_topic, 1), (self.event_topic, 1)])
         self.client.loop_start()
-        self.device_id = None
-        self.current_temperature = None
-        self.switch_window = None
-        self.switch_someone_present = None
-        self.leds_on = None
-        self.websocket_client = socketio.Client()
-        self.window_processed = False
-        self.door_processed = False
-        self.high_temperature_processed =False
-        self.low_temperature_processed = False
+        self.fanout = fanout or Fanout(
+            port=int(os.getenv("WEBSOCKET_PORT", 5001)),
+            default_room=self.default_device_id or ALL_DEVICES,
+        )
+        self.influx_client.write_observer = metrics.influx_write_seconds.observe
+        # Settings changed from the API apply to the whole fleet right away.
+        system_state.subscribe(self._on_state_change)
+        metrics.devices.set_function(lambda: len(self.devices))
+        metrics.influx_queue_depth.set_function(lambda: self.influx_client.write_stats().get("queue_depth", 0))
+
+    # Single-device view kept for the routes and websocket payload: the
+    # configured DEVICE_ID, or the first device seen when it is unset.
+    def primary_device(self):
+        if self.default_device_id:
+            return self.devices.get(self.default_device_id)
+        devices = self.devices.all()
+        return devices[0] if devices else None
+
+    def _primary_attr(self, name):
+        device = self.primary_device()
+        return getattr(device, name) if device else None
+
+    @property
+    def device_id(self):
+        return self._primary_attr("device_id")
+
+    @property
+    def current_temperature(self):
+        return self._primary_attr("current_temperature")
+
+    @property
+    def switch_window(self):
+        return self._primary_attr("switch_window")
+
+    @property
+    def switch_someone_present(self):
+        return self._primary_attr("switch_someone_present")
+
+    @property
+    def leds_on(self):
+        return self._primary_attr("leds_on")
 
+    def on_message(self, client, userdata, msg):
+        # Runs on paho's network thread: queue the message and return.
+        metrics.mqtt_messages.inc()
+        self.ingest.submit(msg.topic, msg.payload)
+
+    def _ingest_batch(self, messages):
+        """Handle a batch of queued (topic, payload, received_at) status messages."""
+        received = []
+        for topic, payload, received_at in messages:
+            started = time.perf_counter()
+            try:
+                status = decode_status(payload)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("status received", extra={"status": status})
+                device_id = status.device_id or topic.split("/", 1)[0]
+                self.devices.get_or_create(device_id).update(status)
+                self.history.record_status(device_id, status)
+                received.append((device_id, status, received_at))
+            except Exception as e:
+                metrics.errors.labels("mqtt").inc()
+                log.warning("error handling message", extra={"topic": topic, "error": e})
+            metrics.mqtt_handle_seconds.observe(time.perf_counter() - started)
 
+        self.check_alarms_batch([(device_id, status) for device_id, status, _ in received])
+        for device_id, _, received_at in received:
+            self.scheduler.notify(device_id, received_at)
 
-    def on_message(self, client, userdata, msg):
+    def on_backlog(self, client, userdata, msg):
+        """Statuses a device spooled while offline: stored for history, never acted on."""
         try:
-            status = json.loads(msg.payload.decode())
-            print(status)
-            self.device_id = status.get("device_id")
-            self.current_temperature = status.get("temperature_c")
-            self.leds_on = status.get("leds_on")
-            switches = status.get("switches", {})
-            self.switch_window = switches.get("switch_1")
-            self.switch_someone_present = switches.get("switch_2")
+            statuses = decode_batch(msg.payload)
+            if not statuses:
+                return
+            device_id = statuses[0].device_id or msg.topic.split("/", 1)[0]
+            self.influx_client.write_backlog(device_id, statuses)
+            self.history.mark_incomplete(device_id, max(status.timestamp for status in statuses))
+            metrics.backlog_statuses.inc(len(statuses))
+            log.info("backlog received", extra={"device_id": device_id, "count": len(statuses)})
+        except Exception as e:
+            metrics.errors.labels("backlog").inc()
+            log.warning("error handling backlog", extra={"topic": msg.topic, "error": e})
 
-            self.check_for_alarms(status)
+    def on_event(self, client, userdata, msg):
+        """A switch changed on a device: pause its fans now, not at the next tick.
 
+        Handled on the network thread rather than queued behind statuses; it
+        is one small message and the point is to act on it at once.
+        """
+        received = time.monotonic()
+        try:
+            event = json.loads(msg.payload)
+            device_id = event.get("device_id") or msg.topic.split("/", 1)[0]
+            device = self.devices.get_or_create(device_id)
+            device.apply_switch_event(event["switch_window"], event["switch_someone_present"], event["timestamp"])
+            metrics.switch_events.inc()
+            if is_paused(system_state.mode, device.switch_window, device.switch_someone_present):
+                self._set_speed(device, 0)
+                metrics.switch_to_command_seconds.observe(time.monotonic() - received)
+            # The next tick records the change and updates status and websocket.
+            self.scheduler.notify(device_id, received)
         except Exception as e:
-            print(f"Error handling message: {e}")
-
-    def check_for_alarms(self,status):
-        switches = status.get("switches", {})
-        switch_window = switches.get("switch_1")
-        switch_someone_present = switches.get("switch_2")
-        print("checking for alarms status: ", status)
-        
-        if switch_window == "off" and not self.window_processed:
-            self.window_processed = True
-            self.publish_to_websocket("alarm", "Window open")
-        elif switch_window == "on":
-            self.window_processed = False
-
-        if switch_someone_present == "off" and not self.door_processed:
-            self.door_processed = True
-
-            self.publish_to_websocket("alarm", "Door open")
-        elif switch_someone_present == "on":
-            self.door_processed = False
-
-        if self.current_temperature > system_state.target_temperature + 10 and not self.high_temperature_processed:
-            self.high_temperature_processed = True
-            self.publish_to_websocket("alarm", "High temperature")
-        elif self.current_temperature < system_state.target_temperature + 10:
-            self.high_temperature_processed = False
-
-        if self.current_temperature < system_state.target_temperature - 10 and not self.low_temperature_processed:
-            self.low_temperature_processed = True
-            self.publish_to_websocket("alarm", "Low temperature")
-        elif self.current_temperature > system_state.target_temperature - 10:
-            self.low_temperature_processed = False
-
-        
+            metrics.errors.labels("event").inc()
+            log.warning("error handling switch event", extra={"topic": msg.topic, "error": e})
+
+    def _on_state_change(self, previous, snapshot):
+        if controls_changed(previous, snapshot):
+            self.scheduler.notify()
+
+    def check_alarms_batch(self, statuses):
+        events = self.alarm_engine.evaluate_batch(statuses, system_state.target_temperature)
+        for event in events:
+            metrics.alarms.labels(event["rule"]).inc()
+            if self.alarm_limiter.allow(event):
+                self.publish_to_websocket("alarm", event["alarmDescription"], self.devices.get(event["device_id"]))
+
+    def _report_suppressed_alarms(self):
+        suppressed = self.alarm_limiter.take_suppressed()
+        if suppressed:
+            log.warning("alarms suppressed", extra={"count": suppressed})
+            self.publish_to_websocket("alarm", f"{suppressed} further alarms suppressed")
 
     def command(self, action, pin):
         return {"action": action, "pin": pin}
 
+    def speed_command(self, speed):
+        return {"action": "set_speed", "speed": speed}
+
     def start(self):
-        self.websocket_client.connect("http://localhost:5001")
+        try:
+            self.history.warm(self.influx_client, HISTORY_MEASUREMENTS, os.getenv("HISTORY_CACHE_WARM", "-1h"))
+        except Exception as e:
+            log.warning("could not warm history cache", extra={"error": e})
+        if self.influx_client.rollups:
+            try:
+                self.influx_client.rollups.provision()
+            except Exception as e:
+                log.warning("could not provision rollups", extra={"error": e})
+        self.fanout.start()
+        self.ingest.start()
         self.running = True
         self.thread.start()
 
     def stop(self):
         self.running = False
+        self.scheduler.stop()
         self.thread.join()
+        self.executor.shutdown()
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.ingest.stop()
+        self.fanout.stop()
+        self.influx_client.close()
 
     def _worker(self):
-        print("[Daemon] Background worker started.")
+        log.info("background worker started", extra={"shards": self.workers, "topic": self.status_topic})
         while self.running:
+            due = self.scheduler.wait_for_tick()
+            if not self.running:
+                break
+            started = time.monotonic()
+            # One snapshot per pass, so every device sees the same settings.
+            state = system_state.snapshot
             try:
-                temp = self.current_temperature
-                self.influx_client.write_temperature(temp)
-                self.influx_client.write_windows_switch(self.switch_window)
-                self.influx_client.write_present_switch(self.switch_someone_present)
-                self.influx_client.write_fan_speed(self.leds_on)
-                self.publish_to_websocket("message")
-
-                print(f"[Daemon] Temp: {temp}°C | Mode: {system_state.mode}")
-
-                # Read door and window states
-                door_state = self.switch_someone_present
-                window_state = self.switch_window
-
-                # NEW: Check if door or window is open
-                if (door_state == "off" or window_state == "off") and system_state.mode == "auto":
-                    print("[Daemon] Door or window open. Pausing system.")
-                    # Turn off all fan speeds
-                    self.set_led("turn_off_led", [LED1_PIN, LED2_PIN, LED3_PIN])
-
-                    # Update system state if needed
-                    system_state.current_speed = 0
-                    system_state.pid_value = 0
-                    system_state.status_message = "Paused (door/window open)"
+                if due is None:
+                    devices = self.devices.all()
                 else:
-                    # Normal operation
-                    print(f"[Daemon] Current mode: {system_state.mode}")
-                    if system_state.mode == "manual":
-                        self._handle_manual()
-                    elif system_state.mode == "auto":
-                        self._handle_auto(temp)
-                    elif system_state.mode == "pid":
-                        self._handle_pid(temp)
+                    devices = [d for d in (self.devices.get(device_id) for device_id in due) if d]
+                if state.mode == "pid":
+                    self._step_pid(devices, state)
+                shards = self.devices.shards(self.workers, devices)
+                futures = [self.executor.submit(self._process_shard, shard, state) for shard in shards]
+                for future in futures:
+                    future.result()
+            except Exception as e:
+                metrics.errors.labels("control").inc()
+                log.error("control pass failed", extra={"error": e})
+
+            self._report_suppressed_alarms()
+            elapsed = time.monotonic() - started
+            self.scheduler.record_tick(elapsed)
+            metrics.control_tick_seconds.observe(elapsed)
+            if elapsed > self.scheduler.max_period:
+                log.warning("tick overran interval", extra={"elapsed": round(elapsed, 3), "devices": len(self.devices),
+                                                            "interval": self.scheduler.max_period})
+
+    def _process_shard(self, devices, state):
+        for device in devices:
+            try:
+                self._control_device(device, state)
+            except Exception as e:
+                metrics.errors.labels("control").inc()
+                log.error("control failed", extra={"device_id": device.device_id, "error": e})
+
+    def _control_device(self, device, state):
+        device.last_control = time.monotonic()
+        temp = device.current_temperature
+        self.influx_client.write_temperature(temp, device.device_id)
+        self.influx_client.write_windows_switch(device.switch_window, device.device_id)
+        self.influx_client.write_present_switch(device.switch_someone_present, device.device_id)
+        self.influx_client.write_fan_speed(device.leds_on, device.device_id)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("control", extra={"device_id": device.device_id, "temperature": temp, "mode": state.mode})
+
+        # Pause while the door or window is open
+        if is_paused(state.mode, device.switch_window, device.switch_someone_present):
+            log.debug("door or window open, pausing", extra={"device_id": device.device_id})
+            # Turn off all fan speeds
+            self._set_speed(device, 0)
+
+            device.pid_value = 0
+            device.status_message = "Paused (door/window open)"
+        else:
+            # Normal operation
+            if state.mode == "manual":
+                self._handle_manual(device, state)
+            elif state.mode == "auto":
+                self._handle_auto(device, temp, state)
+            elif state.mode == "pid":
+                self._handle_pid(device)
 
-                    system_state.status_message = "Running normally"
+            device.status_message = "Running normally"
 
-                time.sleep(self.interval)
+        if device is self.primary_device():
+            system_state.update(current_speed=device.current_speed, pid_value=device.pid_value,
+                                status_message=device.status_message)
 
-            except Exception as e:
-                print(f"[Daemon] Error: {e}")
-                time.sleep(5)
+        self.publish_to_websocket("message", device=device, state=state)
 
-    def _handle_manual(self):
+    def _handle_manual(self, device, state):
         #pass
-        self._set_speed(system_state.manual_speed)
-
-    def _handle_auto(self, temp):
-        deviation = abs(temp - system_state.target_temperature)
-        if deviation < 2:
-            speed = 0
-        elif 2 <= deviation <= 5:
-            speed = 2
-        else:
-            speed = 3
-        self._set_speed(speed)
-
-    def _handle_pid(self, temp):
-        if not self.pid:
-            params = system_state.pid_params
-            print(f"[Daemon] PID params: {params}")
-            self.pid = PIDController(
-                params["Kp"], params["Ki"], params["Kd"],
-                setpoint=system_state.target_temperature
-            )
-            print(f"[Daemon] PID setpoint: {system_state.target_temperature}°C")
-
-        output = self.pid.compute(temp, self.interval)
-        system_state.pid_value = output
-        print(f"[Daemon] PID output: {output:.2f}%")
-
-    def _set_speed(self, speed):
-        # Turn off all LEDs first
-        self.set_led("turn_off_led", [LED1_PIN, LED2_PIN, LED3_PIN])
-
-        print(f"[Daemon] Setting speed to {speed}")
-        if speed == 1:
-            self.set_led("turn_on_led", [LED1_PIN])
-        elif speed == 2:
-            self.set_led("turn_on_led", [LED1_PIN, LED2_PIN])
-        elif speed == 3:
-            self.set_led("turn_on_led", [LED1_PIN, LED2_PIN, LED3_PIN])
-    
-    def set_led(self, action, pins):
+        self._set_speed(device, state.manual_speed)
+
+    def _handle_auto(self, device, temp, state):
+        self._set_speed(device, auto_speed(temp, state.target_temperature))
+
+    def _step_pid(self, devices, state):
+        """Step the PID zones of all devices in this pass with one engine call."""
+        params = state.pid_params
+        target = state.target_temperature
+        settings = (params["Kp"], params["Ki"], params["Kd"], target)
+        if self._pid_settings is not None and settings != self._pid_settings:
+            self.pid_engine.set_gains(params["Kp"], params["Ki"], params["Kd"])
+            self.pid_engine.set_setpoint(target)
+            log.info("pid settings updated", extra={"params": params, "setpoint": target})
+        self._pid_settings = settings
+
+        ready = [device for device in devices if device.current_temperature is not None]
+        if not ready:
+            return
+        now = time.monotonic()
+        for device in ready:
+            self.pid_engine.add_zone(device.device_id, params["Kp"], params["Ki"], params["Kd"], target)
+        index = self.pid_engine.indices([device.device_id for device in ready])
+        dt = [now - device.last_control if device.last_control else self.interval for device in ready]
+        outputs = self.pid_engine.step(index, [device.current_temperature for device in ready], dt)
+        for device, output in zip(ready, outputs):
+            device.pid_value = abs(float(output))
+
+    def _handle_pid(self, device):
+        # pid_value was computed for the whole pass in _step_pid.
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("pid output", extra={"device_id": device.device_id, "output": round(device.pid_value, 2)})
+
+    def _set_speed(self, device, speed):
+        # Only send when the speed changes, or when the device still reports
+        # something else well after the last command (e.g. it rebooted).
+        now = time.monotonic()
+        unchanged = speed == device.current_speed and device.commanded_at is not None
+        confirmed = device.leds_on is None or device.leds_on == speed
+        if unchanged and (confirmed or now - device.commanded_at < self.interval):
+            return
+
+        log.debug("setting speed", extra={"device_id": device.device_id, "speed": speed})
+        self.client.publish(
+            f"{device.device_id}/command",
+            json.dumps(self.speed_command(speed))
+        )
+        device.current_speed = speed
+        device.commanded_at = now
+
+    def set_led(self, action, pins, device_id=None):
             """Helper to send LED commands easily."""
+            device_id = device_id or self.default_device_id or self.device_id
             for pin in pins:
                 self.client.publish(
-                    f"{os.getenv('DEVICE_ID')}/command",
+                    f"{device_id}/command",
                     json.dumps(self.command(action, pin))
                 )
 
-    def get_switch(self, pin):
+    def get_switch(self, pin, device_id=None):
+        device = self.devices.get(device_id) if device_id else self.primary_device()
+        if device is None:
+            return None
         if pin == 23:
-            return self.switch_window
+            return device.switch_window
         elif pin == 24:
-            return self.switch_someone_present
+            return device.switch_someone_present
         else:
             return None
-    
 
-    def publish_to_websocket(self,type, alarmType = None):
-        
+    def publish_to_websocket(self, type, alarmType=None, device=None, state=None):
+        started = time.perf_counter()
         if type == "alarm":
-            data = {
+            self.fanout.publish_alarm({
+                "device_id": device.device_id if device else None,
                 "alarmDescription": alarmType,
                 "timestamp": datetime.now().isoformat(),
-            }
+            })
         else:
-            data = {
-                "device_id": self.device_id,
-                "temperature": self.current_temperature,
-                "leds_on": self.leds_on,
-                "switch_window": self.switch_window,
-                "switch_someone_present": self.switch_someone_present,
-                "pid_value": system_state.pid_value,
-                "status_message": system_state.status_message,
-                "mode": system_state.mode,
-            }
-
-        self.websocket_client.emit(type, data)
\ No newline at end of file
+            device = device or self.primary_device()
+            if device is None:
+                return
+            self.fanout.publish_state(device.device_id, {
+                "temperature": device.current_temperature,
+                "leds_on": device.leds_on,
+                "switch_window": device.switch_window,
+                "switch_someone_present": device.switch_someone_present,
+                "pid_value": device.pid_value,
+                "status_message": device.status_message,
+                "mode": (state or system_state.snapshot).mode,
+            })
+        metrics.websocket_emit_seconds.labels(type).observe(time.perf_counter() - started)
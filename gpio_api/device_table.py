@@ -0,0 +1,117 @@
+import threading
+import time
+
+
+class DeviceState:
+    __slots__ = (
+        "device_id",
+        "current_temperature",
+        "sensors",
+        "leds_on",
+        "switch_window",
+        "switch_someone_present",
+        "last_seen",
+        "last_control",
+        "current_speed",
+        "commanded_at",
+        "pid_value",
+        "status_message",
+        "switches_at",
+        "lock",
+    )
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.current_temperature = None
+        self.sensors = {}
+        self.leds_on = None
+        self.switch_window = None
+        self.switch_someone_present = None
+        self.last_seen = None
+        self.last_control = None
+        self.current_speed = 0
+        self.commanded_at = None
+        self.pid_value = 0
+        self.status_message = "Message"
+        self.switches_at = 0  # device time of the switch states held
+        # Switch events arrive on the MQTT network thread, statuses on the
+        # ingest workers.
+        self.lock = threading.Lock()
+
+    def _newer_switches(self, timestamp):
+        # A status sampled before the last switch event may still be queued,
+        # and an event can be redelivered; switch states older than the ones
+        # held are dropped. Binary v1 statuses carry whole seconds, so those
+        # compare at that resolution.
+        if not timestamp:
+            return True
+        held = self.switches_at if isinstance(timestamp, float) else int(self.switches_at)
+        return timestamp >= held
+
+    def update(self, status):
+        with self.lock:
+            self.current_temperature = status.temperature_c
+            self.sensors = status.sensors
+            self.leds_on = status.leds_on
+            if self._newer_switches(status.timestamp):
+                self.switch_window = status.switch_window
+                self.switch_someone_present = status.switch_someone_present
+                self.switches_at = status.timestamp or self.switches_at
+            self.last_seen = time.time()
+
+    def apply_switch_event(self, switch_window, switch_someone_present, timestamp):
+        with self.lock:
+            if self._newer_switches(timestamp):
+                self.switch_window = switch_window
+                self.switch_someone_present = switch_someone_present
+                self.switches_at = timestamp
+            self.last_seen = time.time()
+
+    def to_dict(self):
+        return {
+            "device_id": self.device_id,
+            "temperature": self.current_temperature,
+            "sensors": self.sensors,
+            "leds_on": self.leds_on,
+            "switch_window": self.switch_window,
+            "switch_someone_present": self.switch_someone_present,
+            "current_speed": self.current_speed,
+            "pid_value": self.pid_value,
+            "status_message": self.status_message,
+            "last_seen": self.last_seen,
+        }
+
+
+class DeviceTable:
+    """Per-device state for every device reporting on the status topic."""
+
+    def __init__(self):
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def get_or_create(self, device_id):
+        device = self._devices.get(device_id)
+        if device is None:
+            with self._lock:
+                device = self._devices.get(device_id)
+                if device is None:
+                    device = DeviceState(device_id)
+                    self._devices[device_id] = device
+        return device
+
+    def all(self):
+        with self._lock:
+            return list(self._devices.values())
+
+    def shards(self, count, devices=None):
+        # Devices are only ever appended, so slicing the insertion-ordered
+        # list keeps every device on the same shard from tick to tick.
+        if devices is None:
+            devices = self.all()
+        return [devices[i::count] for i in range(count) if devices[i::count]]
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,199 @@
+"""Socket.IO fan-out of device state, hosted inside the daemon process.
+
+Browsers connect here directly (it replaces the old relay in
+websocket/websocket.py). Each client is subscribed to device rooms and gets
+only the fields that changed since it was last updated. A client has at most
+one unacknowledged update in flight; anything that changes meanwhile is merged
+into its pending update, so a slow browser skips stale intermediate states and
+always catches up with the newest one.
+
+The server runs on gevent's WSGI server, on a gevent hub of its own in one
+thread of the daemon (the daemon is not monkey-patched). Everything that
+touches sockets - serving, the sender, alarm emits - runs on that hub; other
+threads only update the pending state under the lock and wake the sender.
+"""
+import logging
+import os
+import threading
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.pywsgi import WSGIServer
+from flask import Flask, request
+from flask_socketio import SocketIO, join_room, leave_room
+
+log = logging.getLogger("scada.fanout")
+
+ALL_DEVICES = "*"
+# Origins allowed to open a socket; the dashboard's dev server and the API.
+DEFAULT_ALLOWED_ORIGINS = "http://localhost:5173,http://localhost:5000,http://localhost:5001"
+
+
+def allowed_origins():
+    """WEBSOCKET_ALLOWED_ORIGINS: comma-separated origins, or "*" for any."""
+    value = os.getenv("WEBSOCKET_ALLOWED_ORIGINS", DEFAULT_ALLOWED_ORIGINS)
+    return "*" if value.strip() == "*" else [origin.strip() for origin in value.split(",") if origin.strip()]
+
+
+class _Client:
+    __slots__ = ("rooms", "pending", "inflight_since")
+
+    def __init__(self):
+        self.rooms = set()
+        self.pending = {}  # device_id -> merged changes not yet sent
+        self.inflight_since = None
+
+
+class Fanout:
+    def __init__(self, host="0.0.0.0", port=5001, default_room=ALL_DEVICES, ack_timeout=2.0,
+                 cors_allowed_origins=None):
+        self.host = host
+        self.port = port
+        self.default_room = default_room
+        self.ack_timeout = ack_timeout
+        self.app = Flask("fanout")
+        self.socketio = SocketIO(self.app, async_mode="gevent",
+                                 cors_allowed_origins=cors_allowed_origins or allowed_origins())
+        self.clients = {}
+        self.last_state = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._hub = None  # the server thread's gevent hub, once it runs
+        self._hub_ready = threading.Event()
+        self._wake = None
+        self._http = None
+        self._server = threading.Thread(target=self._serve, name="fanout-server", daemon=True)
+
+        self.socketio.on_event("connect", self._on_connect)
+        self.socketio.on_event("disconnect", self._on_disconnect)
+        self.socketio.on_event("subscribe", self._on_subscribe)
+        self.socketio.on_event("unsubscribe", self._on_unsubscribe)
+
+    def start(self):
+        self._running = True
+        self._server.start()
+        self._hub_ready.wait()
+
+    def stop(self):
+        self._running = False
+        if self._http is not None:
+            self._on_hub(self._http.stop, 1)
+            self._notify()
+            self._server.join(timeout=5)
+
+    def _serve(self):
+        self._hub = gevent.get_hub()
+        self._wake = Event()
+        self._http = WSGIServer((self.host, self.port), self.app, log=None, error_log=log)
+        self._http.start()
+        sender = gevent.spawn(self._send_loop)
+        self._hub_ready.set()
+        sender.join()
+
+    def _on_hub(self, function, *args):
+        """Run function in a greenlet on the server's hub; safe from any thread."""
+        if self._hub is not None:
+            self._hub.loop.run_callback_threadsafe(gevent.spawn, function, *args)
+
+    def _notify(self):
+        if self._hub is not None:
+            self._hub.loop.run_callback_threadsafe(self._wake.set)
+
+    # Subscriptions
+
+    def _on_connect(self, auth=None):
+        room = request.args.get("device_id") or (auth or {}).get("device_id") or self.default_room
+        with self._lock:
+            self.clients[request.sid] = _Client()
+        self._subscribe(request.sid, room)
+
+    def _on_disconnect(self, *args):
+        with self._lock:
+            self.clients.pop(request.sid, None)
+
+    def _on_subscribe(self, data):
+        self._subscribe(request.sid, (data or {}).get("device_id") or ALL_DEVICES)
+
+    def _on_unsubscribe(self, data):
+        room = (data or {}).get("device_id") or ALL_DEVICES
+        leave_room(room)
+        with self._lock:
+            client = self.clients.get(request.sid)
+            if client:
+                client.rooms.discard(room)
+                if room != ALL_DEVICES and ALL_DEVICES not in client.rooms:
+                    client.pending.pop(room, None)
+
+    def _subscribe(self, sid, room):
+        join_room(room, sid=sid)
+        with self._lock:
+            client = self.clients.get(sid)
+            if client is None:
+                return
+            client.rooms.add(room)
+            # A new subscriber starts from a full snapshot.
+            devices = self.last_state if room == ALL_DEVICES else {room: self.last_state.get(room)}
+            for device_id, state in devices.items():
+                if state:
+                    client.pending.setdefault(device_id, {}).update(state)
+        self._notify()
+
+    # Publishing
+
+    def publish_state(self, device_id, state):
+        with self._lock:
+            previous = self.last_state.get(device_id, {})
+            changes = {key: value for key, value in state.items() if previous.get(key, object()) != value}
+            if not changes:
+                return
+            self.last_state[device_id] = dict(state)
+            for client in self.clients.values():
+                if device_id in client.rooms or ALL_DEVICES in client.rooms:
+                    client.pending.setdefault(device_id, {}).update(changes)
+        self._notify()
+
+    def publish_alarm(self, data):
+        # Alarms are rare and each one matters, so they are not conflated.
+        device_id = data.get("device_id")
+        rooms = [ALL_DEVICES, device_id] if device_id else [ALL_DEVICES]
+        self._on_hub(lambda: self.socketio.emit("alarm", data, to=rooms))
+
+    def _send_loop(self):
+        # Runs as a greenlet on the server's hub.
+        while self._running:
+            self._wake.wait(self.ack_timeout / 2)
+            self._wake.clear()
+            with self._lock:
+                batches = []
+                now = time.monotonic()
+                for sid, client in self.clients.items():
+                    if client.pending and self._can_send(client, now):
+                        batches.append((sid, client.pending))
+                        client.pending = {}
+                        client.inflight_since = now
+            for sid, pending in batches:
+                self._emit(sid, pending)
+
+    def _can_send(self, client, now):
+        # Clients that never acknowledge still get an update every ack_timeout.
+        return client.inflight_since is None or now - client.inflight_since >= self.ack_timeout
+
+    def _emit(self, sid, pending):
+        items = list(pending.items())
+        try:
+            for i, (device_id, changes) in enumerate(items):
+                payload = dict(changes, device_id=device_id)
+                if i == len(items) - 1:
+                    self.socketio.emit("message", payload, to=sid, callback=lambda *args: self._acked(sid))
+                else:
+                    self.socketio.emit("message", payload, to=sid)
+        except Exception as e:
+            log.warning("emit failed", extra={"sid": sid, "error": e})
+
+    def _acked(self, sid):
+        with self._lock:
+            client = self.clients.get(sid)
+            if client:
+                client.inflight_since = None
+        self._notify()
@@ -0,0 +1,113 @@
+"""Hand MQTT messages off paho's network thread to a pool of ingest workers.
+
+The paho callback only appends the raw message to a bounded queue, so a slow
+decode, alarm check or Influx hiccup can never hold up the network loop and
+its keepalives. Messages are sharded by topic, which keeps each device's
+statuses in order on one worker, and every worker drains its queue in
+batches.
+
+When a queue fills up, the overflow policy decides what goes:
+
+- "conflate" (default) drops the older of several pending messages from the
+  same topic, keeping the latest per device. Only if the queue still holds
+  more distinct devices than it has room for does the oldest message go.
+- "drop_oldest" always drops the oldest pending message.
+"""
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+
+from gpio_api import metrics
+
+log = logging.getLogger("scada.ingest")
+
+POLICIES = ("conflate", "drop_oldest")
+
+
+class _Shard:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.pending = deque()  # (topic, payload, received_at)
+        self.cond = threading.Condition()
+
+    def _conflate(self):
+        """Keep only the newest pending message per topic; returns how many went."""
+        seen = set()
+        kept = deque()
+        for message in reversed(self.pending):
+            if message[0] not in seen:
+                seen.add(message[0])
+                kept.appendleft(message)
+        dropped = len(self.pending) - len(kept)
+        self.pending = kept
+        return dropped
+
+
+class IngestPipeline:
+    def __init__(self, handle_batch, workers=2, capacity=10000, batch_size=200, policy="conflate"):
+        """handle_batch(messages) is called on a worker with a list of (topic, payload, received_at)."""
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown ingest policy: {policy}")
+        self.handle_batch = handle_batch
+        self.batch_size = batch_size
+        self.policy = policy
+        self.shards = [_Shard(max(1, capacity // workers)) for _ in range(workers)]
+        self._running = False
+        self._threads = [
+            threading.Thread(target=self._work, args=(shard,), name=f"ingest-{i}", daemon=True)
+            for i, shard in enumerate(self.shards)
+        ]
+        metrics.ingest_queue_depth.set_function(self.depth)
+        metrics.ingest_lag_seconds.set_function(self.lag)
+
+    def start(self):
+        self._running = True
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._running = False
+        for shard in self.shards:
+            with shard.cond:
+                shard.cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, topic, payload):
+        """Queue one message; never blocks. Called on the MQTT network thread."""
+        shard = self.shards[zlib.crc32(topic.encode()) % len(self.shards)]
+        with shard.cond:
+            if len(shard.pending) >= shard.capacity:
+                if self.policy == "conflate":
+                    metrics.ingest_dropped.labels("conflated").inc(shard._conflate())
+                if len(shard.pending) >= shard.capacity:
+                    shard.pending.popleft()
+                    metrics.ingest_dropped.labels("overflow").inc()
+            shard.pending.append((topic, payload, time.monotonic()))
+            shard.cond.notify()
+
+    def depth(self):
+        return sum(len(shard.pending) for shard in self.shards)
+
+    def lag(self):
+        """Age in seconds of the oldest message still waiting."""
+        now = time.monotonic()
+        oldest = [shard.pending[0][2] for shard in self.shards if shard.pending]
+        return now - min(oldest) if oldest else 0.0
+
+    def _work(self, shard):
+        while True:
+            with shard.cond:
+                while self._running and not shard.pending:
+                    shard.cond.wait()
+                if not shard.pending:
+                    return  # stopped and drained
+                batch = [shard.pending.popleft() for _ in range(min(self.batch_size, len(shard.pending)))]
+            metrics.ingest_batch_size.observe(len(batch))
+            try:
+                self.handle_batch(batch)
+            except Exception as e:
+                metrics.errors.labels("ingest").inc()
+                log.warning("error handling ingest batch", extra={"size": len(batch), "error": e})
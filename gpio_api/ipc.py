@@ -0,0 +1,446 @@
+"""Talking to the control daemon, in this process or in its own.
+
+Exactly one process runs the control loop (python -m gpio_api.daemon). It
+publishes its state as JSON into shared memory segments guarded by a
+sequence counter, so any number of API workers read it without a round trip:
+the settings snapshot in a small segment of its own, written on every change,
+and devices, scheduler and write statistics in a larger one, refreshed every
+PUBLISH_INTERVAL. Everything else goes over a Unix socket as
+newline-delimited JSON commands, including waiting for the next settings
+change, which blocks in the daemon until there is one.
+
+Routes use the same small interface either way: DaemonClient talks to the
+daemon process, LocalDaemon wraps a DaemonWorker running in-process
+(SCADA_DAEMON=embedded, the old single-process setup).
+
+This module is imported by the API, so it must stay cheap to import:
+nothing here pulls in paho, numpy or Influx.
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from multiprocessing import resource_tracker, shared_memory
+
+from gpio_api.system_state import Snapshot
+
+log = logging.getLogger("scada.ipc")
+
+SHM_NAME = os.getenv("DAEMON_SHM_NAME", "scada_state")
+SHM_SIZE = int(os.getenv("DAEMON_SHM_SIZE", 4 * 1024 * 1024))
+STATE_SHM_SIZE = 64 * 1024  # the settings snapshot
+SOCKET_PATH = os.getenv("DAEMON_SOCKET", "/tmp/scada_daemon.sock")
+PUBLISH_INTERVAL = 0.2  # seconds between device publications
+MAX_WAIT = 60  # seconds a wait_for_change command may block
+SWITCH_PINS = {23: "switch_window", 24: "switch_someone_present"}
+
+_HEADER = struct.Struct("<QI")  # sequence (odd while writing), payload length
+
+
+class DaemonUnavailable(RuntimeError):
+    """The control daemon is not running or stopped answering."""
+
+
+class StateSegment:
+    """Single writer, many readers of a JSON document in shared memory (a seqlock)."""
+
+    def __init__(self, name=SHM_NAME, size=SHM_SIZE, create=False):
+        if create:
+            try:
+                shared_memory.SharedMemory(name).unlink()  # left over from a crash
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            _HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # Readers must not unlink the writer's segment when they exit.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.owner = create
+        self._inode = os.fstat(self.shm._fd).st_ino
+        self._sequence = 0
+        self._cached = (None, None)
+
+    def replaced(self):
+        """Whether the segment is gone or a restarted daemon created a new one under the name."""
+        if not os.path.isdir("/dev/shm"):
+            return False  # no way to tell without Linux's shm filesystem
+        try:
+            return os.stat(f"/dev/shm/{self.shm._name.lstrip('/')}").st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def write(self, document):
+        payload = json.dumps(document, default=str).encode()
+        if len(payload) > self.shm.size - _HEADER.size:
+            raise ValueError(f"State of {len(payload)} bytes does not fit DAEMON_SHM_SIZE")
+        buf = self.shm.buf
+        self._sequence += 1
+        _HEADER.pack_into(buf, 0, self._sequence, 0)
+        buf[_HEADER.size:_HEADER.size + len(payload)] = payload
+        self._sequence += 1
+        _HEADER.pack_into(buf, 0, self._sequence, len(payload))
+
+    def read(self):
+        """The latest document; parsed again only when the writer published a new one."""
+        buf = self.shm.buf
+        while True:
+            sequence, length = _HEADER.unpack_from(buf, 0)
+            if sequence == self._cached[0]:
+                return self._cached[1]
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            payload = bytes(buf[_HEADER.size:_HEADER.size + length])
+            if _HEADER.unpack_from(buf, 0)[0] == sequence:
+                document = json.loads(payload) if length else {}
+                self._cached = (sequence, document)
+                return document
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _points_to_wire(points):
+    return [{"time": p["time"].timestamp(), "value": p["value"]} for p in points]
+
+
+def _points_from_wire(points):
+    return [{"time": datetime.fromtimestamp(p["time"], timezone.utc), "value": p["value"]} for p in points]
+
+
+class LocalDaemon:
+    """The daemon interface over a DaemonWorker in this process."""
+
+    def __init__(self, worker):
+        from gpio_api.system_state import system_state
+        self.worker = worker
+        self.system_state = system_state
+
+    def primary_device(self):
+        device = self.worker.primary_device()
+        return device.to_dict() if device else None
+
+    def devices(self):
+        return [device.to_dict() for device in self.worker.devices.all()]
+
+    def device(self, device_id):
+        device = self.worker.devices.get(device_id)
+        return device.to_dict() if device else None
+
+    def get_switch(self, pin):
+        return self.worker.get_switch(pin)
+
+    def scheduler_stats(self):
+        return self.worker.scheduler.stats()
+
+    def write_stats(self):
+        return self.worker.influx_client.write_stats()
+
+    def set_led(self, action, pins, device_id=None):
+        self.worker.set_led(action, pins, device_id)
+
+    def history_query(self, measurement, start, stop, max_points, agg, device_id):
+        return self.worker.history.query(measurement, start, stop, max_points, agg, device_id)
+
+    def history_columns(self, measurements, start, stop, max_points, agg, device_id):
+        return self.worker.history.query_columns(measurements, start, stop, max_points, agg, device_id)
+
+    def metrics_text(self):
+        from gpio_api.metrics import registry
+        return registry.render()
+
+    def state_document(self):
+        return {
+            "primary": self.primary_device(),
+            "devices": self.devices(),
+            "scheduler": self.scheduler_stats(),
+            "write_stats": self.write_stats(),
+            "published_at": time.time(),
+        }
+
+
+class DaemonService:
+    """Publishes a LocalDaemon's state to shared memory and serves commands on a Unix socket."""
+
+    COMMANDS = {"update_state", "wait_for_change", "set_led", "history_query", "history_columns", "metrics_text"}
+
+    def __init__(self, local, socket_path=SOCKET_PATH, shm_name=SHM_NAME, shm_size=SHM_SIZE):
+        self.local = local
+        self.socket_path = socket_path
+        # Exactly one control loop: refuse to take over from a live daemon.
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise RuntimeError(f"A control daemon is already running on {socket_path}")
+        except OSError:
+            pass
+        finally:
+            probe.close()
+        self.segment = StateSegment(shm_name, shm_size, create=True)
+        self.state_segment = StateSegment(f"{shm_name}_state", STATE_SHM_SIZE, create=True)
+        self._stopped = threading.Event()
+        self._publish_lock = threading.Lock()  # a segment takes one writer at a time
+        self._state_lock = threading.Lock()
+        self._running = False
+        self._publisher = threading.Thread(target=self._publish_loop, name="ipc-publisher", daemon=True)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(service._dispatch(line) + b"\n")
+
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self.server.daemon_threads = True
+        self._server_thread = threading.Thread(target=self.server.serve_forever, name="ipc-server", daemon=True)
+
+    def start(self):
+        self._running = True
+        self.local.system_state.subscribe(self._on_state_change)
+        self._publish_state()
+        self._publish()
+        self._publisher.start()
+        self._server_thread.start()
+        log.info("daemon ipc ready", extra={"socket": self.socket_path, "shm": self.segment.shm.name})
+
+    def stop(self):
+        self._running = False
+        self._stopped.set()
+        self.local.system_state.unsubscribe(self._on_state_change)
+        self.server.shutdown()
+        self.server.server_close()
+        self.segment.close()
+        self.state_segment.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _on_state_change(self, previous, snapshot):
+        # Published before update() returns, so whoever is woken by the
+        # change already reads it here.
+        self._publish_state()
+
+    def _publish_state(self):
+        try:
+            with self._state_lock:
+                # The latest snapshot, in case updates overtook each other.
+                self.state_segment.write(self.local.system_state.snapshot._asdict())
+        except Exception as e:
+            log.warning("could not publish state", extra={"error": e})
+
+    def _publish(self):
+        try:
+            with self._publish_lock:
+                self.segment.write(self.local.state_document())
+        except Exception as e:
+            log.warning("could not publish state", extra={"error": e})
+
+    def _publish_loop(self):
+        while not self._stopped.wait(PUBLISH_INTERVAL):
+            self._publish()
+
+    def _dispatch(self, line):
+        try:
+            request = json.loads(line)
+            command, args = request["cmd"], request.get("args", {})
+            if command not in self.COMMANDS:
+                raise ValueError(f"Unknown command: {command}")
+            result = getattr(self, "_" + command)(**args)
+            response = {"ok": True, "result": result}
+        except ValueError as e:
+            response = {"ok": False, "error": str(e), "type": "ValueError"}
+        except Exception as e:
+            log.warning("command failed", extra={"error": e})
+            response = {"ok": False, "error": str(e), "type": type(e).__name__}
+        return json.dumps(response, default=str).encode()
+
+    def _update_state(self, changes):
+        return self.local.system_state.update(**changes)._asdict()
+
+    def _wait_for_change(self, version, timeout, epoch=None):
+        # Each waiting client holds one connection, and so one handler thread.
+        return self.local.system_state.wait_for_change(version, min(timeout, MAX_WAIT), epoch)._asdict()
+
+    def _set_led(self, action, pins, device_id=None):
+        self.local.set_led(action, pins, device_id)
+
+    def _history_query(self, **args):
+        points = self.local.history_query(**args)
+        return None if points is None else _points_to_wire(points)
+
+    def _history_columns(self, **args):
+        return self.local.history_columns(**args)
+
+    def _metrics_text(self):
+        return self.local.metrics_text()
+
+
+class RemoteSystemState:
+    """system_state's interface, backed by the daemon process."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def snapshot(self):
+        return Snapshot(**self.client.state())
+
+    def update(self, **changes):
+        return Snapshot(**self.client.call("update_state", changes=changes))
+
+    def wait_for_change(self, version, timeout=None, epoch=None):
+        snapshot = self.snapshot
+        if snapshot.version != version or epoch not in (None, snapshot.epoch):
+            return snapshot
+        timeout = MAX_WAIT if timeout is None else timeout
+        return Snapshot(**self.client.call("wait_for_change", version=version, timeout=timeout, epoch=epoch))
+
+
+class DaemonClient:
+    """The daemon interface over shared memory and a pool of command connections."""
+
+    def __init__(self, socket_path=SOCKET_PATH, shm_name=SHM_NAME, max_idle=8):
+        self.socket_path = socket_path
+        self.shm_name = shm_name
+        self._segments = {}
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self.system_state = RemoteSystemState(self)
+
+    def _read(self, name):
+        segment = self._segments.get(name)
+        if segment is not None and segment.replaced():
+            del self._segments[name]
+            segment.close()
+            segment = None
+        if segment is None:
+            try:
+                segment = self._segments[name] = StateSegment(name)
+            except FileNotFoundError:
+                raise DaemonUnavailable("Control daemon is not running (python -m gpio_api.daemon)")
+        return segment.read()
+
+    def document(self):
+        return self._read(self.shm_name)
+
+    def state(self):
+        return self._read(f"{self.shm_name}_state")
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise DaemonUnavailable("Control daemon is not running (python -m gpio_api.daemon)")
+        return sock, sock.makefile("rb")
+
+    def call(self, command, **args):
+        request = json.dumps({"cmd": command, "args": args}).encode() + b"\n"
+        for attempt in (1, 2):
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            sock, reader = connection
+            try:
+                sock.sendall(request)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("daemon closed the connection")
+            except OSError:
+                # A pooled connection may predate a daemon restart; retry on a fresh one.
+                sock.close()
+                if attempt == 2:
+                    raise DaemonUnavailable("Lost connection to the control daemon")
+                continue
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                sock.close()
+            response = json.loads(line)
+            if response["ok"]:
+                return response["result"]
+            if response.get("type") == "ValueError":
+                raise ValueError(response["error"])
+            raise RuntimeError(response["error"])
+
+    def primary_device(self):
+        return self.document()["primary"]
+
+    def devices(self):
+        return self.document()["devices"]
+
+    def device(self, device_id):
+        return next((d for d in self.devices() if d["device_id"] == device_id), None)
+
+    def get_switch(self, pin):
+        device = self.primary_device()
+        return device.get(SWITCH_PINS[pin]) if device and pin in SWITCH_PINS else None
+
+    def scheduler_stats(self):
+        return self.document()["scheduler"]
+
+    def write_stats(self):
+        return self.document()["write_stats"]
+
+    def set_led(self, action, pins, device_id=None):
+        self.call("set_led", action=action, pins=pins, device_id=device_id)
+
+    def history_query(self, measurement, start, stop, max_points, agg, device_id):
+        points = self.call("history_query", measurement=measurement, start=start, stop=stop,
+                           max_points=max_points, agg=agg, device_id=device_id)
+        return None if points is None else _points_from_wire(points)
+
+    def history_columns(self, measurements, start, stop, max_points, agg, device_id):
+        return self.call("history_columns", measurements=measurements, start=start, stop=stop,
+                         max_points=max_points, agg=agg, device_id=device_id)
+
+    def metrics_text(self):
+        return self.call("metrics_text")
+
+
+class Lazy:
+    """Builds the wrapped object on first use, so importing the routes connects to nothing."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def daemon_mode():
+    return os.getenv("SCADA_DAEMON", "external")
+
+
+def connect():
+    """The daemon interface for this process, per SCADA_DAEMON."""
+    if daemon_mode() == "embedded":
+        from gpio_api.daemon_worker import DaemonWorker
+        worker = DaemonWorker()
+        worker.start()
+        return LocalDaemon(worker)
+    return DaemonClient()
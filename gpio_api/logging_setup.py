@@ -0,0 +1,63 @@
+import logging
+import os
+import threading
+import time
+
+# Attributes every LogRecord has; anything else came in through extra={...}.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as `time level logger message key=value ...`."""
+
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        fields = [f"{key}={value}" for key, value in vars(record).items() if key not in _RECORD_ATTRS]
+        if fields:
+            line += " " + " ".join(fields)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `burst` records per message template per `period` seconds."""
+
+    def __init__(self, burst=10, period=1.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                if suppressed:
+                    record.suppressed = suppressed
+                started, count, suppressed = now, 0, 0
+            if count >= self.burst:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            self._windows[key] = (started, count + 1, suppressed)
+        return True
+
+
+def configure_logging():
+    """Set up the `scada` loggers from LOG_LEVEL, LOG_RATE_BURST and LOG_RATE_PERIOD."""
+    logger = logging.getLogger("scada")
+    if logger.handlers:
+        return logger
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter())
+    handler.addFilter(RateLimitFilter(
+        burst=int(os.getenv("LOG_RATE_BURST", 10)),
+        period=float(os.getenv("LOG_RATE_PERIOD", 1.0)),
+    ))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+    return logger
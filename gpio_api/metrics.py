@@ -0,0 +1,208 @@
+"""Process metrics rendered in the Prometheus text exposition format."""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_label_text(self.labelnames, values)} {_number(child.value)}"]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function else self.value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+    def _render_child(self, values, child):
+        try:
+            value = child.get()
+        except Exception:
+            return []
+        return [f"{self.name}{_label_text(self.labelnames, values)} {_number(value)}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _label_text(self.labelnames, values, ("le", _number(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _label_text(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_number(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        if not metric.labelnames:
+            metric.labels()  # so unlabelled metrics are exported from the start
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+mqtt_messages = registry.counter("scada_mqtt_messages_total", "MQTT status messages received.")
+backlog_statuses = registry.counter(
+    "scada_backlog_statuses_total", "Spooled statuses devices forwarded after reconnecting.")
+mqtt_handle_seconds = registry.histogram(
+    "scada_mqtt_handle_seconds", "Time spent processing one MQTT status message.")
+status_to_control_seconds = registry.histogram(
+    "scada_status_to_control_seconds", "Delay from a status arriving to the control tick that handles it.")
+control_tick_seconds = registry.histogram(
+    "scada_control_tick_seconds", "Duration of one control pass over the due devices.")
+control_jitter_seconds = registry.gauge(
+    "scada_control_jitter_seconds", "Running jitter of the status-to-control delay.")
+influx_write_seconds = registry.histogram(
+    "scada_influx_write_seconds", "Latency of one Influx write request.")
+websocket_emit_seconds = registry.histogram(
+    "scada_websocket_emit_seconds", "Latency of one websocket emit.", ["event"])
+alarms = registry.counter("scada_alarms_total", "Alarms raised.", ["alarm"])
+errors = registry.counter("scada_errors_total", "Errors caught on hot paths.", ["component"])
+devices = registry.gauge("scada_devices", "Devices currently tracked by the daemon.")
+influx_queue_depth = registry.gauge("scada_influx_queue_depth", "Points waiting in the Influx write buffer.")
+ingest_queue_depth = registry.gauge("scada_ingest_queue_depth", "MQTT messages waiting for an ingest worker.")
+ingest_lag_seconds = registry.gauge("scada_ingest_lag_seconds", "Age of the oldest MQTT message waiting for ingest.")
+ingest_dropped = registry.counter(
+    "scada_ingest_dropped_total", "MQTT messages dropped because the ingest queue was full.", ["reason"])
+ingest_batch_size = registry.histogram(
+    "scada_ingest_batch_size", "Messages handled per ingest batch.", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+switch_events = registry.counter("scada_switch_events_total", "Switch change events received from devices.")
+switch_to_command_seconds = registry.histogram(
+    "scada_switch_to_command_seconds", "Delay from a switch event arriving to the fan stop command going out.")
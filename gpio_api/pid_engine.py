@@ -0,0 +1,111 @@
+"""PID control for many zones at once, with all state held in NumPy arrays.
+
+- derivative on measurement, so setpoint changes do not kick the output;
+- conditional integration anti-windup: the integral stops growing while the
+  output is saturated in the direction the error is pushing;
+- bumpless gain and setpoint changes: the integral is kept as its
+  contribution to the output (Ki times the integrated error), so changing Ki,
+  even to 0, leaves it as it was. Where Ki is not 0 it also absorbs the
+  proportional and derivative steps of the change so the output does not
+  jump; without integral action nothing would ever bleed that offset off, so
+  there the change takes effect at once.
+"""
+import threading
+
+import numpy as np
+
+
+class PIDEngine:
+    def __init__(self, output_limits=(-100, 100), capacity=16):
+        self.output_min, self.output_max = output_limits
+        self.zones = {}
+        self._lock = threading.Lock()
+        self._size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        def grow(name, dtype=float):
+            new = np.zeros(capacity, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:len(old)] = old
+            setattr(self, name, new)
+
+        # integral is the integral term in output units, Ki * integral of error dt.
+        for name in ("kp", "ki", "kd", "setpoint", "integral", "last_measurement", "last_error", "last_derivative"):
+            grow(name)
+        grow("initialized", bool)
+
+    def add_zone(self, zone_id, Kp, Ki, Kd, setpoint):
+        with self._lock:
+            index = self.zones.get(zone_id)
+            if index is not None:
+                return index
+            index = self._size
+            if index >= len(self.kp):
+                self._allocate(2 * len(self.kp))
+            self.zones[zone_id] = index
+            self._size += 1
+            self.kp[index], self.ki[index], self.kd[index] = Kp, Ki, Kd
+            self.setpoint[index] = setpoint
+            self.integral[index] = 0.0
+            self.initialized[index] = False
+            return index
+
+    def indices(self, zone_ids):
+        return np.array([self.zones[zone_id] for zone_id in zone_ids], dtype=np.intp)
+
+    def _all(self, index):
+        return slice(0, self._size) if index is None else index
+
+    def set_gains(self, Kp, Ki, Kd, index=None):
+        """Change gains for the given zones (all when index is None) without a bump."""
+        with self._lock:
+            index = self._all(index)
+            shape = self.kp[index].shape
+            Kp, Ki, Kd = (np.broadcast_to(np.asarray(gain, dtype=float), shape) for gain in (Kp, Ki, Kd))
+            # The last output is reproduced with the new gains when the
+            # integral term takes up the change: I' = I + (Kp - Kp') * e + (Kd - Kd') * d.
+            # Ki only scales what is integrated from now on.
+            integral = (self.integral[index]
+                        + (self.kp[index] - Kp) * self.last_error[index]
+                        + (self.kd[index] - Kd) * self.last_derivative[index])
+            integral = np.where(Ki != 0, integral, self.integral[index])
+            self.integral[index] = np.where(self.initialized[index], integral, 0.0)
+            self.kp[index], self.ki[index], self.kd[index] = Kp, Ki, Kd
+
+    def set_setpoint(self, setpoint, index=None):
+        """Move the setpoint; the integral absorbs the proportional step."""
+        with self._lock:
+            index = self._all(index)
+            delta = np.asarray(setpoint, dtype=float) - self.setpoint[index]
+            bumpless = self.initialized[index] & (self.ki[index] != 0)
+            self.integral[index] -= np.where(bumpless, self.kp[index] * delta, 0.0)
+            self.last_error[index] += delta
+            self.setpoint[index] = setpoint
+
+    def step(self, index, measurements, dt):
+        """Advance the given zones by dt seconds (scalar or per zone) and return their outputs."""
+        measurements = np.asarray(measurements, dtype=float)
+        dt = np.maximum(np.asarray(dt, dtype=float), 1e-6)
+        with self._lock:
+            error = self.setpoint[index] - measurements
+            initialized = self.initialized[index]
+            derivative = np.where(initialized, -(measurements - self.last_measurement[index]) / dt, 0.0)
+
+            integral = self.integral[index] + self.ki[index] * error * dt
+            unclamped = self.kp[index] * error + integral + self.kd[index] * derivative
+            output = np.clip(unclamped, self.output_min, self.output_max)
+            # Only integrate when not saturated, or when the error pulls the
+            # output back out of saturation.
+            saturated = ((unclamped > self.output_max) & (error > 0)) | ((unclamped < self.output_min) & (error < 0))
+            self.integral[index] = np.where(saturated, self.integral[index], integral)
+
+            self.last_measurement[index] = measurements
+            self.last_error[index] = error
+            self.last_derivative[index] = derivative
+            self.initialized[index] = True
+        return output
+
+    def __len__(self):
+        return self._size
@@ -1,13 +1,29 @@
-from flask import Blueprint, request, jsonify, current_app
-from gpio_api.system_state import system_state
-from gpio_api.daemon_worker import DaemonWorker
-from repository.influx_repository import InfluxRepository
+import json
+import logging
+from datetime import timedelta
+from flask import Blueprint, Response, request, jsonify, current_app
+from gpio_api import ipc
+from repository.downsampling import parse_time
+from repository.export import DEFAULT_CHUNK, MEASUREMENTS as HISTORY_MEASUREMENTS, csv_stream, export_rows, parse_cursor
+
+log = logging.getLogger("scada.api")
 
 gpio_blueprint = Blueprint('gpio', __name__)
 
-daemon = DaemonWorker()
-influx = InfluxRepository()
-daemon.start()
+def _influx():
+    from repository.influx_repository import InfluxRepository
+    return InfluxRepository(read_only=True)
+
+# The control loop runs in the daemon process (or in this one with
+# SCADA_DAEMON=embedded); both are connected on first use, so importing the
+# routes stays fast and every worker process gets its own connections.
+daemon = ipc.Lazy(ipc.connect)
+influx = ipc.Lazy(_influx)
+system_state = ipc.Lazy(lambda: daemon.system_state)
+
+@gpio_blueprint.errorhandler(ipc.DaemonUnavailable)
+def daemon_unavailable(e):
+    return jsonify({"error": str(e)}), 503
 
 @gpio_blueprint.route('/')
 def home():
@@ -16,9 +32,26 @@ def home():
 # Temperature
 @gpio_blueprint.route('/temperature', methods=['GET'])
 def get_temperature():
-    temp = daemon.temperature
+    device = daemon.primary_device()
+    temp = device["temperature"] if device else None
     return jsonify({"temperature_celsius": temp})
 
+# Fleet
+@gpio_blueprint.route('/devices', methods=['GET'])
+def get_devices():
+    return jsonify(daemon.devices())
+
+@gpio_blueprint.route('/scheduler', methods=['GET'])
+def get_scheduler_stats():
+    return jsonify(daemon.scheduler_stats())
+
+@gpio_blueprint.route('/devices/<device_id>', methods=['GET'])
+def get_device(device_id):
+    device = daemon.device(device_id)
+    if device is None:
+        return jsonify({"error": "Unknown device"}), 404
+    return jsonify(device)
+
 # LED Control
 @gpio_blueprint.route('/led/<int:pin>/on', methods=['POST'])
 def turn_on_led(pin):
@@ -51,8 +84,8 @@ def set_mode():
     mode = data.get("mode")
     if mode not in ["manual", "auto", "pid"]:
         return jsonify({"error": "Invalid mode"}), 400
-    system_state.mode = mode
-    return jsonify({"mode": system_state.mode})
+    state = system_state.update(mode=mode)
+    return jsonify({"mode": state.mode})
 
 @gpio_blueprint.route('/manual_speed', methods=['POST'])
 def set_manual_speed():
@@ -60,70 +93,203 @@ def set_manual_speed():
     speed = data.get("speed")
     if speed not in [0, 1, 2, 3]:
         return jsonify({"error": "Invalid speed"}), 400
-    system_state.manual_speed = speed
-    return jsonify({"manual_speed": system_state.manual_speed})
+    state = system_state.update(manual_speed=speed)
+    return jsonify({"manual_speed": state.manual_speed})
 
 @gpio_blueprint.route('/pid_params', methods=['POST'])
 def set_pid_params():
-    print(f"[ROUTING] Received PID params: {request.json}")
     data = request.json
-    print(f"[ROUTING] Received PID params: {data}")
     Kp = data.get("kp")
     Ki = data.get("ki")
     Kd = data.get("kd")
     target_temp = data.get("target_temp")
     if None in (Kp, Ki, Kd):
         return jsonify({"error": "Missing PID parameters"}), 400
-    system_state.pid_params = {"Kp": Kp, "Ki": Ki, "Kd": Kd}
-    system_state.target_temperature = target_temp
-    print(f"[ROUTING] Updated PID params: {system_state.pid_params}")
-    return jsonify({"pid_params": system_state.pid_params})
+    changes = {"pid_params": {"Kp": Kp, "Ki": Ki, "Kd": Kd}}
+    if target_temp is not None:
+        changes["target_temperature"] = target_temp
+    # Gains and target change together in one snapshot.
+    state = system_state.update(**changes)
+    log.info("pid params updated", extra={"pid_params": state.pid_params, "target": state.target_temperature})
+    return jsonify({"pid_params": state.pid_params})
+
+
 
+MAX_STATUS_WAIT = 30  # seconds
+STREAM_KEEPALIVE = 15  # seconds between comments on an idle event stream
 
+def _status_body(state):
+    return {
+        "epoch": state.epoch,
+        "version": state.version,
+        "mode": state.mode,
+        "manual_speed": state.manual_speed,
+        "pid_params": state.pid_params,
+        "pid_value": state.pid_value,
+        "status_message": state.status_message,
+        "target_temperature": state.target_temperature
+    }
 
+def _conditional(response):
+    # Clients revalidate every time and get an empty 304 when nothing changed.
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+# Long poll: with ?version=N&epoch=E the request waits (up to ?wait seconds)
+# until the state moves past version N, so clients hear about changes without
+# polling. Versions restart with the daemon; a version of another epoch is
+# answered at once, and the epoch is part of the ETag.
 @gpio_blueprint.route('/status', methods=['GET'])
 def get_status():
-    return jsonify({
-        "mode": system_state.mode,
-        "manual_speed": system_state.manual_speed,
-        "pid_params": system_state.pid_params,
-        "pid_value": system_state.pid_value,
-        "status_message": system_state.status_message,
-        "target_temperature": system_state.target_temperature    
-    })
+    state = system_state.snapshot
+    version = request.args.get("version", type=int)
+    epoch = request.args.get("epoch")
+    if version is not None and version == state.version and epoch in (None, state.epoch):
+        wait = min(request.args.get("wait", MAX_STATUS_WAIT, type=float), MAX_STATUS_WAIT)
+        state = system_state.wait_for_change(version, max(0.0, wait), epoch)
+    response = jsonify(_status_body(state))
+    response.set_etag(f"status-{state.epoch}-{state.version}")
+    return _conditional(response)
 
-@gpio_blueprint.route('/influx/temperature', methods=['GET'])
-def get_recent_temperatures():
+def _event_id(state):
+    return f"{state.epoch}-{state.version}"
+
+def _parse_event_id(event_id):
+    """(epoch, version) from a Last-Event-ID, or (None, None)."""
+    epoch, _, version = (event_id or "").rpartition("-")
+    try:
+        return epoch, int(version)
+    except ValueError:
+        return None, None
+
+# Server-Sent Events: one event per state change, instead of polling /status.
+@gpio_blueprint.route('/status/stream', methods=['GET'])
+def stream_status():
+    last_epoch, last_version = _parse_event_id(request.headers.get("Last-Event-ID"))
+
+    def events():
+        epoch, version = last_epoch, last_version
+        while True:
+            state = system_state.wait_for_change(version, STREAM_KEEPALIVE, epoch)
+            if (state.epoch, state.version) == (epoch, version):
+                yield ": keepalive\n\n"
+                continue
+            epoch, version = state.epoch, state.version
+            yield f"id: {_event_id(state)}\nevent: status\ndata: {json.dumps(_status_body(state))}\n\n"
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+DEFAULT_MAX_POINTS = 1000
+
+def _history_args():
+    max_points = request.args.get("max_points", DEFAULT_MAX_POINTS, type=int)
+    if max_points is not None and max_points <= 0:
+        max_points = None
+    return {
+        "time_range": request.args.get("start", "-1h"),
+        "stop": request.args.get("stop"),
+        "max_points": max_points,
+        "device_id": request.args.get("device_id"),
+    }
+
+def _history_response(measurement, read, default_agg):
     try:
-        temperatures = influx.read_recent_temperatures()
-        return jsonify(temperatures), 200
+        args = _history_args()
+        agg = request.args.get("agg", default_agg)
+        # Recent ranges come straight from the daemon's ring buffers; only
+        # ranges reaching past them go to Influx.
+        states = daemon.history_query(
+            measurement, args["time_range"], args["stop"], args["max_points"], agg, args["device_id"]
+        )
+        if states is None:
+            states = read(agg=agg, **args)
+        response = jsonify(states)
+        response.add_etag()
+        return _conditional(response)
+    except ipc.DaemonUnavailable:
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@gpio_blueprint.route('/influx/temperature', methods=['GET'])
+def get_recent_temperatures():
+    return _history_response("temperature_data", influx.read_recent_temperatures, "mean")
+
 # Get recent windows switch states
 @gpio_blueprint.route('/influx/windows_switch', methods=['GET'])
 def get_recent_windows_switch():
-    try:
-        states = influx.read_recent_windows_switch()
-        return jsonify(states), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return _history_response("windows_switch", influx.read_recent_windows_switch, "last")
 
 # Get recent present switch states
 @gpio_blueprint.route('/influx/present_switch', methods=['GET'])
 def get_recent_present_switch():
-    try:
-        states = influx.read_recent_present_switch()
-        return jsonify(states), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return _history_response("present_switch", influx.read_recent_present_switch, "last")
 
 # Get recent fan speeds
 @gpio_blueprint.route('/influx/fan_speed', methods=['GET'])
 def get_recent_fan_speed():
+    return _history_response("fan_speed", influx.read_recent_fan_speed, "mean")
+
+# Any set of measurements in one response: a shared "time" column (epoch ms)
+# and one value column per measurement under "series".
+@gpio_blueprint.route('/influx/history', methods=['GET'])
+def get_history_columns():
     try:
-        speeds = influx.read_recent_fan_speed()
-        return jsonify(speeds), 200
+        measurements = request.args.get("measurements")
+        measurements = measurements.split(",") if measurements else list(HISTORY_MEASUREMENTS)
+        unknown = [m for m in measurements if m not in HISTORY_MEASUREMENTS]
+        if unknown:
+            return jsonify({"error": f"Unknown measurements: {', '.join(unknown)}"}), 400
+        args = _history_args()
+        agg = request.args.get("agg", "mean")
+        columns = daemon.history_columns(
+            measurements, args["time_range"], args["stop"], args["max_points"], agg, args["device_id"]
+        )
+        if columns is None:
+            columns = influx.read_columns(measurements, args["time_range"], args["stop"], args["max_points"],
+                                          agg, args["device_id"])
+        response = jsonify(columns)
+        response.add_etag()
+        return _conditional(response)
+    except ipc.DaemonUnavailable:
+        raise
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    
+
+# Raw history as CSV, streamed chunk by chunk. If a download breaks off, pass
+# the last row received as ?cursor=<time>/<measurement>/<device_id> to continue.
+@gpio_blueprint.route('/influx/export', methods=['GET'])
+def export_history():
+    try:
+        measurements = request.args.get("measurements")
+        measurements = measurements.split(",") if measurements else list(HISTORY_MEASUREMENTS)
+        unknown = [m for m in measurements if m not in HISTORY_MEASUREMENTS]
+        if unknown:
+            return jsonify({"error": f"Unknown measurements: {', '.join(unknown)}"}), 400
+        start = parse_time(request.args.get("start", "-24h"))
+        stop = parse_time(request.args.get("stop"))
+        chunk_hours = request.args.get("chunk_hours", DEFAULT_CHUNK.total_seconds() / 3600, type=float)
+        if chunk_hours <= 0:
+            return jsonify({"error": "chunk_hours must be positive"}), 400
+        chunk = timedelta(hours=chunk_hours)
+        cursor = request.args.get("cursor")
+        if cursor:
+            parse_cursor(cursor)  # reject a bad cursor before the stream starts
+        rows = export_rows(influx, measurements, start, stop, request.args.get("device_id"), chunk, cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(csv_stream(rows, header=not cursor), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=history.csv"})
+
+@gpio_blueprint.route('/influx/write_stats', methods=['GET'])
+def get_write_stats():
+    return jsonify(daemon.write_stats()), 200
+
+@gpio_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(daemon.metrics_text(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from gpio_api import metrics
+
+
+class ControlScheduler:
+    """Wakes the control loop when new statuses arrive instead of polling.
+
+    A tick runs as soon as a device reports, but never sooner than min_period
+    after the previous tick, so bursts of messages coalesce into one pass over
+    the devices that changed. If nothing arrives for max_period a heartbeat
+    tick covers the whole fleet so mode and setpoint changes still apply.
+    """
+
+    def __init__(self, min_period=0.5, max_period=5.0):
+        self.min_period = min_period
+        self.max_period = max_period
+        self._cond = threading.Condition()
+        self._pending = {}  # device_id -> monotonic time of first unhandled status
+        self._last_tick = time.monotonic()
+        self._running = True
+        self._stats = {
+            "ticks": 0,
+            "event_ticks": 0,
+            "heartbeat_ticks": 0,
+            "latency_last": 0.0,
+            "latency_max": 0.0,
+            "latency_sum": 0.0,
+            "latency_count": 0,
+            "jitter": 0.0,
+            "tick_duration_last": 0.0,
+            "tick_duration_max": 0.0,
+        }
+
+    def notify(self, device_id=None, arrived=None):
+        """Request a tick; `arrived` is when the triggering status came in (time.monotonic())."""
+        with self._cond:
+            self._pending.setdefault(device_id, arrived or time.monotonic())
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def wait_for_tick(self):
+        """Block until the next tick; returns the due device ids, or None for all."""
+        with self._cond:
+            heartbeat = False
+            while self._running:
+                since = time.monotonic() - self._last_tick
+                if since >= self.max_period:
+                    heartbeat = True
+                    break
+                if self._pending and since >= self.min_period:
+                    break
+                timeout = (self.min_period if self._pending else self.max_period) - since
+                self._cond.wait(timeout)
+
+            now = time.monotonic()
+            pending, self._pending = self._pending, {}
+            self._last_tick = now
+            self._record_latencies(now, pending.values())
+            self._stats["ticks"] += 1
+            self._stats["heartbeat_ticks" if heartbeat else "event_ticks"] += 1
+            if heartbeat or None in pending:
+                return None
+            return list(pending)
+
+    def record_tick(self, duration):
+        with self._cond:
+            self._stats["tick_duration_last"] = duration
+            self._stats["tick_duration_max"] = max(self._stats["tick_duration_max"], duration)
+
+    def _record_latencies(self, now, arrivals):
+        stats = self._stats
+        for arrived in arrivals:
+            latency = now - arrived
+            metrics.status_to_control_seconds.observe(latency)
+            # RFC 3550 style running jitter of the status-to-tick latency.
+            stats["jitter"] += (abs(latency - stats["latency_last"]) - stats["jitter"]) / 16
+            stats["latency_last"] = latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["latency_sum"] += latency
+            stats["latency_count"] += 1
+        metrics.control_jitter_seconds.set(stats["jitter"])
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+        count = stats.pop("latency_count")
+        stats["latency_mean"] = stats.pop("latency_sum") / count if count else 0.0
+        stats["pending"] = len(self._pending)
+        return stats
@@ -1,10 +1,95 @@
+"""Controller settings and status, published as immutable versioned snapshots.
+
+Readers take `system_state.snapshot` once and use its fields, so they always
+see one consistent state without taking a lock. Writers call update(), which
+builds the next snapshot and swaps it in as a single attribute assignment,
+then wakes anyone waiting in wait_for_change() and calls the subscribers.
+
+Versions count from 0 in every process, so each snapshot also carries the
+epoch of the state it belongs to; a (version, epoch) pair from before a
+restart never matches the new state.
+"""
+import threading
+import uuid
+from collections import namedtuple
+
+Snapshot = namedtuple(
+    "Snapshot",
+    ["epoch", "version", "mode", "manual_speed", "pid_params", "target_temperature",
+     "current_speed", "pid_value", "status_message"],
+)
+
+# Fields set from the API that change what the control loop does; the rest
+# is status the control loop reports back.
+CONTROL_FIELDS = ("mode", "manual_speed", "pid_params", "target_temperature")
+
+
+def controls_changed(previous, snapshot):
+    return any(getattr(previous, field) != getattr(snapshot, field) for field in CONTROL_FIELDS)
+
+
 class SystemState:
     def __init__(self):
-        self.mode = "manual"  # manual / auto / pid
-        self.manual_speed = 0  # 0 = off, 1 = speed1, 2 = speed2, 3 = speed3
-        self.pid_params = {"Kp": 1.0, "Ki": 0.1, "Kd": 1.0}
-        self.target_temperature = 22.0  # Ideal room temp
-        self.pid_value = 0  # Last PID output (0-100%)
-        self.status_message = "Message"
+        self._snapshot = Snapshot(
+            epoch=uuid.uuid4().hex[:12],
+            version=0,
+            mode="manual",  # manual / auto / pid
+            manual_speed=0,  # 0 = off, 1 = speed1, 2 = speed2, 3 = speed3
+            pid_params={"Kp": 1.0, "Ki": 0.1, "Kd": 1.0},  # replaced, never mutated
+            target_temperature=22.0,  # Ideal room temp
+            current_speed=0,
+            pid_value=0,  # Last PID output (0-100%)
+            status_message="Message",
+        )
+        self._cond = threading.Condition()
+        self._subscribers = []
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def update(self, **changes):
+        """Publish a new snapshot with the given fields changed; returns it."""
+        if "pid_params" in changes:
+            changes["pid_params"] = dict(changes["pid_params"])
+        with self._cond:
+            previous = self._snapshot
+            if all(getattr(previous, field) == value for field, value in changes.items()):
+                return previous
+            snapshot = previous._replace(version=previous.version + 1, **changes)
+            self._snapshot = snapshot
+            self._cond.notify_all()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(previous, snapshot)
+        return snapshot
+
+    def subscribe(self, callback):
+        """Call callback(previous, snapshot) after every change."""
+        with self._cond:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._cond:
+            self._subscribers.remove(callback)
+
+    def wait_for_change(self, version, timeout=None, epoch=None):
+        """Block until the version differs from the given one; returns the current snapshot.
+
+        A version of another epoch is already out of date, so that returns at once.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._snapshot.version != version or
+                                epoch not in (None, self._snapshot.epoch), timeout)
+            return self._snapshot
+
+    # Read-only views of the current snapshot.
+    mode = property(lambda self: self._snapshot.mode)
+    manual_speed = property(lambda self: self._snapshot.manual_speed)
+    pid_params = property(lambda self: self._snapshot.pid_params)
+    target_temperature = property(lambda self: self._snapshot.target_temperature)
+    current_speed = property(lambda self: self._snapshot.current_speed)
+    pid_value = property(lambda self: self._snapshot.pid_value)
+    status_message = property(lambda self: self._snapshot.status_message)
 
 system_state = SystemState()
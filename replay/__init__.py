@@ -0,0 +1,3 @@
+from replay.engine import History, replay, run_candidates, candidate_grid
+
+__all__ = ["History", "replay", "run_candidates", "candidate_grid"]
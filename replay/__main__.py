@@ -0,0 +1,68 @@
+"""Backtest control settings against recorded history.
+
+    python -m replay --file history.csv --mode auto --low 1,2,3 --high 4,5,6
+    python -m replay --start -7d --device-id room1 --mode pid --kp 0.5,1,2 --ki 0,0.05,0.1 --kd 0,1
+"""
+import argparse
+import json
+import time
+
+from replay.engine import DEFAULT_COOLING, DEFAULT_LEAK, History, candidate_grid, replay
+
+
+def floats(text):
+    return [float(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay history through the control modes")
+    parser.add_argument("--file", help="CSV with time, measurement, value[, device_id]; Influx if omitted")
+    parser.add_argument("--start", default="-24h")
+    parser.add_argument("--stop", default=None)
+    parser.add_argument("--device-id", default=None)
+    parser.add_argument("--step", type=float, default=5.0, help="replay step in seconds")
+    parser.add_argument("--mode", choices=["auto", "manual", "pid"], default="auto")
+    parser.add_argument("--target", type=float, default=22.0)
+    parser.add_argument("--low", type=floats, default=[2.0], help="auto: deviations below which the fan is off")
+    parser.add_argument("--high", type=floats, default=[5.0], help="auto: deviations above which it is at full speed")
+    parser.add_argument("--speed", type=floats, default=[0.0, 1.0, 2.0, 3.0], help="manual: fan speeds")
+    parser.add_argument("--kp", type=floats, default=[1.0])
+    parser.add_argument("--ki", type=floats, default=[0.1])
+    parser.add_argument("--kd", type=floats, default=[1.0])
+    parser.add_argument("--cooling", type=float, default=DEFAULT_COOLING, help="degrees/s per fan speed step")
+    parser.add_argument("--leak", type=float, default=DEFAULT_LEAK, help="1/s pull back to the recorded temperature")
+    parser.add_argument("--comfort-band", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.file:
+        history = History.from_file(args.file, args.device_id, args.step)
+    else:
+        from repository.influx_repository import InfluxRepository
+        repository = InfluxRepository()
+        history = History.from_repository(repository, args.start, args.stop, args.device_id, args.step)
+        repository.close()
+
+    if args.mode == "auto":
+        candidates = [c for c in candidate_grid(low=args.low, high=args.high) if c["low"] <= c["high"]]
+    elif args.mode == "manual":
+        candidates = candidate_grid(speed=args.speed)
+    else:
+        candidates = candidate_grid(Kp=args.kp, Ki=args.ki, Kd=args.kd)
+
+    started = time.monotonic()
+    results = replay(history, args.mode, candidates, args.target, args.cooling, args.leak,
+                     args.comfort_band, args.workers)
+    elapsed = time.monotonic() - started
+    print(json.dumps({
+        "steps": len(history),
+        "candidates": len(candidates),
+        "elapsed": elapsed,
+        "speedup": len(history) * history.step * len(candidates) / elapsed if elapsed else None,
+        "results": results[:args.top],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Replay recorded history through the control modes, far faster than real time.
+
+The recorded temperature already contains the effect of whatever the fans did
+at the time. To ask "what if the controller had done something else", the
+replay follows the recorded trajectory and models only the difference the
+candidate makes, with ThermalPlant's linearised dynamics: the extra cooling of
+a different fan speed, and the room leaking back towards the recorded
+temperature (faster with the window open):
+
+    d[k+1] = d[k] - dt * (leak * d[k] + cooling * (speed[k] - recorded_speed[k]))
+    T[k] = recorded[k] + d[k]
+
+All candidates of one mode are stepped together as NumPy columns, and large
+candidate sets are split across a process pool.
+"""
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from gpio_api.control import AUTO_HIGH_DEVIATION, AUTO_LOW_DEVIATION
+from gpio_api.pid_engine import PIDEngine
+from repository.downsampling import parse_time
+
+MEASUREMENTS = ("temperature_data", "windows_switch", "present_switch", "fan_speed")
+MAX_SPEED = 3
+# ThermalPlant's defaults: degrees per second per speed step, and the leak rate.
+DEFAULT_COOLING = 0.02
+DEFAULT_LEAK = 0.002
+WINDOW_LEAK_FACTOR = 5.0
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return parse_time(value).timestamp()
+
+
+def _hold(times, values, grid, default):
+    """Sample a sparse, changes-only series at the grid times (last value holds)."""
+    if not len(times):
+        return np.full(len(grid), default, dtype=float)
+    order = np.argsort(times)
+    times, values = np.asarray(times, dtype=float)[order], np.asarray(values, dtype=float)[order]
+    index = np.searchsorted(times, grid, side="right") - 1
+    # Before the first point, use the first recorded value.
+    return values[np.maximum(index, 0)]
+
+
+def _interpolate(times, values, grid, default):
+    """Sample a compressed numeric series at the grid times, linearly between its points.
+
+    Swinging-door compression stores temperatures as the knots of a line
+    within the error bound of every sample; outside them the ends hold.
+    """
+    if not len(times):
+        return np.full(len(grid), default, dtype=float)
+    order = np.argsort(times)
+    return np.interp(grid, np.asarray(times, dtype=float)[order], np.asarray(values, dtype=float)[order])
+
+
+class History:
+    """One device's history resampled onto a regular grid of `step` seconds."""
+
+    def __init__(self, series, step=5.0):
+        temperature = series.get("temperature_data") or []
+        if not temperature:
+            raise ValueError("History has no temperature_data points")
+        start = min(t for t, _ in temperature)
+        stop = max(t for t, _ in temperature)
+        self.step = float(step)
+        self.times = np.arange(start, stop + self.step / 2, self.step)
+
+        def column(measurement, default, convert=float, sample=_hold):
+            points = series.get(measurement) or []
+            return sample([t for t, _ in points], [convert(v) for _, v in points], self.times, default)
+
+        closed = lambda state: 1.0 if state == "on" else 0.0  # "off" means open
+        # Switches and fan speed are stored on change and hold between points.
+        self.temperature = column("temperature_data", np.nan, sample=_interpolate)
+        self.window_open = column("windows_switch", 1.0, closed) == 0.0
+        self.door_open = column("present_switch", 1.0, closed) == 0.0
+        self.fan_speed = column("fan_speed", 0.0)
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def from_repository(cls, repository, start="-24h", stop=None, device_id=None, step=5.0):
+        series = {}
+        for measurement in MEASUREMENTS:
+            points = repository.read_history(measurement, start, stop, device_id=device_id)
+            series[measurement] = [(p["time"].timestamp(), p["value"]) for p in points]
+        return cls(series, step)
+
+    @classmethod
+    def from_file(cls, path, device_id=None, step=5.0):
+        """Load a CSV with time, measurement, value and an optional device_id column."""
+        series = {}
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                if device_id and row.get("device_id") not in (None, "", device_id):
+                    continue
+                value = row["value"]
+                if row["measurement"] not in ("windows_switch", "present_switch"):
+                    value = float(value)
+                series.setdefault(row["measurement"], []).append((_timestamp(row["time"]), value))
+        return cls(series, step)
+
+
+def candidate_grid(**axes):
+    """Every combination of the given parameter lists, as dicts."""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def pid_speed(output, output_max=100.0):
+    """Fan speed for a PID output.
+
+    The daemon only reports the PID output, so the replay maps its magnitude
+    linearly onto the fan speeds to make PID runs comparable with the others.
+    """
+    return np.rint(np.minimum(np.abs(output) / output_max, 1.0) * MAX_SPEED)
+
+
+def _controller(mode, candidates, target, dt):
+    """A function mapping the candidates' temperatures to their fan speeds."""
+    count = len(candidates)
+    if mode == "manual":
+        speeds = np.array([float(c.get("speed", 0)) for c in candidates])
+        return lambda temperature: speeds
+    if mode == "auto":
+        low = np.array([float(c.get("low", AUTO_LOW_DEVIATION)) for c in candidates])
+        high = np.array([float(c.get("high", AUTO_HIGH_DEVIATION)) for c in candidates])
+        return lambda temperature: np.where(
+            np.abs(temperature - target) < low, 0.0,
+            np.where(np.abs(temperature - target) <= high, 2.0, 3.0))
+    if mode == "pid":
+        engine = PIDEngine(capacity=count)
+        for i, c in enumerate(candidates):
+            engine.add_zone(i, c.get("Kp", 1.0), c.get("Ki", 0.1), c.get("Kd", 1.0), target)
+        index = np.arange(count)
+        return lambda temperature: pid_speed(engine.step(index, temperature, dt), engine.output_max)
+    raise ValueError(f"Unknown mode: {mode}")
+
+
+def run_candidates(history, mode, candidates, target=22.0, cooling=DEFAULT_COOLING, leak=DEFAULT_LEAK,
+                   comfort_band=0.5):
+    """Replay every candidate over the history and return one result dict each."""
+    count = len(candidates)
+    if not count:
+        return []
+    dt = history.step
+    controller = _controller(mode, candidates, target, dt)
+    recorded = history.temperature
+    paused = history.window_open | history.door_open
+    leak = np.where(history.window_open, leak * WINDOW_LEAK_FACTOR, leak)
+    difference = np.zeros(count)
+    speed = np.zeros(count)
+    abs_error = np.zeros(count)
+    sq_error = np.zeros(count)
+    uncomfortable = np.zeros(count)
+    duty = np.zeros(count)
+    switches = np.zeros(count, dtype=np.int64)
+
+    for k in range(len(history)):
+        temperature = recorded[k] + difference
+        # Like the daemon, auto mode stops the fans while a door or window is open.
+        new_speed = np.zeros(count) if mode == "auto" and paused[k] else controller(temperature)
+        if k:
+            switches += new_speed != speed
+        speed = new_speed
+
+        error = temperature - target
+        abs_error += np.abs(error)
+        sq_error += error * error
+        uncomfortable += np.abs(error) > comfort_band
+        duty += speed / MAX_SPEED
+
+        difference -= dt * (leak[k] * difference + cooling * (speed - history.fan_speed[k]))
+
+    steps = len(history)
+    return [{
+        "mode": mode,
+        "params": candidate,
+        "comfort_mae": float(abs_error[i] / steps),
+        "comfort_rmse": float(np.sqrt(sq_error[i] / steps)),
+        "outside_band": float(uncomfortable[i] / steps),
+        "fan_duty": float(duty[i] / steps),
+        "switches": int(switches[i]),
+    } for i, candidate in enumerate(candidates)]
+
+
+def replay(history, mode, candidates, target=22.0, cooling=DEFAULT_COOLING, leak=DEFAULT_LEAK,
+           comfort_band=0.5, workers=None):
+    """run_candidates split evenly across a process pool, sorted by comfort error."""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(candidates)))
+    args = (target, cooling, leak, comfort_band)
+    if workers == 1:
+        results = run_candidates(history, mode, candidates, *args)
+    else:
+        size = -(-len(candidates) // workers)
+        chunks = [candidates[i:i + size] for i in range(0, len(candidates), size)]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            futures = [pool.submit(run_candidates, history, mode, chunk, *args) for chunk in chunks]
+            results = [r for future in futures for r in future.result()]
+    return sorted(results, key=lambda r: (r["comfort_rmse"], r["fan_duty"], r["switches"]))
@@ -0,0 +1,176 @@
+"""Historian compression: which samples of a series are worth storing.
+
+Each (device, measurement) series is filtered on its own, with an error
+bound per measurement:
+
+- "swinging_door" keeps a point only when a straight line from the last
+  stored point can no longer pass within `bound` of every sample since.
+  The stored point sits on that line (within `bound` of the raw sample), so
+  linear interpolation between stored points is never further than `bound`
+  from any sample. Suits slowly drifting values such as temperatures.
+- "deadband" stores a sample when it differs from the last stored value by
+  more than `bound`; holding the last stored value reconstructs the series.
+  With bound 0 that is "store on change", for switch states and fan speeds.
+
+Either way a series is written at least every `max_interval` seconds, so a
+quiet sensor still shows it is alive.
+
+Configure with COMPRESSION_<MEASUREMENT>=<method>:<bound>, e.g.
+COMPRESSION_TEMPERATURE_DATA=swinging_door:0.05, and COMPRESSION_MAX_INTERVAL.
+"""
+import os
+import threading
+from collections import namedtuple
+
+Spec = namedtuple("Spec", ["method", "bound"])
+
+METHODS = ("swinging_door", "deadband")
+DEFAULT_SPECS = {
+    "temperature_data": Spec("swinging_door", 0.1),
+    "fan_speed": Spec("deadband", 0),
+    "windows_switch": Spec("deadband", 0),
+    "present_switch": Spec("deadband", 0),
+}
+DEFAULT_MAX_INTERVAL = 900  # seconds
+
+
+def spec_from_env(measurement, default=Spec("deadband", 0)):
+    value = os.getenv(f"COMPRESSION_{measurement.upper()}")
+    if not value:
+        return DEFAULT_SPECS.get(measurement, default)
+    method, _, bound = value.partition(":")
+    if method not in METHODS:
+        raise ValueError(f"Unknown compression method for {measurement}: {method}")
+    return Spec(method, float(bound or 0))
+
+
+class SwingingDoor:
+    def __init__(self, bound, max_interval=DEFAULT_MAX_INTERVAL):
+        self.bound = bound
+        self.max_interval = max_interval
+        self.archived = None  # last stored (t, v)
+        self.pending = None  # latest sample not stored yet
+        self.upper = float("inf")  # the door: slopes from `archived` that stay within bound
+        self.lower = float("-inf")
+
+    def _restart(self, t, v):
+        self.archived = (t, v)
+        self.pending = None
+        self.upper = float("inf")
+        self.lower = float("-inf")
+
+    def _door_point(self):
+        """The pending sample moved onto the middle of the door."""
+        t0, v0 = self.archived
+        t, _ = self.pending
+        return t, v0 + (self.upper + self.lower) / 2 * (t - t0)
+
+    def offer(self, t, v):
+        """Take a sample; returns the (t, v) points to store, oldest first."""
+        if self.archived is None:
+            self._restart(t, v)
+            return [(t, v)]
+        t0, v0 = self.archived
+        if t - t0 >= self.max_interval:
+            stored = [self._door_point()] if self.pending else []
+            self._restart(t, v)
+            return stored + [(t, v)]
+        if t <= t0:
+            return []
+        upper = min(self.upper, (v + self.bound - v0) / (t - t0))
+        lower = max(self.lower, (v - self.bound - v0) / (t - t0))
+        if lower <= upper:
+            self.upper, self.lower = upper, lower
+            self.pending = (t, v)
+            return []
+        # The door closed: store the pending sample and swing a new door from it.
+        point = self._door_point()
+        self._restart(*point)
+        return [point] + self.offer(t, v)
+
+    def flush(self):
+        """Store the pending sample, e.g. on shutdown."""
+        if self.pending is None:
+            return []
+        point = self._door_point()
+        self._restart(*point)
+        return [point]
+
+
+class Deadband:
+    def __init__(self, bound=0, max_interval=DEFAULT_MAX_INTERVAL):
+        self.bound = bound
+        self.max_interval = max_interval
+        self.archived = None
+
+    def _changed(self, v):
+        last = self.archived[1]
+        if self.bound and isinstance(v, (int, float)) and isinstance(last, (int, float)):
+            return abs(v - last) > self.bound
+        return v != last
+
+    def offer(self, t, v):
+        if self.archived is None or self._changed(v) or t - self.archived[0] >= self.max_interval:
+            self.archived = (t, v)
+            return [(t, v)]
+        return []
+
+    def flush(self):
+        return []
+
+
+class Historian:
+    """One compressor per (device_id, measurement), created on first use."""
+
+    def __init__(self, specs=None, max_interval=None):
+        self.specs = specs or {}
+        self.max_interval = max_interval or float(os.getenv("COMPRESSION_MAX_INTERVAL", DEFAULT_MAX_INTERVAL))
+        self.series = {}
+        self.points_in = 0
+        self.points_out = 0
+        self._lock = threading.Lock()
+
+    def _spec(self, measurement):
+        spec = self.specs.get(measurement)
+        if spec is None:
+            spec = self.specs[measurement] = spec_from_env(measurement)
+        return spec
+
+    def offer(self, measurement, device_id, t, value):
+        """Take a sample; returns the (t, value) points to store."""
+        key = (device_id, measurement)
+        spec = self._spec(measurement)
+        # Non-numeric values (switch states, a failed sensor's None) are
+        # stored on change; a gap ends a trend, and the next value starts one.
+        door = spec.method == "swinging_door" and isinstance(value, (int, float))
+        with self._lock:
+            compressor = self.series.get(key)
+            if compressor is None or isinstance(compressor, SwingingDoor) != door:
+                stored = compressor.flush() if compressor else []
+                compressor = SwingingDoor(spec.bound, self.max_interval) if door else \
+                    Deadband(spec.bound, self.max_interval)
+                self.series[key] = compressor
+                stored += compressor.offer(t, value)
+            else:
+                stored = compressor.offer(t, value)
+            self.points_in += 1
+            self.points_out += len(stored)
+            return stored
+
+    def flush(self):
+        """Pending points of every series, as (measurement, device_id, t, value)."""
+        with self._lock:
+            stored = [
+                (measurement, device_id, t, value)
+                for (device_id, measurement), compressor in self.series.items()
+                for t, value in compressor.flush()
+            ]
+            self.points_out += len(stored)
+            return stored
+
+    def stats(self):
+        return {
+            "points_in": self.points_in,
+            "points_out": self.points_out,
+            "ratio": round(self.points_in / self.points_out, 2) if self.points_out else None,
+        }
@@ -0,0 +1,134 @@
+import math
+import re
+from datetime import datetime, timedelta, timezone
+
+AGGREGATES = ("mean", "min", "max", "last", "lttb")
+LTTB_OVERSAMPLE = 4  # pre-aggregated points per LTTB output point
+
+_RELATIVE = re.compile(r"^-(\d+)(ms|s|m|h|d|w)$")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_TAG_VALUE = re.compile(r"^[\w.:\-]+$")
+
+
+def parse_time(value, now=None):
+    """Parse a range bound: "now", a relative duration like "-6h", or RFC3339."""
+    now = now or datetime.now(timezone.utc)
+    if value is None or value in ("now", "now()"):
+        return now
+    match = _RELATIVE.match(value)
+    if match:
+        return now - timedelta(seconds=int(match.group(1)) * _UNIT_SECONDS[match.group(2)])
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def flux_time(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def flux_tag(value):
+    if not _TAG_VALUE.match(value):
+        raise ValueError(f"Invalid tag value: {value}")
+    return value
+
+
+def window_seconds(start, stop, max_points):
+    """Smallest whole-second window that keeps [start, stop) under max_points."""
+    duration = (stop - start).total_seconds()
+    if duration <= 0:
+        raise ValueError("start must be before stop")
+    return max(1, math.ceil(duration / max_points))
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of (x, y) pairs.
+
+    Keeps the first and last point and, from each bucket in between, the point
+    forming the largest triangle with the previously kept point and the mean
+    of the next bucket, which preserves peaks and the overall shape.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = avg_y = 0.0
+        for x, y in points[next_start:next_end]:
+            avg_x += x
+            avg_y += y
+        count = max(1, next_end - next_start)
+        avg_x /= count
+        avg_y /= count
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        max_area = -1.0
+        chosen = start
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+        sampled.append(points[chosen])
+        a = chosen
+    sampled.append(points[-1])
+    return sampled
+
+
+def aggregate_window(points, every, agg):
+    """In-process equivalent of Flux aggregateWindow over sorted (t, v) pairs.
+
+    Windows are aligned to the epoch and labelled with their stop time, like
+    Influx does, so cached and queried series line up.
+    """
+    reduced = []
+    window = None
+    bucket = []
+    for t, v in points:
+        k = int(t // every)
+        if k != window and bucket:
+            reduced.append(((window + 1) * every, _reduce(bucket, agg)))
+            bucket = []
+        window = k
+        bucket.append(v)
+    if bucket:
+        reduced.append(((window + 1) * every, _reduce(bucket, agg)))
+    return reduced
+
+
+def to_columns(series):
+    """Merge {name: [(t, v), ...]} into one shared epoch-millisecond time column.
+
+    Series without a point at some time get None there.
+    """
+    times = sorted({t for points in series.values() for t, _ in points})
+    row = {t: i for i, t in enumerate(times)}
+    columns = {}
+    for name, points in series.items():
+        column = [None] * len(times)
+        for t, v in points:
+            column[row[t]] = v
+        columns[name] = column
+    return {"time": [int(round(t * 1000)) for t in times], "series": columns}
+
+
+def _reduce(values, agg):
+    if agg == "min":
+        return min(values)
+    if agg == "max":
+        return max(values)
+    if agg == "last":
+        return values[-1]
+    return sum(values) / len(values)
@@ -0,0 +1,191 @@
+"""Bulk export of raw history in bounded memory, resumable from a cursor.
+
+The range is read as a sequence of time chunks, one Flux query each, and rows
+are written out as they stream in, so memory use depends on the chunk size
+and not on the length of the range. Rows come in (time, measurement, device)
+order and the cursor is the key of the last row written: an interrupted
+export continues after exactly that row.
+
+    python -m repository.export --start 2024-01-01 --stop 2024-02-01 --out january.csv
+    python -m repository.export --start 2024-01-01 --stop 2024-02-01 --out january.csv --resume
+    python -m repository.export --start -30d --format parquet --out last_month/
+"""
+import argparse
+import csv
+import io
+import os
+from datetime import timedelta
+
+from repository.downsampling import parse_time
+
+MEASUREMENTS = ("temperature_data", "windows_switch", "present_switch", "fan_speed")
+COLUMNS = ("time", "measurement", "device_id", "value")
+DEFAULT_CHUNK = timedelta(hours=6)
+
+
+def parse_cursor(cursor):
+    """A cursor is "<ISO time>/<measurement>/<device_id>" of the last row written."""
+    time, measurement, device_id = cursor.split("/")
+    return parse_time(time), measurement, device_id
+
+
+def _key(time, measurement, device_id):
+    return time, measurement, device_id or ""
+
+
+def _check_chunk(chunk):
+    if chunk <= timedelta(0):
+        raise ValueError("Chunk size must be positive")
+
+
+def export_rows(repository, measurements, start, stop, device_id=None, chunk=DEFAULT_CHUNK, cursor=None):
+    """Raw rows for [start, stop), read chunk by chunk, after the cursor if one is given."""
+    _check_chunk(chunk)  # here rather than in the generator, so callers get the error up front
+    return _rows(repository, measurements, start, stop, device_id, chunk, cursor)
+
+
+def _rows(repository, measurements, start, stop, device_id, chunk, cursor):
+    after = None
+    if cursor:
+        after = _key(*parse_cursor(cursor))
+        start = max(start, after[0])
+    chunk_start = start
+    while chunk_start < stop:
+        chunk_stop = min(chunk_start + chunk, stop)
+        for row in repository.stream_raw(measurements, chunk_start, chunk_stop, device_id):
+            if after is not None:
+                if _key(*row[:3]) <= after:
+                    continue
+                after = None
+            yield row
+        chunk_start = chunk_stop
+
+
+def csv_stream(rows, header=True):
+    """CSV text, a line at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    for time, measurement, device_id, value in rows:
+        writer.writerow((time.isoformat(), measurement, device_id or "", value))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # With no rows the header is still waiting in the buffer.
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def last_csv_cursor(path):
+    """Cursor of the last complete row of a CSV export; a torn last line is cut off."""
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        end = tail.rfind(b"\n") + 1
+        if end < len(tail):
+            f.truncate(size - (len(tail) - end))
+            tail = tail[:end]
+    lines = tail.decode().splitlines()
+    if not lines or lines[-1] == ",".join(COLUMNS):
+        return None
+    time, measurement, device_id, _ = next(csv.reader([lines[-1]]))
+    return f"{time}/{measurement}/{device_id}"
+
+
+def write_csv(rows, path, append=False):
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    with open(path, "a" if append else "w", newline="") as f:
+        for line in csv_stream(counted(), header=not append):
+            f.write(line)
+    return count
+
+
+def write_parquet(repository, measurements, start, stop, directory, device_id=None, chunk=DEFAULT_CHUNK):
+    """One Parquet file per chunk; existing parts are skipped, so a rerun resumes.
+
+    Needs pyarrow. Values go to a float "value" column or, for switch states,
+    a string "state" column.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+    _check_chunk(chunk)
+
+    os.makedirs(directory, exist_ok=True)
+    schema = pa.schema([
+        ("time", pa.timestamp("us", tz="UTC")), ("measurement", pa.string()), ("device_id", pa.string()),
+        ("value", pa.float64()), ("state", pa.string()),
+    ])
+    count = 0
+    chunk_start = start
+    while chunk_start < stop:
+        chunk_stop = min(chunk_start + chunk, stop)
+        path = os.path.join(directory, f"part-{chunk_start.strftime('%Y%m%dT%H%M%S')}.parquet")
+        if not os.path.exists(path):
+            columns = {name: [] for name in schema.names}
+            for time, measurement, device, value in repository.stream_raw(measurements, chunk_start, chunk_stop,
+                                                                          device_id):
+                columns["time"].append(time)
+                columns["measurement"].append(measurement)
+                columns["device_id"].append(device)
+                columns["value"].append(value if not isinstance(value, str) else None)
+                columns["state"].append(value if isinstance(value, str) else None)
+            # Written under a temporary name so a part either exists whole or not at all.
+            pq.write_table(pa.table(columns, schema=schema), path + ".tmp")
+            os.replace(path + ".tmp", path)
+            count += len(columns["time"])
+        chunk_start = chunk_stop
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export raw history from Influx")
+    parser.add_argument("--start", required=True)
+    parser.add_argument("--stop", default=None)
+    parser.add_argument("--measurements", default=",".join(MEASUREMENTS))
+    parser.add_argument("--device-id", default=None)
+    parser.add_argument("--chunk-hours", type=float, default=DEFAULT_CHUNK.total_seconds() / 3600)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--out", required=True, help="CSV file, or directory of Parquet parts")
+    parser.add_argument("--cursor", default=None, help="CSV: continue after this row")
+    parser.add_argument("--resume", action="store_true", help="CSV: continue after the last row in --out")
+    args = parser.parse_args()
+    if args.chunk_hours <= 0:
+        parser.error("--chunk-hours must be positive")
+
+    from dotenv import load_dotenv
+    from repository.influx_repository import InfluxRepository
+    load_dotenv()
+    repository = InfluxRepository()
+    start, stop = parse_time(args.start), parse_time(args.stop)
+    chunk = timedelta(hours=args.chunk_hours)
+    measurements = args.measurements.split(",")
+    try:
+        if args.format == "parquet":
+            count = write_parquet(repository, measurements, start, stop, args.out, args.device_id, chunk)
+        else:
+            cursor = args.cursor
+            append = bool(cursor)
+            if args.resume and os.path.exists(args.out):
+                cursor = last_csv_cursor(args.out)
+                append = True
+            rows = export_rows(repository, measurements, start, stop, args.device_id, chunk, cursor)
+            count = write_csv(rows, args.out, append)
+        print(f"Exported {count} rows to {args.out}")
+    finally:
+        repository.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,21 @@
+import logging
 import os
+import time
+from datetime import datetime, timezone
 from influxdb_client import InfluxDBClient, Point, WriteOptions
 from influxdb_client.client.write_api import SYNCHRONOUS
+from repository.write_buffer import WriteBuffer
+from repository.compression import Historian
+from repository.downsampling import AGGREGATES, LTTB_OVERSAMPLE, parse_time, flux_time, flux_tag, window_seconds, lttb
+from repository.ring_buffer import COLUMN_AGGREGATES
+from repository.rollups import FIELDS as ROLLUP_FIELDS, Rollups
+
+log = logging.getLogger("scada.influx")
+
+STRING_MEASUREMENTS = {"windows_switch", "present_switch"}
 
 class InfluxRepository:
-    def __init__(self, url=None, token=None, org=None, bucket=None):
+    def __init__(self, url=None, token=None, org=None, bucket=None, write_mode=None, read_only=False):
         self.url = url or os.getenv("INFLUXDB_URL", "http://localhost:8086")
         self.token = token or os.getenv("INFLUXDB_INIT_ADMIN_TOKEN")
         self.org = org or os.getenv("INFLUXDB_INIT_ORG")
@@ -17,110 +29,325 @@ class InfluxRepository:
         self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
         self.query_api = self.client.query_api()
 
-        # cache the last written values
-        self.last_states = {
-            "windows_switch": None,
-            "present_switch": None,
-            "fan_speed": None,
-            "temperature": None
-        }
-
-    def write_if_changed(self, measurement: str, value: int):
-        if self.last_states.get(measurement) != value:
-            point = Point(measurement).field("value", value)
-            self.write_api.write(bucket=self.bucket, record=point)
-            self.last_states[measurement] = value  # Update cached value
+        # "sync" writes each point inline; "buffered" hands points to a
+        # background WriteBuffer so callers never wait on the network. A
+        # read-only repository (the API's) never writes, so it starts no
+        # write buffers and keeps no rollup accumulator.
+        self.read_only = read_only
+        self.write_mode = "sync" if read_only else write_mode or os.getenv("INFLUX_WRITE_MODE", "sync")
+        self.write_buffer = None
+        if self.write_mode == "buffered":
+            self.write_buffer = WriteBuffer(
+                self.write_api, self.bucket, self.org,
+                batch_size=int(os.getenv("INFLUX_BATCH_SIZE", 500)),
+                flush_interval=float(os.getenv("INFLUX_FLUSH_INTERVAL", 1.0)),
+                max_queue=int(os.getenv("INFLUX_QUEUE_SIZE", 10000)),
+                overflow=os.getenv("INFLUX_OVERFLOW_POLICY", "drop_oldest"),
+                max_retries=int(os.getenv("INFLUX_MAX_RETRIES", 5)),
+            )
+
+        self._write_observer = None
+
+        # With INFLUX_ROLLUPS set, downsampled reads come from the rollup
+        # tiers (see repository/rollups.py) when one is fine enough.
+        # The daemon computes the finest tier itself, from every sample.
+        self.rollups = Rollups(self.client, self.bucket, self.org) if os.getenv("INFLUX_ROLLUPS") else None
+        self.rollup_buffer = None
+        if self.rollups and self.write_buffer:
+            self.rollup_buffer = WriteBuffer(
+                self.write_api, self.rollups.tier_bucket(self.rollups.tiers[0]), self.org,
+                flush_interval=float(os.getenv("INFLUX_FLUSH_INTERVAL", 1.0)),
+                overflow=os.getenv("INFLUX_OVERFLOW_POLICY", "drop_oldest"),
+                max_retries=int(os.getenv("INFLUX_MAX_RETRIES", 5)),
+            )
+
+        # Decides per (device_id, measurement) which samples are stored; see
+        # repository/compression.py for the error bounds.
+        self.historian = Historian()
+
+    def write_if_changed(self, measurement: str, value: int, device_id=None):
+        now = time.time()
+        if self.rollups and not self.read_only:
+            self._write_rollups(self.rollups.offer(measurement, device_id, now, value))
+        stored = self.historian.offer(measurement, device_id, now, value)
+        for t, value in stored:
+            self._write_at(measurement, value, device_id, t)
+        if not stored and log.isEnabledFor(logging.DEBUG):
+            log.debug("within compression bound, not writing", extra={"measurement": measurement,
+                                                                       "device_id": device_id})
+
+    def _write_at(self, measurement, value, device_id, t):
+        if value is None:
+            return  # a gap: it ends a trend in the historian but has no field to store
+        # Compression can store a sample after later ones arrived, so points
+        # carry their sample time rather than the time of writing.
+        point = Point(measurement).field("value", value).time(int(t * 1e9))
+        if device_id:
+            point = point.tag("device_id", device_id)
+        self._write(point)
+
+    def _write_rollups(self, points):
+        if not points:
+            return
+        if self.rollup_buffer:
+            for point in points:
+                self.rollup_buffer.put(point)
         else:
-            print(f"[INFO] {measurement} state unchanged, not writing.")
+            self.write_api.write(bucket=self.rollups.tier_bucket(self.rollups.tiers[0]), record=points)
 
-    def write_temperature(self, temperature):
-        self.write_if_changed("temperature_data", temperature)
+    @property
+    def write_observer(self):
+        return self._write_observer
 
-    def write_windows_switch(self, state: int):
-        self.write_if_changed("windows_switch", state)
+    @write_observer.setter
+    def write_observer(self, observer):
+        """Callable receiving the duration of every write request, for metrics."""
+        self._write_observer = observer
+        for buffer in (self.write_buffer, self.rollup_buffer):
+            if buffer:
+                buffer.write_observer = observer
 
-    def write_present_switch(self, state: int):
-        self.write_if_changed("present_switch", state)
+    def _write(self, point):
+        # Points carry their sample time, so batching delay does not shift it.
+        if self.write_buffer:
+            self.write_buffer.put(point)
+        else:
+            started = time.perf_counter()
+            self.write_api.write(bucket=self.bucket, record=point)
+            if self._write_observer:
+                self._write_observer(time.perf_counter() - started)
 
-    def write_fan_speed(self, speed: int):
-        self.write_if_changed("fan_speed", speed)
+    def write_stats(self):
+        stats = self.write_buffer.stats() if self.write_buffer else {}
+        stats["compression"] = self.historian.stats()
+        return stats
 
+    def write_temperature(self, temperature, device_id=None):
+        self.write_if_changed("temperature_data", temperature, device_id)
 
-    def read_recent_temperatures(self, time_range="-1h"):
-        query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: {time_range})
-          |> filter(fn: (r) => r._measurement == "temperature_data")
-        '''
+    def write_windows_switch(self, state: int, device_id=None):
+        self.write_if_changed("windows_switch", state, device_id)
 
-        result = self.query_api.query(org=self.org, query=query)
+    def write_present_switch(self, state: int, device_id=None):
+        self.write_if_changed("present_switch", state, device_id)
 
-        temperatures = []
-        for table in result:
-            for record in table.records:
-                temperatures.append({
-                    "time": record.get_time(),
-                    "value": record.get_value()
-                })
+    def write_fan_speed(self, speed: int, device_id=None):
+        self.write_if_changed("fan_speed", speed, device_id)
 
-        return temperatures
+    def write_backlog(self, device_id, statuses):
+        """Write statuses a device spooled while offline, at their own timestamps.
 
-    def read_recent_windows_switch(self, time_range="-1h"):
-        query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: {time_range})
-          |> filter(fn: (r) => r._measurement == "windows_switch")
-        '''
+        They bypass compression, which follows the live stream.
+        """
+        for status in statuses:
+            timestamp = datetime.fromtimestamp(status.timestamp, timezone.utc)
+            for measurement, value in (("temperature_data", status.temperature_c),
+                                       ("windows_switch", status.switch_window),
+                                       ("present_switch", status.switch_someone_present),
+                                       ("fan_speed", status.leds_on)):
+                if value is None:
+                    continue
+                point = Point(measurement).field("value", value).tag("device_id", device_id).time(timestamp)
+                self._write(point)
 
-        result = self.query_api.query(org=self.org, query=query)
 
-        states = []
-        for table in result:
-            for record in table.records:
-                states.append({
-                    "time": record.get_time(),
-                    "value": record.get_value()
-                })
+    def _source(self, measurements, start, every, fn):
+        """Bucket and field to read: the coarsest rollup tier that fits, or the raw points."""
+        if self.rollups and every and fn in ROLLUP_FIELDS:
+            tiers = {self.rollups.select(measurement, start, every) for measurement in measurements}
+            if len(tiers) == 1 and None not in tiers:
+                return self.rollups.tier_bucket(tiers.pop()), fn
+        return self.bucket, "value"
 
-        return states
+    def read_history(self, measurement, start="-1h", stop=None, max_points=None, agg="mean", device_id=None):
+        """Points of one measurement in [start, stop), reduced to at most max_points.
+
+        Numeric series are reduced on the server with aggregateWindow; with
+        agg="lttb" the server pre-aggregates to a few points per output point
+        and LTTB picks the final shape-preserving subset. Switch states are
+        strings, so they are always reduced with "last".
+        """
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {agg}")
+        start_dt = parse_time(start)
+        stop_dt = parse_time(stop)
+        if measurement in STRING_MEASUREMENTS:
+            agg = "last"
+
+        every = fn = None
+        if max_points:
+            every = window_seconds(start_dt, stop_dt, max_points)
+            fn = agg
+            if agg == "lttb":
+                every = max(1, every // LTTB_OVERSAMPLE)
+                fn = "mean"
+        bucket, field = self._source([measurement], start_dt, every, fn)
 
-    def read_recent_present_switch(self, time_range="-1h"):
         query = f'''
-        from(bucket: "{self.bucket}")
-          |> range(start: {time_range})
-          |> filter(fn: (r) => r._measurement == "present_switch")
+        from(bucket: "{bucket}")
+          |> range(start: {flux_time(start_dt)}, stop: {flux_time(stop_dt)})
+          |> filter(fn: (r) => r._measurement == "{flux_tag(measurement)}" and r._field == "{field}")
+        '''
+        if device_id:
+            query += f'''  |> filter(fn: (r) => r.device_id == "{flux_tag(device_id)}")
+        '''
+        # Merge devices (and pre-tag history) into a single series so
+        # max_points bounds the whole response.
+        query += '''  |> group(columns: ["_measurement"])
+          |> sort(columns: ["_time"])
+        '''
+        if every:
+            query += f'''  |> aggregateWindow(every: {every}s, fn: {fn}, createEmpty: false)
         '''
 
         result = self.query_api.query(org=self.org, query=query)
 
-        states = []
+        points = []
         for table in result:
             for record in table.records:
-                states.append({
+                points.append({
                     "time": record.get_time(),
                     "value": record.get_value()
                 })
 
-        return states
+        if agg == "lttb" and max_points and len(points) > max_points:
+            pairs = [(p["time"].timestamp(), p["value"]) for p in points]
+            points = [
+                {"time": datetime.fromtimestamp(x, timezone.utc), "value": y}
+                for x, y in lttb(pairs, max_points)
+            ]
+
+        return points
+
+    def read_columns(self, measurements, start="-1h", stop=None, max_points=None, agg="mean", device_id=None):
+        """Several measurements from one pivoted query: a shared time column plus one column each.
 
-    def read_recent_fan_speed(self, time_range="-1h"):
+        Records go from query_stream straight into the columns. Numeric series
+        use agg and switch states "last", over the same windows, so each row
+        holds one window of every series.
+        """
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {agg}")
+        agg = COLUMN_AGGREGATES.get(agg, agg)
+        start_dt = parse_time(start)
+        stop_dt = parse_time(stop)
+
+        def matching(names):
+            return " or ".join(f'r._measurement == "{flux_tag(name)}"' for name in names)
+
+        # Strings cannot be averaged, so switch states are windowed apart.
+        groups = [
+            (names, fn) for names, fn in (
+                ([m for m in measurements if m not in STRING_MEASUREMENTS], agg),
+                ([m for m in measurements if m in STRING_MEASUREMENTS], "last"),
+            ) if names
+        ]
+        every = window_seconds(start_dt, stop_dt, max_points) if max_points else None
+        query = ""
+        for i, (names, fn) in enumerate(groups):
+            bucket, field = self._source(names, start_dt, every, fn)
+            query += f'''
+        s{i} = from(bucket: "{bucket}")
+          |> range(start: {flux_time(start_dt)}, stop: {flux_time(stop_dt)})
+          |> filter(fn: (r) => ({matching(names)}) and r._field == "{field}")
+        '''
+            if device_id:
+                query += f'''  |> filter(fn: (r) => r.device_id == "{flux_tag(device_id)}")
+        '''
+            query += '''  |> group(columns: ["_measurement"])
+        '''
+            if every:
+                query += f'''  |> aggregateWindow(every: {every}s, fn: {fn}, createEmpty: false)
+        '''
+        streams = ", ".join(f"s{i}" for i in range(len(groups)))
+        query += f'''
+        union(tables: [{streams}])
+          |> keep(columns: ["_time", "_value", "_measurement"])
+          |> pivot(rowKey: ["_time"], columnKey: ["_measurement"], valueColumn: "_value")
+          |> group()
+          |> sort(columns: ["_time"])
+        '''
+
+        # pivot works table by table, one per measurement, so rows of the
+        # different measurements arrive separately; sorted by time, the rows
+        # for one timestamp are adjacent and merge into one.
+        times = []
+        columns = {measurement: [] for measurement in measurements}
+        for record in self.query_api.query_stream(org=self.org, query=query):
+            t = int(record.get_time().timestamp() * 1000)
+            if not times or times[-1] != t:
+                times.append(t)
+                for column in columns.values():
+                    column.append(None)
+            values = record.values
+            for measurement, column in columns.items():
+                value = values.get(measurement)
+                if value is not None:
+                    column[-1] = value
+        return {"time": times, "series": columns}
+
+    def stream_raw(self, measurements, start, stop, device_id=None):
+        """Raw (time, measurement, device_id, value) rows in [start, stop), in export order.
+
+        Rows are sorted by time, measurement and device, and yielded as they
+        arrive from query_stream. Values travel as strings, since numbers and
+        switch states cannot share one table, and are converted back here.
+        """
+        names = " or ".join(f'r._measurement == "{flux_tag(name)}"' for name in measurements)
         query = f'''
         from(bucket: "{self.bucket}")
-          |> range(start: {time_range})
-          |> filter(fn: (r) => r._measurement == "fan_speed")
+          |> range(start: {flux_time(start)}, stop: {flux_time(stop)})
+          |> filter(fn: (r) => ({names}) and r._field == "value")
+        '''
+        if device_id:
+            query += f'''  |> filter(fn: (r) => r.device_id == "{flux_tag(device_id)}")
         '''
+        query += '''  |> keep(columns: ["_time", "_measurement", "device_id", "_value"])
+          |> toString()
+          |> group()
+          |> sort(columns: ["_time", "_measurement", "device_id"])
+        '''
+        for record in self.query_api.query_stream(org=self.org, query=query):
+            values = record.values
+            measurement = values.get("_measurement")
+            value = values.get("_value")
+            if value is not None and measurement not in STRING_MEASUREMENTS:
+                value = float(value)
+            yield record.get_time(), measurement, values.get("device_id"), value
 
+    def read_series_by_device(self, measurement, start="-1h"):
+        """Raw (epoch seconds, value) pairs since start, grouped by device_id tag."""
+        query = f'''
+        from(bucket: "{self.bucket}")
+          |> range(start: {flux_time(parse_time(start))})
+          |> filter(fn: (r) => r._measurement == "{flux_tag(measurement)}" and r._field == "value")
+        '''
         result = self.query_api.query(org=self.org, query=query)
 
-        speeds = []
+        series = {}
         for table in result:
             for record in table.records:
-                speeds.append({
-                    "time": record.get_time(),
-                    "value": record.get_value()
-                })
+                series.setdefault(record.values.get("device_id"), []).append(
+                    (record.get_time().timestamp(), record.get_value())
+                )
+        return series
+
+    def read_recent_temperatures(self, time_range="-1h", stop=None, max_points=None, agg="mean", device_id=None):
+        return self.read_history("temperature_data", time_range, stop, max_points, agg, device_id)
+
+    def read_recent_windows_switch(self, time_range="-1h", stop=None, max_points=None, agg="last", device_id=None):
+        return self.read_history("windows_switch", time_range, stop, max_points, agg, device_id)
+
+    def read_recent_present_switch(self, time_range="-1h", stop=None, max_points=None, agg="last", device_id=None):
+        return self.read_history("present_switch", time_range, stop, max_points, agg, device_id)
 
-        return speeds
+    def read_recent_fan_speed(self, time_range="-1h", stop=None, max_points=None, agg="mean", device_id=None):
+        return self.read_history("fan_speed", time_range, stop, max_points, agg, device_id)
 
     def close(self):
+        for measurement, device_id, t, value in self.historian.flush():
+            self._write_at(measurement, value, device_id, t)
+        for buffer in (self.write_buffer, self.rollup_buffer):
+            if buffer:
+                buffer.close()
         self.client.close()
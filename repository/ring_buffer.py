@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+from repository.downsampling import (AGGREGATES, LTTB_OVERSAMPLE, aggregate_window, lttb, window_seconds, parse_time,
+                                     to_columns)
+
+# Switch states are strings on the wire and in Influx; the buffers only hold
+# doubles, so they are stored as codes and decoded on the way out.
+SWITCH_CODES = {"off": 0.0, "on": 1.0}
+SWITCH_NAMES = {code: name for name, code in SWITCH_CODES.items()}
+SWITCH_MEASUREMENTS = {"windows_switch", "present_switch"}
+# LTTB picks different times per series, so a shared time axis uses the mean.
+COLUMN_AGGREGATES = {"lttb": "mean"}
+SERIES = ("temperature_data", "windows_switch", "present_switch", "fan_speed")  # what record_status stores
+
+
+class RingBuffer:
+    """Fixed-capacity (time, value) series backed by two array('d') columns."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.head = 0  # next write slot
+        self.count = 0
+        self.dropped = 0  # late samples older than everything a full buffer holds
+        self.lock = threading.Lock()
+
+    def append(self, t, value):
+        """Add a sample, in time order; returns False if it is too old to keep."""
+        with self.lock:
+            if not self.count or t >= self.times[(self.head - 1) % self.capacity]:
+                self.times[self.head] = t
+                self.values[self.head] = value
+                self.head = (self.head + 1) % self.capacity
+                if self.count < self.capacity:
+                    self.count += 1
+                return True
+            # A late sample, e.g. from another ingest worker: insert it where
+            # it belongs so the series stays ordered and range lookups can bisect.
+            return self._insert(t, value)
+
+    def _insert(self, t, value):
+        times, _ = self._ordered()
+        position = bisect_right(times, t)
+        first = (self.head - self.count) % self.capacity
+        if self.count == self.capacity:
+            # The oldest sample makes room, unless the late one is older still.
+            if position == 0:
+                self.dropped += 1
+                return False
+            first = (first + 1) % self.capacity
+            position -= 1
+            count = self.count - 1
+        else:
+            count = self.count
+        # Shift the newer samples one slot up, from the newest down.
+        for i in range(count, position, -1):
+            source, target = (first + i - 1) % self.capacity, (first + i) % self.capacity
+            self.times[target] = self.times[source]
+            self.values[target] = self.values[source]
+        slot = (first + position) % self.capacity
+        self.times[slot] = t
+        self.values[slot] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = count + 1
+        return True
+
+    def oldest(self):
+        if not self.count:
+            return None
+        return self.times[(self.head - self.count) % self.capacity]
+
+    def is_full(self):
+        return self.count == self.capacity
+
+    def _ordered(self):
+        first = (self.head - self.count) % self.capacity
+        if first + self.count <= self.capacity:
+            return self.times[first:first + self.count], self.values[first:first + self.count]
+        return (self.times[first:] + self.times[:self.head],
+                self.values[first:] + self.values[:self.head])
+
+    def range(self, start, stop):
+        with self.lock:
+            times, values = self._ordered()
+        lo = bisect_left(times, start)
+        hi = bisect_left(times, stop)
+        return list(zip(times[lo:hi], values[lo:hi]))
+
+
+class HistoryCache:
+    """Recent per-measurement, per-device history kept in ring buffers.
+
+    Fed live from the MQTT stream and warmed once from Influx, it answers any
+    range that starts after the point the cache is complete from; older ranges
+    fall through to Influx. Samples are also recorded under device None, which
+    is the merged series the routes serve when no device is requested.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or int(os.getenv("HISTORY_CACHE_CAPACITY", 4096))
+        self.buffers = {}
+        self.lock = threading.Lock()
+        # Nothing older than this is known to be in the cache; moves back
+        # once warmed from Influx.
+        self.complete_since = time.time()
+        # Per (measurement, device_id): samples before this went to Influx only.
+        self.incomplete = {}
+
+    def _buffer(self, measurement, device_id):
+        key = (measurement, device_id)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            with self.lock:
+                buffer = self.buffers.setdefault(key, RingBuffer(self.capacity))
+        return buffer
+
+    def record(self, measurement, device_id, t, value):
+        if value is None:
+            return
+        if measurement in SWITCH_MEASUREMENTS:
+            value = SWITCH_CODES.get(value)
+            if value is None:
+                return
+        self._buffer(measurement, device_id).append(t, float(value))
+        if device_id is not None:
+            self._buffer(measurement, None).append(t, float(value))
+
+    def record_status(self, device_id, status, t=None):
+        t = t or time.time()
+        self.record("temperature_data", device_id, t, status.temperature_c)
+        self.record("windows_switch", device_id, t, status.switch_window)
+        self.record("present_switch", device_id, t, status.switch_someone_present)
+        self.record("fan_speed", device_id, t, status.leds_on)
+
+    def warm(self, repository, measurements, start="-1h"):
+        warm_from = parse_time(start).timestamp()
+        for measurement in measurements:
+            samples = [
+                (t, device_id, value)
+                for device_id, points in repository.read_series_by_device(measurement, start).items()
+                for t, value in points
+            ]
+            samples.sort(key=lambda sample: sample[0])
+            for t, device_id, value in samples:
+                self.record(measurement, device_id, t, value)
+        self.complete_since = warm_from
+
+    def mark_incomplete(self, device_id, until, measurements=SERIES):
+        """A device's samples before `until` went to Influx only.
+
+        Ranges of that device, and of the merged series, reaching back past
+        `until` are read from Influx; other devices keep using the cache.
+        """
+        with self.lock:
+            for measurement in measurements:
+                for key in ((measurement, device_id), (measurement, None)):
+                    self.incomplete[key] = max(self.incomplete.get(key, until), until)
+
+    def covered_from(self, measurement, device_id):
+        covered = max(self.complete_since, self.incomplete.get((measurement, device_id), self.complete_since))
+        buffer = self.buffers.get((measurement, device_id))
+        if buffer is not None and buffer.is_full():
+            return max(covered, buffer.oldest())
+        return covered
+
+    def query(self, measurement, start="-1h", stop=None, max_points=None, agg="mean", device_id=None):
+        """Points for the range from memory, or None when Influx is needed.
+
+        Reduced the way InfluxRepository.read_history reduces them, so both
+        answer a query with the same windows.
+        """
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {agg}")
+        start_dt = parse_time(start)
+        stop_dt = parse_time(stop)
+        if start_dt.timestamp() < self.covered_from(measurement, device_id):
+            return None
+
+        buffer = self.buffers.get((measurement, device_id))
+        points = buffer.range(start_dt.timestamp(), stop_dt.timestamp()) if buffer else []
+        if measurement in SWITCH_MEASUREMENTS:
+            agg = "last"
+        if max_points:
+            every = window_seconds(start_dt, stop_dt, max_points)
+            if agg == "lttb":
+                points = aggregate_window(points, max(1, every // LTTB_OVERSAMPLE), "mean")
+                if len(points) > max_points:
+                    points = lttb(points, max_points)
+            else:
+                points = aggregate_window(points, every, agg)
+
+        decode = SWITCH_NAMES.get if measurement in SWITCH_MEASUREMENTS else None
+        return [
+            {
+                "time": datetime.fromtimestamp(t, timezone.utc),
+                "value": decode(value) if decode else value,
+            }
+            for t, value in points
+        ]
+
+    def query_columns(self, measurements, start="-1h", stop=None, max_points=None, agg="mean", device_id=None):
+        """Several measurements on one time axis (see to_columns), or None when Influx is needed."""
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {agg}")
+        start_dt = parse_time(start)
+        stop_dt = parse_time(stop)
+        if any(start_dt.timestamp() < self.covered_from(m, device_id) for m in measurements):
+            return None
+        # Every series uses the same windows so their times line up.
+        every = window_seconds(start_dt, stop_dt, max_points) if max_points else None
+        agg = COLUMN_AGGREGATES.get(agg, agg)
+        series = {}
+        for measurement in measurements:
+            buffer = self.buffers.get((measurement, device_id))
+            points = buffer.range(start_dt.timestamp(), stop_dt.timestamp()) if buffer else []
+            switch = measurement in SWITCH_MEASUREMENTS
+            if every:
+                points = aggregate_window(points, every, "last" if switch else agg)
+            if switch:
+                points = [(t, SWITCH_NAMES.get(v)) for t, v in points]
+            series[measurement] = points
+        return to_columns(series)
@@ -0,0 +1,320 @@
+"""Continuous min/mean/max rollups of the numeric measurements in Influx.
+
+Each tier lives in its own bucket, with its own retention. The raw bucket
+only holds the points the historian kept (see repository/compression.py), so
+a plain mean over it would weight every stored point the same and leave
+windows without a change empty. The finest tier is therefore computed in the
+daemon from every sample, before compression, as a time-weighted aggregate:
+a series holds its last reported value until the next report, and windows
+without a report still get that value. Each coarser tier is filled by an
+Influx task from the tier below it, whose windows are all full; tasks rewrite
+their last two windows on every run, so rows that arrive a little late still
+land in the rollup. Reads pick the coarsest tier whose resolution is still
+fine enough and whose retention reaches back to the start of the range, so a
+90-day chart reads a few hundred daily rows instead of every raw point.
+
+Backfill recomputes the finest tier from the stored points, interpolating
+swinging-door series linearly between them and holding the others.
+
+    python -m repository.rollups provision
+    python -m repository.rollups backfill --start -90d
+"""
+import argparse
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from influxdb_client import BucketRetentionRules, Point, TaskCreateRequest, TaskUpdateRequest
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+from repository.compression import DEFAULT_MAX_INTERVAL, spec_from_env
+from repository.downsampling import flux_tag, flux_time, parse_time
+
+Tier = namedtuple("Tier", ["name", "every", "retention"])  # seconds; retention 0 keeps forever
+
+
+def _retention(name, days):
+    return int(float(os.getenv(f"ROLLUP_RETENTION_{name.upper()}", days)) * 86400)
+
+
+TIERS = (
+    Tier("1m", 60, _retention("1m", 30)),
+    Tier("1h", 3600, _retention("1h", 400)),
+    Tier("1d", 86400, _retention("1d", 0)),
+)
+FIELDS = ("min", "mean", "max")
+MEASUREMENTS = ("temperature_data", "fan_speed")
+TASK_OFFSET = 30  # seconds a task waits after its window closes
+# A series not heard from for this long stops holding its value; longer than
+# the device heartbeat and the historian's max_interval.
+MAX_GAP = float(os.getenv("ROLLUP_MAX_GAP", DEFAULT_MAX_INTERVAL))
+
+
+class _Series:
+    __slots__ = ("every", "t", "v", "sampled", "stop", "area", "duration", "low", "high")
+
+    def __init__(self, every, t, v):
+        self.every = every
+        self.t = t  # integrated up to here
+        self.v = v  # value at self.t
+        self.sampled = t
+        self._open(t - t % every + every)
+        self._include(v)
+
+    def _open(self, stop):
+        self.stop = stop
+        self.area = self.duration = 0.0
+        self.low = self.high = None
+
+    def _include(self, v):
+        if self.low is None or v < self.low:
+            self.low = v
+        if self.high is None or v > self.high:
+            self.high = v
+
+    def advance(self, t, v):
+        """Integrate up to t, the value moving linearly from self.v to v; returns the windows closed."""
+        closed = []
+        t0, v0 = self.t, self.v
+        slope = (v - v0) / (t - t0) if t > t0 else 0
+        while self.t < t:
+            end = min(t, self.stop)
+            # A held value keeps its type, so integer fields stay integers.
+            a, b = (v0, v0) if v == v0 else (v0 + slope * (self.t - t0), v0 + slope * (end - t0))
+            self.area += (a + b) / 2 * (end - self.t)
+            self.duration += end - self.t
+            self._include(a)
+            self._include(b)
+            self.t = end
+            if end == self.stop:
+                closed.append(self.window())
+                self._open(self.stop + self.every)
+        self.v = v
+        return closed
+
+    def window(self):
+        """(stop, min, mean, max) of the current window, stamped at its stop like aggregateWindow."""
+        return self.stop, self.low, self.area / self.duration, self.high
+
+
+class TimeWeighted:
+    """Time-weighted min/mean/max of every series over fixed windows.
+
+    Between samples a series holds its value, or for measurements in `linear`
+    moves in a straight line to the next sample. A None value, or no sample
+    for longer than max_gap, ends the series until it reports again.
+    """
+
+    def __init__(self, every, max_gap=MAX_GAP, linear=()):
+        self.every = every
+        self.max_gap = max_gap
+        self.linear = set(linear)
+        self.series = {}  # (device_id, measurement) -> _Series
+        self._lock = threading.Lock()
+
+    def offer(self, measurement, device_id, t, value):
+        """Take a sample; returns the windows it closed as (measurement, device_id, stop, min, mean, max)."""
+        key = (device_id, measurement)
+        closed = []
+        with self._lock:
+            series = self.series.get(key)
+            if series is not None and t <= series.t:
+                return []  # out of order
+            if series is not None and (value is None or t - series.sampled > self.max_gap):
+                # A gap: close the part of the window the series covered and start over.
+                del self.series[key]
+                closed = series.advance(min(t, series.sampled + self.max_gap), series.v)
+                if series.duration:
+                    closed.append(series.window())
+                series = None
+            if series is not None:
+                closed = series.advance(t, value if measurement in self.linear else series.v)
+                series.v = value
+                series.sampled = t
+                series._include(value)
+            elif value is not None:
+                self.series[key] = _Series(self.every, t, value)
+        return [(measurement, device_id) + window for window in closed]
+
+    def flush(self, now):
+        """Close the windows that ended by `now`, holding every series' last value."""
+        closed = []
+        with self._lock:
+            for (device_id, measurement), series in self.series.items():
+                end = min(now, series.sampled + self.max_gap)
+                if end > series.t:
+                    closed += [(measurement, device_id) + window for window in series.advance(end, series.v)]
+        return closed
+
+
+def rollup_point(measurement, device_id, stop, low, mean, high):
+    point = Point(measurement).field("min", low).field("mean", float(mean)).field("max", high)
+    if device_id:
+        point = point.tag("device_id", device_id)
+    return point.time(int(stop * 1e9))
+
+
+class Rollups:
+    def __init__(self, client, bucket, org, tiers=TIERS, max_gap=MAX_GAP):
+        self.client = client
+        self.bucket = bucket
+        self.org = org
+        self.tiers = tiers
+        self.max_gap = max_gap
+        # Live samples are reports, so they are held until the next one.
+        self.live = TimeWeighted(tiers[0].every, max_gap)
+
+    def tier_bucket(self, tier):
+        return f"{self.bucket}_rollup_{tier.name}"
+
+    def offer(self, measurement, device_id, t, value):
+        """Take a raw sample; returns the finest tier's points for the windows it closed."""
+        if measurement not in MEASUREMENTS:
+            return []
+        return [rollup_point(*window) for window in self.live.offer(measurement, device_id, t, value)]
+
+    def flux(self, index, start, stop=None):
+        """Flux that (re)computes tier `index` (not the finest) over [start, stop) from the tier below."""
+        tier = self.tiers[index]
+        names = " or ".join(f'r._measurement == "{name}"' for name in MEASUREMENTS)
+        stop = f", stop: {stop}" if stop else ""
+        query = f'''
+        data = from(bucket: "{self.tier_bucket(self.tiers[index - 1])}")
+          |> range(start: {start}{stop})
+          |> filter(fn: (r) => {names})
+        '''
+        streams = []
+        for field in FIELDS:
+            # Min of mins, mean of means and max of maxes: the windows below
+            # are all the same length, so the mean stays time-weighted.
+            query += f'''
+        {field}_rollup = data
+          |> filter(fn: (r) => r._field == "{field}")
+          |> aggregateWindow(every: {tier.every}s, fn: {field}, createEmpty: false)
+          |> set(key: "_field", value: "{field}")
+        '''
+            streams.append(f"{field}_rollup")
+        query += f'''
+        union(tables: [{", ".join(streams)}])
+          |> to(bucket: "{self.tier_bucket(tier)}", org: "{self.org}")
+        '''
+        return query
+
+    def task_flux(self, index):
+        tier = self.tiers[index]
+        header = f'option task = {{name: "{self._task_name(tier)}", every: {tier.every}s, offset: {TASK_OFFSET}s}}\n'
+        return header + self.flux(index, f"-{2 * tier.every}s")
+
+    def _task_name(self, tier):
+        return f"{self.bucket}_rollup_{tier.name}"
+
+    def provision(self):
+        """Create or update the tier buckets and the tasks of the coarser tiers."""
+        buckets_api = self.client.buckets_api()
+        tasks_api = self.client.tasks_api()
+        for index, tier in enumerate(self.tiers):
+            rules = BucketRetentionRules(type="expire", every_seconds=tier.retention)
+            bucket = buckets_api.find_bucket_by_name(self.tier_bucket(tier))
+            if bucket is None:
+                buckets_api.create_bucket(bucket_name=self.tier_bucket(tier), retention_rules=rules, org=self.org)
+            else:
+                # A bucket kept forever may have no retention rule at all.
+                current = bucket.retention_rules[0].every_seconds if bucket.retention_rules else 0
+                if current != tier.retention:
+                    bucket.retention_rules = [rules]
+                    buckets_api.update_bucket(bucket)
+
+            existing = tasks_api.find_tasks(name=self._task_name(tier))
+            if index == 0:
+                # The daemon writes the finest tier; drop a task left from
+                # when it was computed from the raw bucket.
+                for task in existing:
+                    tasks_api.delete_task(task.id)
+                continue
+            flux = self.task_flux(index)
+            if existing:
+                tasks_api.update_task_request(existing[0].id, TaskUpdateRequest(flux=flux, status="active"))
+            else:
+                tasks_api.create_task(task_create_request=TaskCreateRequest(org=self.org, flux=flux, status="active"))
+
+    def backfill(self, start, stop=None, chunk=timedelta(days=7)):
+        """Compute every tier over a past range, finest first, a chunk at a time."""
+        stop = stop or datetime.now(timezone.utc)
+        self._backfill_finest(start, stop, chunk)
+        query_api = self.client.query_api()
+        for index in range(1, len(self.tiers)):
+            chunk_start = start
+            while chunk_start < stop:
+                chunk_stop = min(chunk_start + chunk, stop)
+                query_api.query(org=self.org, query=self.flux(index, flux_time(chunk_start), flux_time(chunk_stop)))
+                chunk_start = chunk_stop
+
+    def _backfill_finest(self, start, stop, chunk):
+        tier = self.tiers[0]
+        # Stored swinging-door points are linear interpolation knots; the
+        # other series were stored on change and hold their value.
+        linear = [name for name in MEASUREMENTS if spec_from_env(name).method == "swinging_door"]
+        windows = TimeWeighted(tier.every, self.max_gap, linear)
+        query_api = self.client.query_api()
+        write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        names = " or ".join(f'r._measurement == "{flux_tag(name)}"' for name in MEASUREMENTS)
+        # Every series stores a point at least every max_gap, so starting that
+        # much earlier gives each one its value at `start`.
+        chunk_start = start - timedelta(seconds=self.max_gap)
+        while chunk_start < stop:
+            chunk_stop = min(chunk_start + chunk, stop)
+            query = f'''
+            from(bucket: "{self.bucket}")
+              |> range(start: {flux_time(chunk_start)}, stop: {flux_time(chunk_stop)})
+              |> filter(fn: (r) => ({names}) and r._field == "value")
+              |> group()
+              |> sort(columns: ["_time"])
+            '''
+            closed = []
+            for record in query_api.query_stream(org=self.org, query=query):
+                closed += windows.offer(record.get_measurement(), record.values.get("device_id"),
+                                        record.get_time().timestamp(), record.get_value())
+            if chunk_stop == stop:
+                closed += windows.flush(stop.timestamp())
+            points = [rollup_point(*window) for window in closed if window[2] > start.timestamp()]
+            if points:
+                write_api.write(bucket=self.tier_bucket(tier), org=self.org, record=points)
+            chunk_start = chunk_stop
+
+    def select(self, measurement, start, every, now=None):
+        """Coarsest tier with windows no longer than `every` seconds that still covers start, or None."""
+        if measurement not in MEASUREMENTS:
+            return None
+        now = now or datetime.now(timezone.utc)
+        age = (now - start).total_seconds()
+        chosen = None
+        for tier in self.tiers:
+            if tier.every <= every and (not tier.retention or age <= tier.retention):
+                chosen = tier
+        return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the Influx rollup tiers")
+    parser.add_argument("command", choices=["provision", "backfill"])
+    parser.add_argument("--start", default="-30d", help="backfill: start of the range")
+    parser.add_argument("--stop", default=None)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from repository.influx_repository import InfluxRepository
+    load_dotenv()
+    repository = InfluxRepository()
+    rollups = Rollups(repository.client, repository.bucket, repository.org)
+    try:
+        if args.command == "provision":
+            rollups.provision()
+        else:
+            rollups.backfill(parse_time(args.start), parse_time(args.stop))
+    finally:
+        repository.close()
+
+
+if __name__ == "__main__":
+    main()
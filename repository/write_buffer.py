@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger("scada.influx")
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class WriteBuffer:
+    """Bounded queue of points flushed to Influx in batches by a background thread.
+
+    Callers only ever touch the in-memory queue; the HTTP writes, retries and
+    backoff all happen on the flusher thread. When the queue is full the
+    overflow policy decides whether the oldest point is evicted, the new point
+    is discarded, or the caller blocks until the flusher makes room.
+    """
+
+    def __init__(self, write_api, bucket, org=None, batch_size=500, flush_interval=1.0,
+                 max_queue=10000, overflow=DROP_OLDEST, max_retries=5, retry_backoff=0.5,
+                 max_backoff=30.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._inflight = 0
+        self._running = True
+        self.write_observer = None  # called with the duration of each write request
+        self.counters = {
+            "points_queued": 0,
+            "points_written": 0,
+            "points_dropped": 0,
+            "batches_written": 0,
+            "batches_failed": 0,
+            "retries": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, point):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == DROP_NEWEST:
+                    self.counters["points_dropped"] += 1
+                    return False
+                if self.overflow == DROP_OLDEST:
+                    self._queue.popleft()
+                    self.counters["points_dropped"] += 1
+                else:
+                    while len(self._queue) >= self.max_queue and self._running:
+                        self._cond.wait()
+            self._queue.append(point)
+            self.counters["points_queued"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """Ask the flusher to send everything queued and wait until it is empty."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._queue or self._inflight) and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        self.flush(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["queue_depth"] = len(self._queue)
+        return stats
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while self._running and not self._flush_requested and len(self._queue) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            self._inflight = count
+            if not self._queue:
+                self._flush_requested = False
+            # Wake producers blocked on a full queue and flush() waiters.
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while self._running or self._queue:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._write_with_retry(batch)
+                finally:
+                    with self._cond:
+                        self._inflight = 0
+                        self._cond.notify_all()
+
+    def _write_with_retry(self, batch):
+        attempt = 0
+        while True:
+            try:
+                started = time.perf_counter()
+                self.write_api.write(bucket=self.bucket, org=self.org, record=batch)
+                if self.write_observer:
+                    self.write_observer(time.perf_counter() - started)
+                with self._cond:
+                    self.counters["points_written"] += len(batch)
+                    self.counters["batches_written"] += 1
+                return
+            except Exception as e:
+                if attempt >= self.max_retries or not self._running:
+                    log.error("dropping batch", extra={"points": len(batch), "retries": attempt, "error": e})
+                    with self._cond:
+                        self.counters["points_dropped"] += len(batch)
+                        self.counters["batches_failed"] += 1
+                    return
+                delay = min(self.max_backoff, self.retry_backoff * (2 ** attempt))
+                attempt += 1
+                with self._cond:
+                    self.counters["retries"] += 1
+                log.warning("write failed, retrying", extra={"retry": attempt, "delay": delay, "error": e})
+                time.sleep(delay)
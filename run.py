@@ -1,5 +1,32 @@
+import os
+
+# HTTP_SERVER=gevent (the default when gevent is installed) serves many
+# concurrent dashboard clients and long-lived /status streams on greenlets;
+# "werkzeug" is Flask's development server. gevent has to patch the standard
+# library before anything else imports it.
+#
+# Started on its own, this one process serves the API and runs the control
+# loop (SCADA_DAEMON=embedded). With SCADA_DAEMON=external, and for WSGI
+# servers running several workers off run:app, the control loop runs in its
+# own process instead: start python -m gpio_api.daemon next to them.
+if __name__ == "__main__":
+    os.environ.setdefault("SCADA_DAEMON", "embedded")
+HTTP_SERVER = os.getenv("HTTP_SERVER", "gevent")
+if __name__ == "__main__" and HTTP_SERVER == "gevent":
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+    except ImportError:
+        HTTP_SERVER = "werkzeug"
+
 from gpio_api import create_app
 app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    host = os.getenv("HTTP_HOST", "0.0.0.0")
+    port = int(os.getenv("HTTP_PORT", 5000))
+    if HTTP_SERVER == "gevent":
+        from gevent.pywsgi import WSGIServer
+        WSGIServer((host, port), app, log=None).serve_forever()
+    else:
+        app.run(host=host, port=port, threaded=True)
@@ -0,0 +1,78 @@
+"""Run a fleet of virtual devices against an MQTT broker.
+
+    python -m simulator --devices 50 --interval 1 --duration 60 --report
+"""
+import argparse
+import json
+import random
+import time
+
+from simulator.device import VirtualDevice
+from status_codec import ENCODINGS
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(devices, elapsed):
+    latencies = [latency for device in devices for latency in device.latencies]
+    return {
+        "devices": len(devices),
+        "elapsed": elapsed,
+        "published": sum(device.published for device in devices),
+        "commands": sum(device.commands for device in devices),
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated SCADA devices")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--prefix", default="sim")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--sensors", type=int, default=1)
+    parser.add_argument("--encoding", choices=ENCODINGS, default="json")
+    parser.add_argument("--time-scale", type=float, default=60.0)
+    parser.add_argument("--deadband", type=float, default=None,
+                        help="degrees C; IO.py's TEMP_DEADBAND if omitted, 0 publishes every sample")
+    parser.add_argument("--duration", type=float, default=None, help="seconds; run forever if omitted")
+    parser.add_argument("--report", action="store_true", help="print a JSON summary on exit")
+    args = parser.parse_args()
+
+    devices = [
+        VirtualDevice(f"{args.prefix}_{i}", args.broker, args.port, args.interval,
+                      args.sensors, args.encoding, args.time_scale,
+                      **({} if args.deadband is None else {"deadband": args.deadband}))
+        for i in range(args.devices)
+    ]
+    started = time.monotonic()
+    for device in devices:
+        device.plant.temperature = random.uniform(18, 30)
+        device.start()
+        # Spread the publish phases over the interval.
+        time.sleep(args.interval / max(1, args.devices))
+
+    try:
+        while args.duration is None or time.monotonic() - started < args.duration:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+    if args.report:
+        print(json.dumps(summarize(devices, time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+os.environ.setdefault("SCADA_SIMULATE", "1")
+
+import paho.mqtt.client as mqtt
+
+import IO
+from simulator.fake_gpio import FakeGPIO, HIGH, LOW
+from simulator.fake_w1 import FakeW1Bus
+from simulator.plant import ThermalPlant
+from spool import Spool
+
+
+class VirtualDevice(IO.Device):
+    """One simulated Raspberry Pi: GPIO, 1-Wire sensors, a room and an MQTT client.
+
+    It runs IO.py's own device loop (report policy, switch events, spool and
+    backlog) against a fake GPIO board and sysfs tree. time_scale runs the
+    room model faster than wall-clock time.
+    """
+
+    def __init__(self, device_id, broker="localhost", port=1883, interval=5.0,
+                 sensors=1, encoding="json", time_scale=1.0, plant=None, events=True,
+                 deadband=IO.TEMP_DEADBAND, spool_capacity=1000):
+        self.w1 = FakeW1Bus([f"28-{zlib.crc32(f'{device_id}:{i}'.encode()):012x}" for i in range(sensors)])
+        self.spool_dir = tempfile.mkdtemp(prefix="spool_")
+        super().__init__(
+            device_id,
+            mqtt.Client(client_id=device_id),
+            FakeGPIO(),
+            {sensor_id: os.path.join(self.w1.base_dir, sensor_id, "w1_slave") for sensor_id in self.w1.sensor_ids},
+            Spool(os.path.join(self.spool_dir, "status_spool.bin"), spool_capacity),
+            encoding,
+            IO.ReportPolicy(deadband=deadband, slow=interval, fast=min(IO.FAST_SAMPLE_INTERVAL, interval)),
+        )
+        self.broker = broker
+        self.port = port
+        self.events = events
+        self.time_scale = time_scale
+        self.plant = plant or ThermalPlant()
+        self.thread = threading.Thread(target=self.run, name=device_id, daemon=True)
+        self.stepped_at = None
+
+        self.last_publish = None
+        self.published = 0
+        self.commands = 0
+        self.latencies = []  # seconds from the latest status to each command
+        self.stop_latencies = []  # seconds from a window opening to the fans stopping
+        self.opened_at = None
+
+        self.setup_gpio()
+        for pin in IO.SWITCH_PINS:
+            self.gpio.set_input(pin, LOW)  # closed / pressed
+            self.reported_levels[pin] = LOW
+
+    def log(self, message):
+        pass
+
+    def set_switch(self, index, closed):
+        if not closed:  # an open window or door should stop the fans
+            self.opened_at = time.monotonic()
+        self.gpio.set_input(IO.SWITCH_PINS[index], LOW if closed else HIGH)
+
+    def speed(self):
+        return self.count_leds_on()
+
+    def report_switches(self, changed_at):
+        # Without events the daemon only sees switches in statuses.
+        if not self.events:
+            return False
+        return super().report_switches(changed_at)
+
+    def read_all_temperatures(self):
+        now = time.monotonic()
+        window_open = self.gpio.input(IO.SWITCH_PINS[0]) == HIGH
+        dt = (now - self.stepped_at) * self.time_scale if self.stepped_at is not None else 0.0
+        self.stepped_at = now
+        temperature = self.plant.step(dt, self.speed(), window_open)
+        for sensor_id in self.w1.sensor_ids:
+            self.w1.write(sensor_id, temperature)
+        return super().read_all_temperatures()
+
+    def publish_status(self, status):
+        super().publish_status(status)
+        self.last_publish = time.monotonic()
+        self.published += 1
+
+    def on_message(self, client, userdata, msg):
+        received = time.monotonic()
+        super().on_message(client, userdata, msg)
+        self.commands += 1
+        if self.last_publish is not None:
+            self.latencies.append(received - self.last_publish)
+
+    def report_stop_latency(self, speed):
+        if speed == 0 and self.opened_at is not None:
+            self.stop_latencies.append(time.monotonic() - self.opened_at)
+        self.opened_at = None
+        super().report_stop_latency(speed)
+
+    def start(self):
+        self.connect(self.broker, self.port)
+        self.thread.start()
+
+    def stop(self):
+        super().stop()
+        self.thread.join()
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.close()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
@@ -0,0 +1,98 @@
+"""Drop-in stand-in for the parts of RPi.GPIO that IO.py uses.
+
+The module-level functions drive a default FakeGPIO board so the module can
+replace RPi.GPIO for a single device; virtual devices each own a FakeGPIO.
+"""
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+
+class FakeGPIO:
+    def __init__(self):
+        self.levels = {}
+        self.modes = {}
+        self.events = {}  # pin -> [edge, callback, bouncetime (s), last fired]
+        self.lock = threading.Lock()
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+        with self.lock:
+            self.modes[pin] = direction
+            if direction == IN:
+                self.levels[pin] = HIGH if pull_up_down == PUD_UP else LOW
+            else:
+                self.levels[pin] = initial
+
+    def output(self, pins, values):
+        if not isinstance(pins, (list, tuple)):
+            pins, values = [pins], [values]
+        elif not isinstance(values, (list, tuple)):
+            values = [values] * len(pins)
+        with self.lock:
+            for pin, value in zip(pins, values):
+                self.levels[pin] = HIGH if value else LOW
+
+    def input(self, pin):
+        return self.levels.get(pin, LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            self.events[pin] = [edge, callback, (bouncetime or 0) / 1000, None]
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.events.pop(pin, None)
+
+    def set_input(self, pin, level):
+        """Simulate the outside world driving an input pin."""
+        with self.lock:
+            previous = self.levels.get(pin)
+            self.levels[pin] = level
+            event = self.events.get(pin)
+            if event is None or previous == level:
+                return
+            edge, callback, bouncetime, last = event
+            now = time.monotonic()
+            if edge != BOTH and edge != (RISING if level == HIGH else FALLING):
+                return
+            if last is not None and now - last < bouncetime:
+                return
+            event[3] = now
+        if callback:
+            # RPi.GPIO calls back on its own thread, not the one driving the pin.
+            threading.Thread(target=callback, args=(pin,), daemon=True).start()
+
+    def cleanup(self, *args):
+        with self.lock:
+            self.levels.clear()
+            self.modes.clear()
+            self.events.clear()
+
+
+board = FakeGPIO()
+setmode = board.setmode
+setwarnings = board.setwarnings
+setup = board.setup
+output = board.output
+input = board.input
+add_event_detect = board.add_event_detect
+remove_event_detect = board.remove_event_detect
+cleanup = board.cleanup
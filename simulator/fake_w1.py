@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+
+class FakeW1Bus:
+    """A directory laid out like /sys/bus/w1/devices with DS18B20 slaves."""
+
+    def __init__(self, sensor_ids, base_dir=None):
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix="w1_")
+        self.sensor_ids = list(sensor_ids)
+        for sensor_id in self.sensor_ids:
+            os.makedirs(os.path.join(self.base_dir, sensor_id), exist_ok=True)
+
+    def write(self, sensor_id, temperature, crc_ok=True):
+        lines = (
+            f"72 01 4b 46 7f ff 0e 10 57 : crc=57 {'YES' if crc_ok else 'NO'}\n"
+            f"72 01 4b 46 7f ff 0e 10 57 t={int(round(temperature * 1000))}\n"
+        )
+        path = os.path.join(self.base_dir, sensor_id, "w1_slave")
+        # Replace atomically so a concurrent reader never sees half a file.
+        with open(path + ".tmp", "w") as f:
+            f.write(lines)
+        os.replace(path + ".tmp", path)
+
+    @property
+    def glob_base(self):
+        return self.base_dir.rstrip("/") + "/"
@@ -0,0 +1,25 @@
+import random
+
+
+class ThermalPlant:
+    """First-order room model: heat leaks in from outside, the fan removes it.
+
+    dT/dt = leak * (outside - T) + load - cooling * speed
+
+    An open window multiplies the leak. Rates are per simulated second.
+    """
+
+    def __init__(self, temperature=24.0, outside=30.0, leak=0.002, load=0.01,
+                 cooling=0.02, window_leak_factor=5.0, noise=0.02):
+        self.temperature = temperature
+        self.outside = outside
+        self.leak = leak
+        self.load = load
+        self.cooling = cooling
+        self.window_leak_factor = window_leak_factor
+        self.noise = noise
+
+    def step(self, dt, speed, window_open=False):
+        leak = self.leak * (self.window_leak_factor if window_open else 1.0)
+        self.temperature += dt * (leak * (self.outside - self.temperature) + self.load - self.cooling * speed)
+        return self.temperature + random.gauss(0, self.noise)
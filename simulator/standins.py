@@ -0,0 +1,51 @@
+class NullInfluxRepository:
+    """Counts writes instead of sending them, for benchmarks without Influx."""
+
+    def __init__(self):
+        self.points = 0
+        self.write_observer = None
+        self.rollups = None
+
+    def write_if_changed(self, measurement, value, device_id=None):
+        self.points += 1
+
+    def write_temperature(self, temperature, device_id=None):
+        self.write_if_changed("temperature_data", temperature, device_id)
+
+    def write_windows_switch(self, state, device_id=None):
+        self.write_if_changed("windows_switch", state, device_id)
+
+    def write_present_switch(self, state, device_id=None):
+        self.write_if_changed("present_switch", state, device_id)
+
+    def write_fan_speed(self, speed, device_id=None):
+        self.write_if_changed("fan_speed", speed, device_id)
+
+    def write_backlog(self, device_id, statuses):
+        self.points += 4 * len(statuses)
+
+    def read_series_by_device(self, measurement, start="-1h"):
+        return {}
+
+    def write_stats(self):
+        return {"points_written": self.points}
+
+    def close(self):
+        pass
+
+
+class NullFanout:
+    def __init__(self):
+        self.emitted = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def publish_state(self, device_id, state):
+        self.emitted += 1
+
+    def publish_alarm(self, data):
+        self.emitted += 1
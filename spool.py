@@ -0,0 +1,110 @@
+"""Persistent ring buffer of encoded status records for store-and-forward.
+
+The spool is a memory-mapped file of fixed-size slots, so its size on disk
+never changes and a crash loses at most the record being written. Records are
+read from the head and only removed once the caller commits them, after the
+broker acknowledged the batch. When the spool is full the oldest record is
+overwritten.
+
+Layout (little-endian): a header of
+
+    4s  magic b"SCSP"
+    I   slot size
+    Q   capacity (slots)
+    Q   head: sequence number of the oldest record
+    Q   tail: sequence number of the next record
+    Q   records dropped because the spool was full
+
+followed by `capacity` slots of a 2-byte length and the record bytes.
+"""
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b"SCSP"
+_HEADER = struct.Struct("<4sIQQQQ")
+_LENGTH = struct.Struct("<H")
+
+
+class Spool:
+    def __init__(self, path, capacity=17280, slot_size=256):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        self._file.seek(0)
+        header = self._file.read(_HEADER.size)
+        stored = _HEADER.unpack(header) if len(header) == _HEADER.size else None
+        fresh = not (stored and stored[0] == MAGIC and stored[1] and stored[2])
+        if fresh:
+            self.head = self.tail = self.dropped = 0
+            self.slot_size, self.capacity = slot_size, capacity
+        else:
+            # An existing spool keeps its geometry so its records stay readable.
+            _, self.slot_size, self.capacity, self.head, self.tail, self.dropped = stored
+
+        # A new, foreign or cut-short file is sized to its slots before it is
+        # mapped: touching the map past the end of the file is a SIGBUS.
+        size = _HEADER.size + self.capacity * self.slot_size
+        self._file.seek(0, os.SEEK_END)
+        if fresh or self._file.tell() < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        if fresh:
+            self._write_header()
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def _write_header(self):
+        _HEADER.pack_into(self._map, 0, MAGIC, self.slot_size, self.capacity, self.head, self.tail, self.dropped)
+
+    def _offset(self, sequence):
+        return _HEADER.size + (sequence % self.capacity) * self.slot_size
+
+    def append(self, record):
+        if len(record) > self.slot_size - _LENGTH.size:
+            raise ValueError(f"Record of {len(record)} bytes does not fit a {self.slot_size} byte slot")
+        with self._lock:
+            if self.tail - self.head >= self.capacity:
+                self.head += 1
+                self.dropped += 1
+            offset = self._offset(self.tail)
+            _LENGTH.pack_into(self._map, offset, len(record))
+            self._map[offset + _LENGTH.size:offset + _LENGTH.size + len(record)] = record
+            self.tail += 1
+            self._write_header()
+            self._map.flush()
+
+    def peek(self, count):
+        """Up to count of the oldest records, and the sequence to commit after sending them."""
+        with self._lock:
+            end = min(self.tail, self.head + count)
+            records = []
+            for sequence in range(self.head, end):
+                offset = self._offset(sequence)
+                length = _LENGTH.unpack_from(self._map, offset)[0]
+                records.append(bytes(self._map[offset + _LENGTH.size:offset + _LENGTH.size + length]))
+            return records, end
+
+    def commit(self, sequence):
+        """Drop every record before sequence."""
+        with self._lock:
+            # Records overwritten while the batch was in flight already moved the head.
+            if sequence > self.head:
+                self.head = min(sequence, self.tail)
+                self._write_header()
+                self._map.flush()
+
+    def stats(self):
+        with self._lock:
+            return {"backlog": self.tail - self.head, "capacity": self.capacity, "dropped": self.dropped}
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
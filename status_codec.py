@@ -0,0 +1,191 @@
+"""Encoding of device status messages.
+
+Devices publish either the original JSON object or a compact binary frame.
+Binary frames start with a small version byte, JSON text never starts with a
+control character, so decode() tells them apart from the first byte.
+
+Binary v3 layout (little-endian):
+
+    B   version (3)
+    B   flags: bit0 switch_1 on, bit1 switch_2 on,
+        bit2 switch_1 unknown, bit3 switch_2 unknown (decoded as None)
+    B   leds_on
+    B   sensor count N
+    d   timestamp (unix seconds, with the fraction)
+    h   temperature_c in hundredths of a degree, -32768 = none
+    B   device_id length, then the UTF-8 bytes
+    N x (B sensor id length, sensor id bytes, h hundredths of a degree)
+
+v1, still decoded, is the same with the timestamp in whole seconds (I).
+
+A batch frame carries many binary records, e.g. a device's backlog after
+a reconnect:
+
+    B   version (2)
+    H   record count N
+    N x (H record length, record bytes)
+"""
+import json
+import struct
+from collections import namedtuple
+
+VERSION_1 = 1
+BATCH = 2
+VERSION_3 = 3
+NO_TEMPERATURE = -32768
+ENCODINGS = ("json", "binary")
+
+_HEADERS = {VERSION_1: struct.Struct("<BBBBIh"), VERSION_3: struct.Struct("<BBBBdh")}
+_TEMPERATURE = struct.Struct("<h")
+_BATCH = struct.Struct("<BH")
+_LENGTH = struct.Struct("<H")
+
+StatusRecord = namedtuple(
+    "StatusRecord",
+    ["device_id", "temperature_c", "leds_on", "switch_window", "switch_someone_present",
+     "timestamp", "sensors", "sensor_errors"],
+)
+
+
+def _centi(value):
+    return NO_TEMPERATURE if value is None else int(round(value * 100))
+
+
+def _degrees(value):
+    return None if value == NO_TEMPERATURE else value / 100
+
+
+def _switch_flags(state, bit):
+    """The on bit, or the unknown bit two above it for anything but "on"/"off"."""
+    if state == "on":
+        return 1 << bit
+    if state == "off":
+        return 0
+    return 1 << (bit + 2)
+
+
+def _switch_state(flags, bit):
+    if flags & (1 << (bit + 2)):
+        return None
+    return "on" if flags & (1 << bit) else "off"
+
+
+def encode_binary(record):
+    sensors = record.sensors or {}
+    errors = record.sensor_errors or {}
+    flags = _switch_flags(record.switch_window, 0) | _switch_flags(record.switch_someone_present, 1)
+    device_id = record.device_id.encode()
+    parts = [
+        _HEADERS[VERSION_3].pack(VERSION_3, flags, record.leds_on or 0, len(sensors) + len(errors),
+                                 float(record.timestamp or 0), _centi(record.temperature_c)),
+        bytes((len(device_id),)),
+        device_id,
+    ]
+    for sensor_id, value in list(sensors.items()) + [(sensor_id, None) for sensor_id in errors]:
+        encoded = sensor_id.encode()
+        parts.append(bytes((len(encoded),)))
+        parts.append(encoded)
+        parts.append(_TEMPERATURE.pack(_centi(value)))
+    return b"".join(parts)
+
+
+def encode_json(record):
+    return json.dumps({
+        "device_id": record.device_id,
+        "temperature_c": record.temperature_c,
+        "sensors": record.sensors or {},
+        "sensor_errors": record.sensor_errors or {},
+        "leds_on": record.leds_on,
+        "switches": {
+            "switch_1": record.switch_window,
+            "switch_2": record.switch_someone_present,
+        },
+        "timestamp": record.timestamp,
+    })
+
+
+def encode(record, encoding="json"):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown status encoding: {encoding}")
+    if encoding == "binary":
+        return encode_binary(record)
+    return encode_json(record)
+
+
+def _decode_binary(payload):
+    header = _HEADERS.get(payload[0])
+    if header is None:
+        raise ValueError(f"Unsupported status version: {payload[0]}")
+    version, flags, leds_on, count, timestamp, temperature = header.unpack_from(payload, 0)
+    offset = header.size
+    length = payload[offset]
+    device_id = payload[offset + 1:offset + 1 + length].decode()
+    offset += 1 + length
+
+    sensors, errors = {}, {}
+    for _ in range(count):
+        length = payload[offset]
+        sensor_id = payload[offset + 1:offset + 1 + length].decode()
+        offset += 1 + length
+        value = _degrees(_TEMPERATURE.unpack_from(payload, offset)[0])
+        offset += _TEMPERATURE.size
+        if value is None:
+            errors[sensor_id] = "error"
+        else:
+            sensors[sensor_id] = value
+
+    return StatusRecord(
+        device_id=device_id,
+        temperature_c=_degrees(temperature),
+        leds_on=leds_on,
+        switch_window=_switch_state(flags, 0),
+        switch_someone_present=_switch_state(flags, 1),
+        timestamp=timestamp,
+        sensors=sensors,
+        sensor_errors=errors,
+    )
+
+
+def _decode_json(payload):
+    status = json.loads(payload)
+    switches = status.get("switches", {})
+    return StatusRecord(
+        device_id=status.get("device_id"),
+        temperature_c=status.get("temperature_c"),
+        leds_on=status.get("leds_on"),
+        switch_window=switches.get("switch_1"),
+        switch_someone_present=switches.get("switch_2"),
+        timestamp=status.get("timestamp"),
+        sensors=status.get("sensors") or {},
+        sensor_errors=status.get("sensor_errors") or {},
+    )
+
+
+def decode(payload):
+    """Decode a status message in any supported encoding into a StatusRecord."""
+    if payload and payload[0] < 0x20 and payload[0] not in b"\t\n\r":
+        return _decode_binary(payload)
+    return _decode_json(payload)
+
+
+def encode_batch(frames):
+    """Pack already encoded binary records into one batch frame."""
+    parts = [_BATCH.pack(BATCH, len(frames))]
+    for frame in frames:
+        parts.append(_LENGTH.pack(len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+
+def decode_batch(payload):
+    version, count = _BATCH.unpack_from(payload, 0)
+    if version != BATCH:
+        raise ValueError(f"Not a batch frame: version {version}")
+    offset = _BATCH.size
+    records = []
+    for _ in range(count):
+        length = _LENGTH.unpack_from(payload, offset)[0]
+        offset += _LENGTH.size
+        records.append(_decode_binary(payload[offset:offset + length]))
+        offset += length
+    return records
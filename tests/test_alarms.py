@@ -0,0 +1,82 @@
+from gpio_api.alarms import AlarmEngine
+from status_codec import StatusRecord
+
+HIGH = {"name": "high", "field": "temperature_c", "kind": "above", "value": 25.0,
+        "hysteresis": 1.0, "debounce": 2}
+WINDOW = {"name": "window_open", "field": "switch_window", "kind": "equals", "value": "off"}
+
+
+def status(temperature, switch_window="on", device_id="dev"):
+    return StatusRecord(device_id, temperature, 0, switch_window, "on", 0.0, {}, {})
+
+
+def fired(events):
+    return [(event["device_id"], event["rule"]) for event in events]
+
+
+def test_debounce_counts_a_devices_samples_in_batch_order():
+    engine = AlarmEngine([HIGH])
+
+    events = engine.evaluate_batch([("a", status(26.0)), ("a", status(27.0))], 20.0)
+
+    assert fired(events) == [("a", "high")]
+    assert engine.active("a") == ["high"]
+
+
+def test_interrupted_streak_does_not_fire():
+    engine = AlarmEngine([HIGH])
+
+    events = engine.evaluate_batch(
+        [("a", status(26.0)), ("a", status(24.0)), ("a", status(26.0))], 20.0)
+
+    assert events == []
+    assert engine.active("a") == []
+
+
+def test_devices_in_one_batch_are_independent():
+    engine = AlarmEngine([HIGH])
+
+    events = engine.evaluate_batch(
+        [("a", status(26.0)), ("b", status(26.0)), ("b", status(20.0)), ("a", status(26.0))], 20.0)
+
+    assert fired(events) == [("a", "high")]
+    assert engine.active("b") == []
+
+
+def test_latched_alarm_clears_only_below_hysteresis_band():
+    engine = AlarmEngine([HIGH])
+    engine.evaluate_batch([("a", status(26.0)), ("a", status(26.0))], 20.0)
+
+    # Inside the band: stays latched and does not fire again.
+    assert engine.evaluate_batch([("a", status(24.5)), ("a", status(26.0)), ("a", status(26.0))], 20.0) == []
+    assert engine.active("a") == ["high"]
+
+    engine.evaluate_batch([("a", status(23.9))], 20.0)
+    assert engine.active("a") == []
+
+    events = engine.evaluate_batch([("a", status(26.0)), ("a", status(26.0))], 20.0)
+    assert fired(events) == [("a", "high")]
+
+
+def test_clear_and_refire_within_one_batch():
+    engine = AlarmEngine([WINDOW])
+
+    events = engine.evaluate_batch(
+        [("a", status(20.0, "off")), ("a", status(20.0, "on")), ("a", status(20.0, "off"))], 20.0)
+
+    assert fired(events) == [("a", "window_open"), ("a", "window_open")]
+
+
+def test_relative_threshold_follows_target():
+    engine = AlarmEngine([dict(HIGH, value=5.0, relative_to_target=True, debounce=1)])
+
+    assert engine.evaluate_batch([("a", status(26.0))], 22.0) == []
+    assert fired(engine.evaluate_batch([("a", status(26.0))], 20.0)) == [("a", "high")]
+
+
+def test_missing_reading_neither_fires_nor_clears():
+    engine = AlarmEngine([dict(HIGH, debounce=1)])
+    engine.evaluate_batch([("a", status(26.0))], 20.0)
+
+    assert engine.evaluate_batch([("a", status(None))], 20.0) == []
+    assert engine.active("a") == ["high"]
@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+
+from replay.engine import History, _hold
+from repository.compression import Historian, Spec
+from repository.influx_repository import InfluxRepository
+
+BOUND = 0.1
+
+
+def compressed_temperatures():
+    historian = Historian({"temperature_data": Spec("swinging_door", BOUND)}, max_interval=900)
+    times = np.arange(0.0, 3600.0, 5.0)
+    raw = 22.0 + 2.0 * np.sin(times / 600.0) + 0.03 * np.sign(np.sin(times / 35.0))
+    stored = []
+    for t, value in zip(times, raw):
+        stored += historian.offer("temperature_data", "dev", float(t), float(value))
+    stored += [(t, value) for _, _, t, value in historian.flush()]
+    return times, raw, stored
+
+
+def test_replay_reconstructs_compressed_temperatures_within_bound():
+    times, raw, stored = compressed_temperatures()
+    assert len(stored) < len(times) / 4
+
+    history = History({"temperature_data": stored}, step=5.0)
+
+    assert np.array_equal(history.times, times)
+    assert np.max(np.abs(history.temperature - raw)) <= BOUND + 1e-9
+    # Holding the stored points instead would not stay within the bound.
+    held = _hold([t for t, _ in stored], [v for _, v in stored], times, math.nan)
+    assert np.max(np.abs(held - raw)) > BOUND
+
+
+def test_replay_holds_step_series_between_points():
+    history = History({
+        "temperature_data": [(0.0, 20.0), (100.0, 30.0)],
+        "fan_speed": [(0.0, 0), (50.0, 3)],
+        "windows_switch": [(0.0, "on"), (60.0, "off")],
+    }, step=10.0)
+
+    assert history.temperature[3] == 23.0
+    assert list(history.fan_speed) == [0, 0, 0, 0, 0, 3, 3, 3, 3, 3, 3]
+    assert list(history.window_open) == [False] * 6 + [True] * 5
+
+
+class CollectingBuffer:
+    def __init__(self):
+        self.points = []
+
+    def put(self, point):
+        self.points.append(point)
+
+
+def test_buffered_points_keep_their_sample_time():
+    repository = InfluxRepository(url="http://localhost:1", bucket="test", org="test", write_mode="sync")
+    repository.write_buffer = CollectingBuffer()
+
+    sampled_at = 1700000000.25
+    repository._write_at("temperature_data", 21.5, "dev", sampled_at)
+
+    [point] = repository.write_buffer.points
+    assert point.to_line_protocol().endswith(f" {int(sampled_at * 1e9)}")
@@ -0,0 +1,54 @@
+import threading
+
+from gpio_api.device_table import DeviceState
+from status_codec import StatusRecord
+
+
+def status(switch_window, timestamp):
+    return StatusRecord("dev", 21.0, 0, switch_window, "off", timestamp, {}, {})
+
+
+def test_status_older_than_switch_event_keeps_event_switches():
+    device = DeviceState("dev")
+    device.apply_switch_event("on", "on", 100.5)
+    device.update(status("off", 100.2))
+
+    assert device.switch_window == "on"
+    assert device.current_temperature == 21.0
+
+
+def test_whole_second_status_compares_at_second_resolution():
+    device = DeviceState("dev")
+    device.apply_switch_event("on", "on", 100.5)
+    device.update(status("off", 100))
+
+    assert device.switch_window == "off"
+
+
+def test_redelivered_event_does_not_overwrite_newer_status():
+    device = DeviceState("dev")
+    device.update(status("off", 200.0))
+    device.apply_switch_event("on", "on", 150.0)
+
+    assert device.switch_window == "off"
+
+
+def test_concurrent_events_and_statuses_keep_newest_switches():
+    device = DeviceState("dev")
+
+    def statuses():
+        for n in range(2000):
+            device.update(status("off", float(n)))
+
+    def events():
+        for n in range(2000):
+            device.apply_switch_event("on", "on", n + 0.5)
+
+    threads = [threading.Thread(target=statuses), threading.Thread(target=events)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert device.switches_at == 1999.5
+    assert device.switch_window == "on"
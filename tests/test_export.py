@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from repository.export import export_rows, last_csv_cursor, parse_cursor, write_csv
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+STOP = START + timedelta(hours=4)
+
+
+class FakeRepository:
+    """stream_raw over a fixed list of rows, in export order."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: (row[0], row[1], row[2] or ""))
+        self.queries = []
+
+    def stream_raw(self, measurements, start, stop, device_id=None):
+        self.queries.append((start, stop))
+        for row in self.rows:
+            if start <= row[0] < stop and row[1] in measurements and device_id in (None, row[2]):
+                yield row
+
+
+def sample_rows():
+    rows = []
+    for minute in range(0, 240, 20):
+        t = START + timedelta(minutes=minute)
+        rows.append((t, "temperature_data", "dev_a", 20.0 + minute / 60))
+        rows.append((t, "temperature_data", "dev_b", 21.0))
+        rows.append((t, "windows_switch", "dev_a", "on"))
+    return rows
+
+
+MEASUREMENTS = ("temperature_data", "windows_switch")
+
+
+def test_rows_are_read_chunk_by_chunk_without_overlap():
+    repository = FakeRepository(sample_rows())
+
+    rows = list(export_rows(repository, MEASUREMENTS, START, STOP, chunk=timedelta(hours=1)))
+
+    assert rows == repository.rows
+    assert len(repository.queries) == 4
+    assert all(a[1] == b[0] for a, b in zip(repository.queries, repository.queries[1:]))
+
+
+def test_cursor_resumes_after_the_last_row_within_a_timestamp():
+    repository = FakeRepository(sample_rows())
+    time, measurement, device_id, _ = repository.rows[4]  # dev_b's temperature, between two rows at its time
+
+    rows = list(export_rows(repository, MEASUREMENTS, START, STOP, chunk=timedelta(hours=1),
+                            cursor=f"{time.isoformat()}/{measurement}/{device_id}"))
+
+    assert rows == repository.rows[5:]
+    # Chunks start at the cursor, not at the start of the range.
+    assert repository.queries[0][0] == time
+
+
+def test_parse_cursor():
+    assert parse_cursor("2024-01-01T00:20:00+00:00/windows_switch/") == (
+        START + timedelta(minutes=20), "windows_switch", "")
+
+
+def test_interrupted_csv_export_resumes_from_its_last_complete_row(tmp_path):
+    repository = FakeRepository(sample_rows())
+    path = str(tmp_path / "export.csv")
+    full = str(tmp_path / "full.csv")
+    write_csv(export_rows(repository, MEASUREMENTS, START, STOP), full)
+
+    rows = export_rows(repository, MEASUREMENTS, START, STOP, chunk=timedelta(hours=1))
+    write_csv((row for _, row in zip(range(10), rows)), path)
+    with open(path, "a") as f:
+        f.write("2024-01-01T01:")  # torn by the interruption
+
+    cursor = last_csv_cursor(path)
+    count = write_csv(export_rows(repository, MEASUREMENTS, START, STOP, chunk=timedelta(hours=1),
+                                  cursor=cursor), path, append=True)
+
+    assert count == len(repository.rows) - 10
+    with open(path) as resumed, open(full) as expected:
+        assert resumed.read() == expected.read()
+
+
+def test_cursor_of_header_only_export_is_none(tmp_path):
+    path = str(tmp_path / "export.csv")
+    write_csv(iter(()), path)
+
+    assert last_csv_cursor(path) is None
+
+
+@pytest.mark.parametrize("chunk", [timedelta(0), timedelta(hours=-1)])
+def test_non_positive_chunk_is_rejected_up_front(chunk):
+    with pytest.raises(ValueError):
+        export_rows(FakeRepository([]), MEASUREMENTS, START, STOP, chunk=chunk)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from gpio_api.pid_engine import PIDEngine
+
+
+def settled_engine(Kp=2.0, Ki=0.5, Kd=1.0, setpoint=22.0, measurement=20.0, steps=10):
+    engine = PIDEngine()
+    engine.add_zone("zone", Kp, Ki, Kd, setpoint)
+    index = engine.indices(["zone"])
+    output = None
+    for _ in range(steps):
+        output = engine.step(index, [measurement], 1.0)
+    return engine, index, output[0]
+
+
+def test_output_continuous_when_ki_set_to_zero():
+    engine, index, before = settled_engine()
+    assert before != pytest.approx(2.0 * 2.0)  # the integral term is doing work
+
+    engine.set_gains(2.0, 0.0, 1.0)
+    after = engine.step(index, [20.0], 1.0)[0]
+
+    # Same error, no derivative, nothing integrated with Ki = 0: the output holds.
+    assert after == pytest.approx(before)
+
+
+def test_output_continuous_across_gain_change():
+    engine, index, before = settled_engine()
+
+    engine.set_gains(4.0, 1.5, 0.0)
+    after = engine.step(index, [20.0], 1.0)[0]
+
+    # Only the new Ki's integration of the error over the step moves it.
+    assert after == pytest.approx(before + 1.5 * 2.0 * 1.0)
+
+
+def test_output_continuous_across_setpoint_change():
+    engine, index, before = settled_engine()
+
+    engine.set_setpoint(23.0)
+    after = engine.step(index, [20.0], 1.0)[0]
+
+    assert after == pytest.approx(before + 0.5 * 3.0 * 1.0)
+
+
+def test_gains_before_first_step_start_from_zero():
+    engine = PIDEngine()
+    engine.add_zone("zone", 1.0, 0.1, 0.0, 22.0)
+    engine.set_gains(2.0, 0.0, 0.0)
+    output = engine.step(engine.indices(["zone"]), [20.0], 1.0)
+    assert np.allclose(output, [4.0])
+
+
+def test_setpoint_change_moves_output_without_integral_action():
+    engine, index, before = settled_engine(Ki=0.0, Kd=0.0)
+    assert before == pytest.approx(4.0)
+
+    engine.set_setpoint(30.0)
+    after = engine.step(index, [20.0], 1.0)[0]
+
+    assert after == pytest.approx(2.0 * 10.0)
+
+
+def test_gain_change_moves_output_without_integral_action():
+    engine, index, before = settled_engine(Ki=0.0, Kd=0.0)
+
+    engine.set_gains(5.0, 0.0, 0.0)
+    after = engine.step(index, [20.0], 1.0)[0]
+
+    assert after == pytest.approx(5.0 * 2.0)
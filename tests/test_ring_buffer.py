@@ -0,0 +1,63 @@
+import random
+import threading
+import time
+
+from repository.ring_buffer import HistoryCache, RingBuffer
+
+
+def test_late_sample_is_inserted_in_order():
+    buffer = RingBuffer(8)
+    for t in (1.0, 2.0, 4.0, 5.0):
+        buffer.append(t, t)
+    assert buffer.append(3.0, 3.0)
+    assert [t for t, _ in buffer.range(0, 10)] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_late_sample_in_full_wrapped_buffer_evicts_oldest():
+    buffer = RingBuffer(4)
+    for t in range(1, 7):  # wraps: holds 3, 4, 5, 6
+        buffer.append(float(t), float(t))
+    assert buffer.append(4.5, 4.5)
+    assert buffer.range(0, 10) == [(4.0, 4.0), (4.5, 4.5), (5.0, 5.0), (6.0, 6.0)]
+    # Older than anything a full buffer holds: left out and counted.
+    assert not buffer.append(1.0, 1.0)
+    assert buffer.dropped == 1
+
+
+def test_concurrent_writers_keep_merged_series_complete_and_ordered():
+    cache = HistoryCache(capacity=10000)
+    cache.complete_since = 0
+    start = time.time()
+
+    def writer(device_id):
+        for i in range(500):
+            # Timestamps taken before the call, like the ingest workers do,
+            # so the merged series sees them slightly out of order.
+            t = start + i * 0.01 + random.uniform(0, 0.005)
+            cache.record("temperature_data", device_id, t, 20.0)
+
+    threads = [threading.Thread(target=writer, args=(f"dev{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = cache.buffers[("temperature_data", None)].range(0, start + 100)
+    times = [t for t, _ in merged]
+    assert len(times) == 2000
+    assert times == sorted(times)
+    assert cache.covered_from("temperature_data", None) == 0
+    assert cache.query("temperature_data", "-1h", stop="now") is not None
+
+
+def test_backlog_marks_only_its_device_incomplete():
+    cache = HistoryCache(capacity=100)
+    cache.complete_since = 0
+    now = time.time()
+    cache.mark_incomplete("dev1", now)
+
+    assert cache.covered_from("temperature_data", "dev1") == now
+    assert cache.covered_from("temperature_data", None) == now
+    assert cache.covered_from("temperature_data", "dev2") == 0
+    assert cache.query("temperature_data", "-1h", device_id="dev2") is not None
+    assert cache.query("temperature_data", "-1h", device_id="dev1") is None
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from spool import Spool, _HEADER
+
+
+def records(count, start=0):
+    return [f"status {n}".encode() for n in range(start, start + count)]
+
+
+def test_wraparound_drops_oldest(tmp_path):
+    spool = Spool(str(tmp_path / "spool.bin"), capacity=4, slot_size=32)
+    for record in records(6):
+        spool.append(record)
+
+    assert len(spool) == 4
+    assert spool.stats() == {"backlog": 4, "capacity": 4, "dropped": 2}
+    assert spool.peek(10) == (records(4, start=2), 6)
+    spool.close()
+
+
+def test_commit_after_records_overwritten_in_flight(tmp_path):
+    spool = Spool(str(tmp_path / "spool.bin"), capacity=4, slot_size=32)
+    for record in records(4):
+        spool.append(record)
+    frames, end = spool.peek(2)
+    for record in records(3, start=4):  # overwrites 0, 1 and 2 while 0 and 1 are being sent
+        spool.append(record)
+    spool.commit(end)
+
+    assert spool.peek(10) == (records(4, start=3), 7)
+    spool.close()
+
+
+def test_replay_after_restart(tmp_path):
+    path = str(tmp_path / "spool.bin")
+    spool = Spool(path, capacity=8, slot_size=32)
+    for record in records(5):
+        spool.append(record)
+    _, end = spool.peek(2)
+    spool.commit(end)
+    spool.close()
+
+    # Reopened with other arguments: the file's geometry wins.
+    spool = Spool(path, capacity=100, slot_size=64)
+    assert (spool.capacity, spool.slot_size) == (8, 32)
+    assert spool.peek(10) == (records(3, start=2), 5)
+    spool.append(b"after restart")
+    assert spool.peek(10)[0][-1] == b"after restart"
+    spool.close()
+
+
+def test_truncated_file_is_resized(tmp_path):
+    path = str(tmp_path / "spool.bin")
+    spool = Spool(path, capacity=8, slot_size=32)
+    for record in records(2):
+        spool.append(record)
+    spool.close()
+    with open(path, "r+b") as f:
+        f.truncate(_HEADER.size + 32)  # only the first slot survives
+
+    spool = Spool(path, capacity=8, slot_size=32)
+    assert os.path.getsize(path) == _HEADER.size + 8 * 32
+    assert len(spool) == 2
+    # Slots past the end of the file read back empty instead of faulting.
+    assert spool.peek(10) == ([b"status 0", b""], 2)
+    for record in records(8, start=2):
+        spool.append(record)
+    assert spool.peek(10)[0] == records(8, start=2)
+    spool.close()
+
+
+def test_foreign_file_starts_a_fresh_spool(tmp_path):
+    path = str(tmp_path / "spool.bin")
+    with open(path, "wb") as f:
+        f.write(b"not a spool")
+
+    spool = Spool(path, capacity=4, slot_size=32)
+    assert len(spool) == 0
+    assert os.path.getsize(path) == _HEADER.size + 4 * 32
+    spool.append(b"first")
+    spool.close()
+
+    assert Spool(path).peek(1) == ([b"first"], 1)
+
+
+def test_oversized_record_is_rejected(tmp_path):
+    spool = Spool(str(tmp_path / "spool.bin"), capacity=4, slot_size=32)
+    with pytest.raises(ValueError):
+        spool.append(b"x" * 31)
+    assert len(spool) == 0
+    spool.close()